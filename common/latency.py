@@ -0,0 +1,21 @@
+"""
+Latency samples of nki.benchmark runs, shared by part1/sweep.py and
+part2/results_store.py.
+"""
+
+import numpy as np
+
+
+def latency_samples(nc_latency):
+    """
+    Raw per-iteration latencies (μs) of an nki.benchmark run, or None when the
+    result carries no `latency_list`.
+
+    Percentiles are not a substitute: p1 is not the minimum, and 99 of them
+    are not 99 independent samples, so callers that need samples should report
+    the statistic as unavailable instead.
+    """
+    latencies = getattr(nc_latency, "latency_list", None)
+    if latencies is None:
+        return None
+    return np.asarray(latencies, dtype=np.float64)
@@ -0,0 +1,108 @@
+"""
+Process pool for running correctness cases ahead of the timed benchmarks,
+shared by part1/run_benchmark.py and part2/test_harness.py.
+
+NKI's baremetal wrapper compiles and executes in a single call, so the unit of
+work handed to the pool is a whole correctness case. Each worker pins itself
+to its own NeuronCores through NEURON_RT_VISIBLE_CORES, so their compilations
+run in parallel and their short executions never share a core. The cores
+before `first_core` are left to the main process, which keeps running the
+timed benchmarks one at a time.
+
+The pool is clamped to the NeuronCores this process may use (the
+NEURON_RT_VISIBLE_CORES it was started with, or every core neuron-ls lists),
+so no worker is handed a core past the end of the device. Compilation is
+CPU-bound, so the pool is also clamped to the CPUs this process may run on
+(os.sched_getaffinity), keeping one of them for the main process, and each
+worker is pinned to its own CPU from that set.
+"""
+
+import json
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+
+def parse_core_list(spec):
+    """NeuronCore ids in a NEURON_RT_VISIBLE_CORES value, e.g. "0-3" or "0,2,5-7"."""
+    cores = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def format_core_list(cores):
+    """Inverse of parse_core_list: "4" or "4-7" for consecutive ids, else "4,6"."""
+    if len(cores) == 1:
+        return str(cores[0])
+    if cores == list(range(cores[0], cores[-1] + 1)):
+        return f"{cores[0]}-{cores[-1]}"
+    return ",".join(str(core) for core in cores)
+
+
+def visible_neuron_cores():
+    """
+    NeuronCore ids this process may use, or None when they cannot be
+    determined (no NEURON_RT_VISIBLE_CORES and no neuron-ls, e.g. --simulate
+    on a host without a device).
+    """
+    spec = os.environ.get("NEURON_RT_VISIBLE_CORES")
+    if spec:
+        return parse_core_list(spec)
+    try:
+        listing = subprocess.run(
+            ["neuron-ls", "--json-output"], capture_output=True, text=True, check=True
+        ).stdout
+        return list(range(sum(device["nc_count"] for device in json.loads(listing))))
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _pin_core(slots):
+    neuron_cores, cpu = slots.get()
+    os.environ["NEURON_RT_VISIBLE_CORES"] = neuron_cores
+    os.sched_setaffinity(0, {cpu})
+
+
+def make_compile_pool(jobs, first_core=1, cores_per_job=1):
+    """
+    Pool of up to `jobs` workers, each owning `cores_per_job` consecutive
+    NeuronCores (for SPMD launches) starting at core `first_core`, and one CPU.
+    Core indices count from the first visible NeuronCore.
+
+    Fewer workers are started when fewer NeuronCores or CPUs are available;
+    the pool's `_max_workers` is the number actually started.
+    """
+    cores = visible_neuron_cores()
+    if cores is None:
+        cores = list(range(first_core + jobs * cores_per_job))
+    core_jobs = (len(cores) - first_core) // cores_per_job
+    if core_jobs < 1:
+        raise ValueError(
+            f"--jobs needs {cores_per_job} NeuronCore(s) per worker after the "
+            f"{first_core} kept by the main process, but only {len(cores)} are visible"
+        )
+
+    cpus = sorted(os.sched_getaffinity(0))
+    jobs = max(1, min(jobs, core_jobs, len(cpus) - 1))
+
+    # fork, so workers inherit the entry script's module state (e.g. the simulate wrapper)
+    ctx = multiprocessing.get_context("fork")
+    slots = ctx.Queue()
+    for job in range(jobs):
+        first = first_core + job * cores_per_job
+        neuron_cores = format_core_list(cores[first:first + cores_per_job])
+        # cpus[0] stays with the main process
+        slots.put((neuron_cores, cpus[(job + 1) % len(cpus)]))
+    return ProcessPoolExecutor(
+        max_workers=jobs, mp_context=ctx, initializer=_pin_core, initargs=(slots,)
+    )
+
+
+def run_ordered(pool, fn, cases):
+    """Submit fn(*case) for every case up front, then yield results in case order."""
+    futures = [pool.submit(fn, *case) for case in cases]
+    for future in futures:
+        yield future.result()
@@ -1 +1 @@
-tar -czvf asst4.tar.gz part1/kernels.py part2/conv2d.py
\ No newline at end of file
+tar -czvf asst4.tar.gz part1/kernels.py part2/conv2d.py part2/conv_shape.py
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+Tile-size autotuning for the Part 1 streaming kernels and the gemm kernel.
+
+Candidate `row_chunk` / `free_dim` values (and `tiles_m` / `tiles_n` output
+blocks for the gemm) are generated for a given size and pruned against the
+hardware limits before anything is compiled. The winner for each (kernel, n,
+dtype) is stored in a JSON tuning database, from which run_benchmark.py picks
+up the parameters on later runs.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# The maximum size of the partition dimension
+PARTITION_DIM = 128
+
+# Bytes of SBUF available to each of the 128 partitions (24 MiB / 128)
+SBUF_PARTITION_BYTES = 192 * 1024
+
+# Maximum free-dimension size of a single vector engine instruction
+MAX_FREE_DIM = 64 * 1024
+
+# PSUM banks per partition, each holding one 128 x 512 fp32 matmul output tile
+PSUM_BANKS = 8
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tuning_db.json")
+
+
+def divisors(n):
+    small = [d for d in range(1, int(n**0.5) + 1) if n % d == 0]
+    return sorted(set(small + [n // d for d in small]))
+
+
+def tiled_candidates(n, dtype=np.float32):
+    """Legal `row_chunk` values for vector_add_tiled: chunks that divide n and fit the partitions."""
+    return [{"row_chunk": d} for d in divisors(n) if d <= PARTITION_DIM]
+
+
+def stream_candidates(n, dtype=np.float32):
+    """
+    Legal `free_dim` values for vector_add_stream.
+
+    Any width is correct, since the kernel finishes with a narrower tile, but
+    only divisors of n // PARTITION_DIM avoid that extra tile, so those are the
+    candidates. The a, b and result tiles must fit in one partition's share of
+    SBUF together.
+    """
+    if n < PARTITION_DIM:
+        return []
+    itemsize = np.dtype(dtype).itemsize
+    return [
+        {"free_dim": d}
+        for d in divisors(n // PARTITION_DIM)
+        if d <= MAX_FREE_DIM and 3 * d * itemsize <= SBUF_PARTITION_BYTES
+    ]
+
+
+def gemm_max_block_tiles(transpose_a=False, transpose_b=False):
+    """
+    PSUM tiles a matmul_tiled output block may use. An operand that is not
+    K-major (a without transpose_a, or b with transpose_b) is transposed
+    through PSUM, which keeps one bank free; the same limit as the kernel's
+    assertion.
+    """
+    return PSUM_BANKS if transpose_a and not transpose_b else PSUM_BANKS - 1
+
+
+def gemm_candidates(n, dtype=np.float32, transpose_a=False, transpose_b=False):
+    """Legal `tiles_m` / `tiles_n` output blocks for matmul_tiled: every block that fits PSUM."""
+    max_tiles = gemm_max_block_tiles(transpose_a, transpose_b)
+    return [
+        {"tiles_m": tiles_m, "tiles_n": tiles_n}
+        for tiles_m in range(1, max_tiles + 1)
+        for tiles_n in range(1, max_tiles // tiles_m + 1)
+    ]
+
+
+candidates_by_kernel = {
+    "tiled": tiled_candidates,
+    "stream": stream_candidates,
+    "gemm": gemm_candidates,
+}
+
+
+class TuningDB:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(kernel_name, n, dtype):
+        return f"{kernel_name}:{n}:{np.dtype(dtype).name}"
+
+    def lookup(self, kernel_name, n, dtype):
+        """Return the stored kernel parameters, or None if this point was never tuned."""
+        entry = self.entries.get(self.key(kernel_name, n, dtype))
+        return entry["params"] if entry is not None else None
+
+    def store(self, kernel_name, n, dtype, params, p99_us, results):
+        self.entries[self.key(kernel_name, n, dtype)] = {
+            "params": params,
+            "p99_us": p99_us,
+            "candidates": results,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,129 @@
+"""
+Expression front end for kernels.fused_elementwise_stream, and its NumPy
+reference.
+
+parse_expression turns an elementwise expression such as "a * b + c",
+"relu(a + bias)" or "alpha * x + y" into the program the kernel evaluates on
+every tile, a tree of nested tuples:
+    ("input", i)              the i-th array passed to the kernel
+    ("const", value)          a compile-time scalar
+    ("binop", op, lhs, rhs)   op one of BINARY_OPS
+    ("call", fn, arg)         fn one of UNARY_FUNCTIONS
+Names bound in `scalars` become constants, and constant subexpressions are
+folded on the host, so the kernel only issues instructions that touch data.
+"""
+
+import ast
+import math
+
+import numpy as np
+
+# The kernel takes at most this many arrays (x0..x3)
+MAX_INPUTS = 4
+
+OPERATORS = {
+    ast.Add: "add",
+    ast.Sub: "subtract",
+    ast.Mult: "multiply",
+    ast.Div: "divide",
+}
+
+NUMPY_BINARY_OPS = {
+    "add": np.add,
+    "subtract": np.subtract,
+    "multiply": np.multiply,
+    "divide": np.divide,
+    "maximum": np.maximum,
+    "minimum": np.minimum,
+}
+BINARY_OPS = tuple(NUMPY_BINARY_OPS)
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+NUMPY_UNARY_FUNCTIONS = {
+    "relu": lambda x: np.maximum(x, 0),
+    "exp": np.exp,
+    "tanh": np.tanh,
+    "sqrt": np.sqrt,
+    "sigmoid": _sigmoid,
+    "silu": lambda x: x * _sigmoid(x),
+    "gelu": lambda x: 0.5 * x * (1 + np.vectorize(math.erf, otypes=[np.float64])(x / math.sqrt(2))),
+}
+UNARY_FUNCTIONS = tuple(NUMPY_UNARY_FUNCTIONS)
+
+
+def parse_expression(expr, scalars=None):
+    """
+    Compile `expr` for fused_elementwise_stream.
+
+    Returns (names, program): the names of the array inputs, in the order
+    the kernel takes them (first appearance in `expr`), and the program.
+    """
+    names = []
+    program = _to_program(ast.parse(expr, mode="eval").body, scalars or {}, names)
+    if len(names) > MAX_INPUTS:
+        raise ValueError(f"{expr!r} has {len(names)} array inputs, at most {MAX_INPUTS} are supported")
+    if not names:
+        raise ValueError(f"{expr!r} has no array inputs")
+    return names, program
+
+
+def _to_program(node, scalars, names):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return ("const", float(node.value))
+    if isinstance(node, ast.Name):
+        if node.id in scalars:
+            return ("const", float(scalars[node.id]))
+        if node.id not in names:
+            names.append(node.id)
+        return ("input", names.index(node.id))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _to_program(node.operand, scalars, names)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        return _binop("multiply", ("const", -1.0), operand)
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return _binop(
+            OPERATORS[type(node.op)], _to_program(node.left, scalars, names), _to_program(node.right, scalars, names)
+        )
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        fn, args = node.func.id, [_to_program(arg, scalars, names) for arg in node.args]
+        if fn in UNARY_FUNCTIONS and len(args) == 1:
+            if args[0][0] == "const":
+                return ("const", float(NUMPY_UNARY_FUNCTIONS[fn](np.float64(args[0][1]))))
+            return ("call", fn, args[0])
+        if fn in BINARY_OPS and len(args) == 2:
+            return _binop(fn, *args)
+    raise ValueError(f"Unsupported expression: {ast.unparse(node)!r}")
+
+
+def _binop(op, lhs, rhs):
+    if lhs[0] == "const" and rhs[0] == "const":
+        return ("const", float(NUMPY_BINARY_OPS[op](lhs[1], rhs[1])))
+    return ("binop", op, lhs, rhs)
+
+
+def evaluate(program, arrays):
+    """
+    NumPy reference for fused_elementwise_stream(*arrays, program=program).
+
+    Per-partition (128, 1) vectors broadcast along the rows of the
+    (128, n // 128) view of the 1D streams, as in the kernel.
+    """
+    stream = next(array for array in arrays if array.ndim == 1)
+    if any(array.ndim == 2 for array in arrays):
+        arrays = [array.reshape(128, -1) if array.ndim == 1 else array for array in arrays]
+    return _evaluate(program, arrays).reshape(stream.shape).astype(stream.dtype)
+
+
+def _evaluate(node, arrays):
+    if node[0] == "input":
+        return arrays[node[1]].astype(np.float64)
+    if node[0] == "const":
+        return node[1]
+    if node[0] == "call":
+        return NUMPY_UNARY_FUNCTIONS[node[1]](_evaluate(node[2], arrays))
+    return NUMPY_BINARY_OPS[node[1]](_evaluate(node[2], arrays), _evaluate(node[3], arrays))
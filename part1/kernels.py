@@ -10,6 +10,12 @@ For Step 1 & 2, you should look at these kernels:
 For Step 3, you should look at this kernel:
     - matrix_transpose
 
+fused_elementwise_stream generalizes vector_add_stream to any elementwise
+expression over several inputs (see elementwise.py).
+
+matmul_tiled is a general tiled GEMM (transposed operands, bias, batching),
+built from the same tiles as matrix_transpose plus nc_matmul.
+
 It's highly recommended to carefully read the code of each kernel and understand how
 they work. For NKI functions, you can refer to the NKI documentation at:
 https://awsdocs-neuron-staging.readthedocs-hosted.com/en/nki_docs_2.21_beta_class/
@@ -52,12 +58,18 @@ def vector_add_naive(a_vec, b_vec):
 """
 This is the tiled implementation of a vector add kernel.
 We load the input vectors in chunks, add them, and then store the result
-chunk into HBM. Therefore, this kernel works for any vector that is a
-multiple of 128.
+chunk into HBM. A vector that is not a multiple of the chunk size ends with
+one shorter chunk.
+
+The chunk size is the `row_chunk` parameter, so run_benchmark.py can autotune it.
+
+With buffer_depth > 1 the chunks are software-pipelined through that many
+input buffers (see add_tiles_buffered) instead of leaving the overlap of
+consecutive iterations to the scheduler.
 """
 @nki.compiler.skip_middle_end_transformations
 @nki.jit
-def vector_add_tiled(a_vec, b_vec):
+def vector_add_tiled(a_vec, b_vec, row_chunk=256, buffer_depth=1):
     
     # Allocate space for the output vector in HBM
     out = nl.ndarray(shape=a_vec.shape, dtype=a_vec.dtype, buffer=nl.hbm)
@@ -65,8 +77,15 @@ def vector_add_tiled(a_vec, b_vec):
     # Get the total number of vector rows
     M = a_vec.shape[0]
     
-    # TODO: You should modify this variable for Step 1
-    ROW_CHUNK = 256 
+    # TODO: You should modify the default of `row_chunk` for Step 1
+    ROW_CHUNK = row_chunk
+
+    if buffer_depth > 1:
+        # chunk m is elements m * ROW_CHUNK + p, one per partition
+        add_tiles_buffered(a_vec, b_vec, out, ROW_CHUNK, 1, 1, ROW_CHUNK, 0, M // ROW_CHUNK, buffer_depth)
+        if M % ROW_CHUNK > 0:
+            add_rows(a_vec, b_vec, out, (M // ROW_CHUNK) * ROW_CHUNK, M % ROW_CHUNK)
+        return out
 
     # Loop over the total number of chunks, we can use affine_range
     # because there are no loop-carried dependencies
@@ -85,6 +104,10 @@ def vector_add_tiled(a_vec, b_vec):
 
         # Store the result chunk into HBM
         nisa.dma_copy(src=res, dst=out[m * ROW_CHUNK : (m + 1) * ROW_CHUNK])
+
+    # Add the remaining rows, if any, as one shorter chunk
+    if M % ROW_CHUNK > 0:
+        add_rows(a_vec, b_vec, out, (M // ROW_CHUNK) * ROW_CHUNK, M % ROW_CHUNK)
     
     return out
 
@@ -93,71 +116,561 @@ This is an extension of the vector_add_tiled kernel. Instead of loading tiles
 of size (ROW_CHUNK, 1), we reshape the vectors into (PARTITION_DIM, FREE_DIM)
 tiles. This allows us to amortize DMA transfer overhead and load many more
 elements per DMA transfer.
+
+The tile width is the `free_dim` parameter, so run_benchmark.py can autotune it.
+
+Vectors of any length are handled without padding: the (PARTITION_DIM,
+M // PARTITION_DIM) view ends with a narrower tile when its width is not a
+multiple of FREE_DIM, and the last M % PARTITION_DIM elements, which do not
+fill a column of the view, are added as one short chunk like vector_add_tiled.
+
+Launched over a 1D SPMD grid, the full tiles are split evenly between the
+programs by nl.program_id(0). The few leftover tiles go one each to the first
+programs, and the tails to the last one, so every element is written once.
+
+With buffer_depth > 1 each program's full tiles are software-pipelined through
+that many input buffers, like vector_add_tiled.
 """
 @nki.compiler.skip_middle_end_transformations
 @nki.jit
-def vector_add_stream(a_vec, b_vec):
+def vector_add_stream(a_vec, b_vec, free_dim=1000, buffer_depth=1):
 
     # Get the total number of vector rows
     M = a_vec.shape[0]
 
-    # TODO: You should modify this variable for Step 2a
-    FREE_DIM = 1000
+    # TODO: You should modify the default of `free_dim` for Step 2a
+    FREE_DIM = free_dim
 
     # The maximum size of our Partition Dimension
     PARTITION_DIM = 128
 
-    a_vec_re = a_vec.reshape((PARTITION_DIM, M // PARTITION_DIM))
-    b_vec_re = b_vec.reshape((PARTITION_DIM, M // PARTITION_DIM))
-    out = nl.ndarray(shape=a_vec_re.shape, dtype=a_vec_re.dtype, buffer=nl.hbm)
+    # Width of the (PARTITION_DIM, cols) view of the first PARTITION_DIM * cols elements
+    cols = M // PARTITION_DIM
+    out = nl.ndarray(shape=a_vec.shape, dtype=a_vec.dtype, buffer=nl.shared_hbm)
+
+    # Loop over this program's share of the full tiles
+    num_tiles = cols // FREE_DIM
+    tile_start, tile_count = spmd_shard(num_tiles)
+    if buffer_depth > 1:
+        # tile m is elements p * cols + m * FREE_DIM + f
+        add_tiles_buffered(a_vec, b_vec, out, PARTITION_DIM, FREE_DIM, cols, FREE_DIM, tile_start, tile_count, buffer_depth)
+    else:
+        for m in nl.affine_range(tile_count):
+            add_stream_tile(a_vec, b_vec, out, cols, (tile_start + m) * FREE_DIM, FREE_DIM)
+    leftover = spmd_leftover(num_tiles)
+    if leftover is not None:
+        tile, mask = leftover
+        add_stream_tile(a_vec, b_vec, out, cols, tile * FREE_DIM, FREE_DIM, mask=mask)
+
+    # A narrower tile for the columns left over
+    if cols % FREE_DIM > 0:
+        add_stream_tile(a_vec, b_vec, out, cols, (cols // FREE_DIM) * FREE_DIM, cols % FREE_DIM, mask=spmd_last_mask())
+
+    # The elements that do not fill a whole column
+    if M % PARTITION_DIM > 0:
+        add_rows(a_vec, b_vec, out, PARTITION_DIM * cols, M % PARTITION_DIM, mask=spmd_last_mask())
+
+    return out
+
+"""
+(start, count) of this SPMD program's share of `total` tiles, split evenly
+along axis 0 of the launch grid like part 2's conv2d.spmd_shard; the
+total % num_programs tiles left over are handed out by spmd_leftover.
+(0, total) outside an SPMD launch.
+"""
+def spmd_shard(total):
+    if nl.program_ndim() == 0:
+        return 0, total
+    num_shards = nl.num_programs(axes=0)
+    count = total // num_shards
+    return nl.program_id(axis=0) * count, count
 
-    # Loop over the total number of tiles
-    for m in nl.affine_range(M // (PARTITION_DIM * FREE_DIM)):
+"""
+The tiles spmd_shard leaves over go one each to the first programs. Returns
+(tile, mask): this program's leftover tile, and the predicate that masks it
+off on the programs that have none. None when there are no leftovers.
+"""
+def spmd_leftover(total):
+    if nl.program_ndim() == 0:
+        return None
+    num_shards = nl.num_programs(axes=0)
+    leftover = total % num_shards
+    if leftover == 0:
+        return None
+    program = nl.program_id(axis=0)
+    return total - leftover + program, program < leftover
 
-        # Allocate space for a reshaped tile
-        a_tile = nl.ndarray((PARTITION_DIM, FREE_DIM), dtype=a_vec.dtype, buffer=nl.sbuf)
-        b_tile = nl.ndarray((PARTITION_DIM, FREE_DIM), dtype=b_vec.dtype, buffer=nl.sbuf)
+"""
+Predicate that holds on the last program of an SPMD launch only, for work
+(the tails) that must be written exactly once. That program never gets a
+leftover tile from spmd_leftover. None outside an SPMD launch.
+"""
+def spmd_last_mask():
+    if nl.program_ndim() == 0:
+        return None
+    return nl.program_id(axis=0) >= nl.num_programs(axes=0) - 1
+
+"""
+Add one (128, width) tile of vector_add_stream: columns [col, col + width) of
+the vectors viewed as (128, cols). Element (p, f) of the tile is element
+p * cols + col + f of the vector, which is what reshape((128, cols)) would
+give, but also works when the vector length is not a multiple of 128.
+`mask` predicates every instruction, e.g. to a single SPMD program.
+"""
+def add_stream_tile(a_vec, b_vec, out, cols, col, width, mask=None):
+    i_p, i_f = nl.mgrid[0:nl.tile_size.pmax, 0:width]
 
-        # Load the input tiles
-        nisa.dma_copy(src=a_vec_re[:, m * FREE_DIM : (m + 1) * FREE_DIM], dst=a_tile)
-        nisa.dma_copy(src=b_vec_re[:, m * FREE_DIM : (m + 1) * FREE_DIM], dst=b_tile)
+    # Allocate space for a reshaped tile
+    a_tile = nl.ndarray((nl.tile_size.pmax, width), dtype=a_vec.dtype, buffer=nl.sbuf)
+    b_tile = nl.ndarray((nl.tile_size.pmax, width), dtype=b_vec.dtype, buffer=nl.sbuf)
 
-        # Add the tiles together. Note that we must switch to tensor_tensor instead of tensor_scalar
-        res = nisa.tensor_tensor(a_tile, b_tile, op=nl.add)
+    # Load the input tiles
+    nisa.dma_copy(src=a_vec[i_p * cols + col + i_f], dst=a_tile, mask=mask)
+    nisa.dma_copy(src=b_vec[i_p * cols + col + i_f], dst=b_tile, mask=mask)
 
-        # Store the result tile into HBM
-        nisa.dma_copy(src=res, dst=out[:, m * FREE_DIM : (m + 1) * FREE_DIM])
+    # Add the tiles together. Note that we must switch to tensor_tensor instead of tensor_scalar
+    res = nisa.tensor_tensor(a_tile, b_tile, op=nl.add, mask=mask)
 
-    # Reshape the output vector into its original shape
-    out = out.reshape(a_vec.shape)
+    # Store the result tile into HBM
+    nisa.dma_copy(src=res, dst=out[i_p * cols + col + i_f], mask=mask)
+
+"""
+Add `num_tiles` (rows, width) tiles with `depth` input buffers in flight.
+Element (p, f) of tile t is element
+p * partition_stride + t * tile_stride + f of the vectors, for
+t = first_tile .. first_tile + num_tiles - 1.
+
+The inputs of tile m + depth - 1 are DMAed into their own buffers before
+tile m is added and stored, so depth - 1 loads are always queued ahead of
+the compute. A Python list of buffers is indexed statically by unrolling
+`depth` tiles per iteration of a sequential loop (the buffers are reused
+across iterations); the tiles that do not fill a last group are unrolled.
+"""
+def add_tiles_buffered(a_vec, b_vec, out, rows, width, partition_stride, tile_stride, first_tile, num_tiles, depth):
+    i_p, i_f = nl.mgrid[0:rows, 0:width]
+    a_bufs = [nl.ndarray((rows, width), dtype=a_vec.dtype, buffer=nl.sbuf) for _ in range(depth)]
+    b_bufs = [nl.ndarray((rows, width), dtype=b_vec.dtype, buffer=nl.sbuf) for _ in range(depth)]
+
+    # prologue: fill all but one buffer
+    ahead = min(depth - 1, num_tiles)
+    for t in range(ahead):
+        index = i_p * partition_stride + (first_tile + t) * tile_stride + i_f
+        nisa.dma_copy(src=a_vec[index], dst=a_bufs[t])
+        nisa.dma_copy(src=b_vec[index], dst=b_bufs[t])
+
+    # steady state: every prefetch is in range for these groups
+    num_groups = (num_tiles - ahead) // depth
+    for g in nl.sequential_range(num_groups):
+        for slot in range(depth):
+            m = first_tile + g * depth + slot
+            prefetch = i_p * partition_stride + (m + depth - 1) * tile_stride + i_f
+            nisa.dma_copy(src=a_vec[prefetch], dst=a_bufs[(slot - 1) % depth])
+            nisa.dma_copy(src=b_vec[prefetch], dst=b_bufs[(slot - 1) % depth])
+            res = nisa.tensor_tensor(a_bufs[slot], b_bufs[slot], op=nl.add)
+            nisa.dma_copy(src=res, dst=out[i_p * partition_stride + m * tile_stride + i_f])
+
+    # epilogue: the last tiles, prefetching only those that exist
+    for t in range(num_groups * depth, num_tiles):
+        if t + depth - 1 < num_tiles:
+            prefetch = i_p * partition_stride + (first_tile + t + depth - 1) * tile_stride + i_f
+            nisa.dma_copy(src=a_vec[prefetch], dst=a_bufs[(t - 1) % depth])
+            nisa.dma_copy(src=b_vec[prefetch], dst=b_bufs[(t - 1) % depth])
+        res = nisa.tensor_tensor(a_bufs[t % depth], b_bufs[t % depth], op=nl.add)
+        nisa.dma_copy(src=res, dst=out[i_p * partition_stride + (first_tile + t) * tile_stride + i_f])
+
+"""
+Add `rows` (<= 128) consecutive elements starting at `start`, one per
+partition, like a single chunk of vector_add_tiled. Used for the tails.
+"""
+def add_rows(a_vec, b_vec, out, start, rows, mask=None):
+    a_tile = nl.ndarray((rows, 1), dtype=a_vec.dtype, buffer=nl.sbuf)
+    b_tile = nl.ndarray((rows, 1), dtype=b_vec.dtype, buffer=nl.sbuf)
+    nisa.dma_copy(src=a_vec[start : start + rows], dst=a_tile, mask=mask)
+    nisa.dma_copy(src=b_vec[start : start + rows], dst=b_tile, mask=mask)
+    res = nisa.tensor_scalar(a_tile, nl.add, b_tile, mask=mask)
+    nisa.dma_copy(src=res, dst=out[start : start + rows], mask=mask)
+
+"""
+A fused elementwise kernel generated from an expression, e.g. "a * b + c",
+"relu(a + bias)" or "alpha * x + y", streamed like vector_add_stream. Every
+input is read once and the result written once, instead of paying an HBM round
+trip per operation when separate add/mul kernels are chained.
+
+`program` is the expression compiled by elementwise.parse_expression; x0..x3
+are its array inputs in the order that returns their names. Each is either
+    - a stream: a 1D vector as long as the output, tiled like vector_add_stream;
+    - a per-partition vector: a (128, 1) array, one value per row of the
+      (128, M // 128) view of the streams, loaded once and applied with
+      tensor_scalar. M must then be a multiple of 128.
+Scalars are compile-time constants in the program, applied as immediates.
+"""
+@nki.compiler.skip_middle_end_transformations
+@nki.jit
+def fused_elementwise_stream(x0, x1=None, x2=None, x3=None, program=None, free_dim=1000):
+    inputs = [x for x in (x0, x1, x2, x3) if x is not None]
+    streams = [x for x in inputs if len(x.shape) == 1]
+    assert streams, "fused_elementwise_stream needs at least one 1-D input to stream; all inputs are per-partition"
+    stream = streams[0]
+
+    # Get the total number of vector rows
+    M = stream.shape[0]
+    FREE_DIM = free_dim
+    PARTITION_DIM = 128
+
+    cols = M // PARTITION_DIM
+    out = nl.ndarray(shape=stream.shape, dtype=stream.dtype, buffer=nl.shared_hbm)
+
+    # Load the per-partition vectors once, for every tile to reuse
+    columns = {}
+    for index, x in enumerate(inputs):
+        if len(x.shape) == 2:
+            assert x.shape == (PARTITION_DIM, 1), f"Per-partition vectors must be ({PARTITION_DIM}, 1), got {x.shape}"
+            assert M % PARTITION_DIM == 0, "Per-partition vectors need a vector length that is a multiple of 128"
+            columns[index] = nl.ndarray((PARTITION_DIM, 1), dtype=x.dtype, buffer=nl.sbuf)
+            nisa.dma_copy(src=x, dst=columns[index])
+
+    # This program's share of the full tiles, then its leftover tile if any
+    num_tiles = cols // FREE_DIM
+    tile_start, tile_count = spmd_shard(num_tiles)
+    for m in nl.affine_range(tile_count):
+        elementwise_stream_tile(inputs, columns, program, out, cols, (tile_start + m) * FREE_DIM, FREE_DIM)
+    leftover = spmd_leftover(num_tiles)
+    if leftover is not None:
+        tile, mask = leftover
+        elementwise_stream_tile(inputs, columns, program, out, cols, tile * FREE_DIM, FREE_DIM, mask=mask)
+
+    # A narrower tile for the columns left over
+    if cols % FREE_DIM > 0:
+        elementwise_stream_tile(
+            inputs, columns, program, out, cols, (cols // FREE_DIM) * FREE_DIM, cols % FREE_DIM, mask=spmd_last_mask()
+        )
+
+    # The elements that do not fill a whole column
+    if M % PARTITION_DIM > 0:
+        elementwise_rows(inputs, program, out, PARTITION_DIM * cols, M % PARTITION_DIM, mask=spmd_last_mask())
 
     return out
 
+# Instructions for the program's operations and functions
+ELEMENTWISE_OPS = {
+    "add": nl.add,
+    "subtract": nl.subtract,
+    "multiply": nl.multiply,
+    "divide": nl.divide,
+    "maximum": nl.maximum,
+    "minimum": nl.minimum,
+}
+ELEMENTWISE_FUNCTIONS = {
+    "relu": nl.relu,
+    "exp": nl.exp,
+    "tanh": nl.tanh,
+    "sqrt": nl.sqrt,
+    "sigmoid": nl.sigmoid,
+    "silu": nl.silu,
+    "gelu": nl.gelu,
+}
+
+"""
+One (128, width) tile of fused_elementwise_stream, indexed like
+add_stream_tile: load a tile of every stream, evaluate the program on the
+tiles, and store the result. `mask` predicates every instruction.
+"""
+def elementwise_stream_tile(inputs, columns, program, out, cols, col, width, mask=None):
+    i_p, i_f = nl.mgrid[0:nl.tile_size.pmax, 0:width]
+
+    operands = []
+    for index, x in enumerate(inputs):
+        if index in columns:
+            operands.append(columns[index])
+        else:
+            x_tile = nl.ndarray((nl.tile_size.pmax, width), dtype=x.dtype, buffer=nl.sbuf)
+            nisa.dma_copy(src=x[i_p * cols + col + i_f], dst=x_tile, mask=mask)
+            operands.append(x_tile)
+
+    res, kind = eval_elementwise(program, operands, columns, mask)
+    assert kind == "tile", "The expression must depend on at least one stream"
+    nisa.dma_copy(src=res, dst=out[i_p * cols + col + i_f], mask=mask)
+
+"""
+The program on `rows` (<= 128) consecutive elements starting at `start`, one
+per partition, like add_rows. Used for the tail.
+"""
+def elementwise_rows(inputs, program, out, start, rows, mask=None):
+    operands = []
+    for x in inputs:
+        x_tile = nl.ndarray((rows, 1), dtype=x.dtype, buffer=nl.sbuf)
+        nisa.dma_copy(src=x[start : start + rows], dst=x_tile, mask=mask)
+        operands.append(x_tile)
+
+    res, _ = eval_elementwise(program, operands, {}, mask)
+    nisa.dma_copy(src=res, dst=out[start : start + rows], mask=mask)
+
+"""
+Evaluate a program node on loaded operands. Returns (value, kind): kind is
+"tile" for stream tiles, "column" for per-partition vectors and "scalar" for
+constants. A tile combined with a column or scalar is one tensor_scalar,
+which broadcasts it along the free dimension; reverse0 keeps the operand
+order of subtract and divide when the broadcast operand is on the left.
+"""
+def eval_elementwise(node, operands, columns, mask=None):
+    if node[0] == "input":
+        return operands[node[1]], "column" if node[1] in columns else "tile"
+    if node[0] == "const":
+        return node[1], "scalar"
+    if node[0] == "call":
+        value, kind = eval_elementwise(node[2], operands, columns, mask)
+        return nisa.activation(op=ELEMENTWISE_FUNCTIONS[node[1]], data=value, mask=mask), kind
+
+    op = ELEMENTWISE_OPS[node[1]]
+    lhs, lhs_kind = eval_elementwise(node[2], operands, columns, mask)
+    rhs, rhs_kind = eval_elementwise(node[3], operands, columns, mask)
+    if lhs_kind == rhs_kind:
+        # constants are folded on the host, so these are two tiles or two columns
+        return nisa.tensor_tensor(lhs, rhs, op=op, mask=mask), lhs_kind
+    if lhs_kind == "tile" or rhs_kind == "scalar":
+        return nisa.tensor_scalar(lhs, op, rhs, mask=mask), lhs_kind
+    return nisa.tensor_scalar(rhs, op, lhs, reverse0=True, mask=mask), rhs_kind
+
 """
 This kernel implements a simple 2D matrix transpose.
 It uses a tile-based approach along with NKI's built-in transpose kernel,
-which only works on tiles of size <= 128x128.
+which only works on tiles of size <= 128x128. When M or N is not a multiple
+of 128, the last row and column of tiles are partial.
+
+Launched over a 1D SPMD grid, the rows of tiles are split between the programs
+like vector_add_stream's tiles: evenly, the leftover rows one per program, and
+the partial last row to the last program.
 """
 @nki.compiler.skip_middle_end_transformations
 @nki.jit
 def matrix_transpose(a_tensor):
     M, N = a_tensor.shape
-    out = nl.ndarray((N, M), dtype=a_tensor.dtype, buffer=nl.hbm)
+    out = nl.ndarray((N, M), dtype=a_tensor.dtype, buffer=nl.shared_hbm)
     tile_dim = nl.tile_size.pmax  # this should be 128
 
-    assert M % tile_dim == N % tile_dim == 0, "Matrix dimensions not divisible by tile dimension!"
+    full_m, tail_m = M // tile_dim, M % tile_dim
+    full_n, tail_n = N // tile_dim, N % tile_dim
 
-    for m in nl.affine_range(M // tile_dim):
-        for n in nl.affine_range(N // tile_dim):
-            a_tile = nl.ndarray((tile_dim, tile_dim), dtype=a_tensor.dtype, buffer=nl.sbuf)
-            nisa.dma_copy(src=a_tensor[m*tile_dim : (m+1)*tile_dim, n*tile_dim : (n+1)*tile_dim], dst=a_tile)
-            a_tile_t = nisa.nc_transpose(a_tile)
-            a_tile_t_sbuf = nisa.tensor_copy(a_tile_t, engine=nisa.vector_engine)
+    # this program's rows of tiles, then its leftover row if any
+    m_start, m_count = spmd_shard(full_m)
+    for m_local in nl.affine_range(m_count):
+        transpose_tile_row(a_tensor, out, (m_start + m_local) * tile_dim, tile_dim, full_n, tail_n)
+    leftover = spmd_leftover(full_m)
+    if leftover is not None:
+        m, mask = leftover
+        transpose_tile_row(a_tensor, out, m * tile_dim, tile_dim, full_n, tail_n, mask=mask)
 
-            # store result in the HBM
-            nisa.dma_copy(src=a_tile_t_sbuf, dst=out[n*tile_dim : (n+1)*tile_dim, m*tile_dim : (m+1)*tile_dim])
+    if tail_m > 0:
+        transpose_tile_row(a_tensor, out, full_m * tile_dim, tail_m, full_n, tail_n, mask=spmd_last_mask())
 
 
     # TODO: Your implementation here. The only compute instruction you should use is `nisa.nc_transpose`.
 
     return out
+
+"""
+Transpose one row of tiles of a_tensor, rows [row, row + rows): full_n full
+tiles and, when tail_n > 0, a partial last one. `mask` predicates every
+instruction.
+"""
+def transpose_tile_row(a_tensor, out, row, rows, full_n, tail_n, mask=None):
+    tile_dim = nl.tile_size.pmax
+    for n in nl.affine_range(full_n):
+        transpose_tile(a_tensor, out, row, rows, n * tile_dim, tile_dim, mask=mask)
+    if tail_n > 0:
+        transpose_tile(a_tensor, out, row, rows, full_n * tile_dim, tail_n, mask=mask)
+
+"""
+Transpose the (rows, cols) tile of a_tensor at (row, col) into out, the tile
+at (col, row). rows and cols are at most 128.
+"""
+def transpose_tile(a_tensor, out, row, rows, col, cols, mask=None):
+    a_tile = nl.ndarray((rows, cols), dtype=a_tensor.dtype, buffer=nl.sbuf)
+    nisa.dma_copy(src=a_tensor[row : row + rows, col : col + cols], dst=a_tile, mask=mask)
+    a_tile_t = nisa.nc_transpose(a_tile, mask=mask)
+    a_tile_t_sbuf = nisa.tensor_copy(a_tile_t, engine=nisa.vector_engine, mask=mask)
+
+    # store result in the HBM
+    nisa.dma_copy(src=a_tile_t_sbuf, dst=out[col : col + cols, row : row + rows], mask=mask)
+
+"""
+Tiled matrix multiply: out = op(a) @ op(b) (+ bias), where op transposes its
+operand when transpose_a / transpose_b is set.
+
+nc_matmul contracts over the partition dimension: it computes
+stationary.T @ moving for a (K <= 128, M <= 128) stationary tile and a
+(K <= 128, N <= 512) moving tile. So a is consumed K-major (its native layout
+is [K, M], i.e. transpose_a=True) and b as [K, N]; the other layouts are
+transposed on chip tile by tile with nc_transpose, as in matrix_transpose.
+
+The output is computed in blocks of tiles_m x tiles_n PSUM tiles of 128 x 512,
+at most 8 (one per PSUM bank), or 7 when an operand is transposed on chip,
+since the nc_transpose results need a bank of their own.
+For every 128-row tile of K, the block's A and B tiles are loaded into SBUF
+once and each A tile is multiplied against every B tile, accumulating in
+PSUM over the whole K dimension; only one K tile of each operand is resident
+at a time, so K is unbounded. M, N and K need not be multiples of the tile
+sizes: the last block and the last K tile are partial, with static sizes.
+
+The bias is added in PSUM too, by one more matmul: a row of ones times the
+bias row puts the bias in every row of the output tile.
+
+Shapes:
+    a: [M, K] ([K, M] if transpose_a), or [batch, M, K] for a batched GEMM
+    b: [K, N] ([N, K] if transpose_b), batched like a, or 2D to share one
+       b across the batch
+    bias: None or [N]
+    out: [M, N], or [batch, M, N], in a's dtype
+"""
+@nki.compiler.skip_middle_end_transformations
+@nki.jit
+def matmul_tiled(a, b, bias=None, transpose_a=False, transpose_b=False, tiles_m=2, tiles_n=2):
+    batched = len(a.shape) == 3
+    batch = a.shape[0] if batched else 1
+    if transpose_a:
+        K, M = a.shape[-2:]
+    else:
+        M, K = a.shape[-2:]
+    if transpose_b:
+        N, K_b = b.shape[-2:]
+    else:
+        K_b, N = b.shape[-2:]
+    assert K_b == K, f"Inner dimensions differ: {K} and {K_b}"
+    assert len(b.shape) == 2 or (batched and b.shape[0] == batch), "b must be 2D or batched like a"
+    assert bias is None or tuple(bias.shape) == (N,), f"bias must have shape ({N},)"
+    # PSUM has 8 banks, one per 128 x 512 fp32 tile; a that is not K-major, or
+    # b with transpose_b, goes through nc_transpose into PSUM as well
+    psum_tiles = 8 if transpose_a and not transpose_b else 7
+    assert tiles_m * tiles_n <= psum_tiles, f"A {tiles_m}x{tiles_n} block must fit in {psum_tiles} PSUM banks"
+
+    out = nl.ndarray((batch, M, N) if batched else (M, N), dtype=a.dtype, buffer=nl.shared_hbm)
+
+    tile_m = nl.tile_size.gemm_stationary_fmax  # 128
+    block_m = tiles_m * tile_m
+    tail_m = gemm_tile_sizes(M % block_m, tile_m)
+
+    for bi in nl.affine_range(batch):
+        for m_block in nl.affine_range(M // block_m):
+            gemm_block_row(a, b, bias, out, bi, m_block * block_m, (tile_m,) * tiles_m, transpose_a, transpose_b, tiles_n)
+        if tail_m:
+            gemm_block_row(a, b, bias, out, bi, (M // block_m) * block_m, tail_m, transpose_a, transpose_b, tiles_n)
+
+    return out
+
+"""
+Sizes of the tiles covering `size` elements: full tiles, then a partial one.
+"""
+def gemm_tile_sizes(size, tile):
+    return (tile,) * (size // tile) + ((size % tile,) if size % tile else ())
+
+"""
+The [rows, cols] slice of a GEMM operand or output, of batch `bi` if batched.
+"""
+def gemm_operand(tensor, bi, rows, cols):
+    if len(tensor.shape) == 3:
+        return tensor[bi, rows, cols]
+    return tensor[rows, cols]
+
+"""
+All the blocks of output rows [m_start, m_start + sum(m_sizes)), tiles_n
+moving tiles wide, the last block partial.
+"""
+def gemm_block_row(a, b, bias, out, bi, m_start, m_sizes, transpose_a, transpose_b, tiles_n):
+    N = out.shape[-1]
+    tile_n = nl.tile_size.gemm_moving_fmax  # 512
+    block_n = tiles_n * tile_n
+    for n_block in nl.affine_range(N // block_n):
+        gemm_block(a, b, bias, out, bi, m_start, m_sizes, n_block * block_n, (tile_n,) * tiles_n, transpose_a, transpose_b)
+    tail_n = gemm_tile_sizes(N % block_n, tile_n)
+    if tail_n:
+        gemm_block(a, b, bias, out, bi, m_start, m_sizes, (N // block_n) * block_n, tail_n, transpose_a, transpose_b)
+
+"""
+One block of output tiles: accumulate over K in PSUM, add the bias, then
+evict every tile and store it.
+"""
+def gemm_block(a, b, bias, out, bi, m_start, m_sizes, n_start, n_sizes, transpose_a, transpose_b):
+    tile_k = nl.tile_size.pmax
+    tile_m = nl.tile_size.gemm_stationary_fmax
+    tile_n = nl.tile_size.gemm_moving_fmax
+    K = a.shape[-2] if transpose_a else a.shape[-1]
+
+    psums = [[nl.zeros((m_size, n_size), nl.float32, buffer=nl.psum) for n_size in n_sizes] for m_size in m_sizes]
+    for k in nl.affine_range(K // tile_k):
+        gemm_k_step(a, b, psums, bi, m_start, m_sizes, n_start, n_sizes, k * tile_k, tile_k, transpose_a, transpose_b)
+    if K % tile_k > 0:
+        gemm_k_step(
+            a, b, psums, bi, m_start, m_sizes, n_start, n_sizes, (K // tile_k) * tile_k, K % tile_k,
+            transpose_a, transpose_b,
+        )
+
+    if bias is not None:
+        ones = nl.ones((1, tile_m), dtype=bias.dtype, buffer=nl.sbuf)
+        for ni, n_size in enumerate(n_sizes):
+            col = n_start + ni * tile_n
+            bias_row = nl.ndarray((1, n_size), dtype=bias.dtype, buffer=nl.sbuf)
+            nisa.dma_copy(src=bias.reshape((1, bias.shape[0]))[0:1, col : col + n_size], dst=bias_row)
+            for mi, m_size in enumerate(m_sizes):
+                psums[mi][ni] += nisa.nc_matmul(ones[:, 0:m_size], bias_row)
+
+    for mi, m_size in enumerate(m_sizes):
+        row = m_start + mi * tile_m
+        for ni, n_size in enumerate(n_sizes):
+            col = n_start + ni * tile_n
+            res = nisa.tensor_copy(psums[mi][ni], dtype=out.dtype)
+            nisa.dma_copy(src=res, dst=gemm_operand(out, bi, slice(row, row + m_size), slice(col, col + n_size)))
+
+"""
+Multiply K rows [k_start, k_start + k_size) of the block's operands into its
+PSUM tiles. Every tile is loaded once and used by all the matmuls of its row
+or column of the block.
+"""
+def gemm_k_step(a, b, psums, bi, m_start, m_sizes, n_start, n_sizes, k_start, k_size, transpose_a, transpose_b):
+    tile_m = nl.tile_size.gemm_stationary_fmax
+    tile_n = nl.tile_size.gemm_moving_fmax
+    a_tiles = [
+        load_gemm_stationary(a, bi, m_start + mi * tile_m, m_size, k_start, k_size, transpose_a)
+        for mi, m_size in enumerate(m_sizes)
+    ]
+    b_tiles = [
+        load_gemm_moving(b, bi, n_start + ni * tile_n, n_size, k_start, k_size, transpose_b)
+        for ni, n_size in enumerate(n_sizes)
+    ]
+    for mi in range(len(m_sizes)):
+        for ni in range(len(n_sizes)):
+            psums[mi][ni] += nisa.nc_matmul(a_tiles[mi], b_tiles[ni])
+
+"""
+The (k_size, m_size) stationary tile of a: DMAed as is when a is K-major
+(transpose_a), and otherwise loaded as an (m_size, k_size) tile and
+transposed like matrix_transpose's tiles.
+"""
+def load_gemm_stationary(a, bi, m_start, m_size, k_start, k_size, transpose_a):
+    rows, cols = slice(m_start, m_start + m_size), slice(k_start, k_start + k_size)
+    if transpose_a:
+        a_t = nl.ndarray((k_size, m_size), dtype=a.dtype, buffer=nl.sbuf)
+        nisa.dma_copy(src=gemm_operand(a, bi, cols, rows), dst=a_t)
+        return a_t
+
+    a_tile = nl.ndarray((m_size, k_size), dtype=a.dtype, buffer=nl.sbuf)
+    nisa.dma_copy(src=gemm_operand(a, bi, rows, cols), dst=a_tile)
+    return nisa.tensor_copy(nisa.nc_transpose(a_tile), dtype=a.dtype, engine=nisa.vector_engine)
+
+"""
+The (k_size, n_size) moving tile of b: DMAed as is from a [K, N] b, and from
+an [N, K] b (transpose_b) loaded and transposed 128 columns at a time.
+"""
+def load_gemm_moving(b, bi, n_start, n_size, k_start, k_size, transpose_b):
+    b_tile = nl.ndarray((k_size, n_size), dtype=b.dtype, buffer=nl.sbuf)
+    k_rows = slice(k_start, k_start + k_size)
+    if not transpose_b:
+        nisa.dma_copy(src=gemm_operand(b, bi, k_rows, slice(n_start, n_start + n_size)), dst=b_tile)
+        return b_tile
+
+    tile_dim = nl.tile_size.pmax
+    for col in range(0, n_size, tile_dim):
+        cols = min(tile_dim, n_size - col)
+        b_rows = nl.ndarray((cols, k_size), dtype=b.dtype, buffer=nl.sbuf)
+        nisa.dma_copy(src=gemm_operand(b, bi, slice(n_start + col, n_start + col + cols), k_rows), dst=b_rows)
+        b_tile[:, col : col + cols] = nisa.tensor_copy(nisa.nc_transpose(b_rows), dtype=b.dtype, engine=nisa.vector_engine)
+    return b_tile
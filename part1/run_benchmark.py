@@ -5,21 +5,124 @@ This script benchmarks various vector addition kernels using different optimizat
 It supports profiling and saving results in .neff and .ntff formats.
 
 For Part 1, your task is to run this script, benchmarking the kernels, and reason about the results.
+
+The gemm kernel (matmul_tiled) is benchmarked on C = A @ B with -m, -n and -k
+giving M, N and K, and reports TFLOP/s and MFU next to the latency.
 """
 
 import argparse
 from argparse import RawTextHelpFormatter
+import os
+import sys
 import numpy as np
+
+# modules shared with part2 (pipeline, latency) live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+
 from kernels import (
     vector_add_naive,
     vector_add_tiled,
     vector_add_stream,
     matrix_transpose,
+    fused_elementwise_stream,
+    matmul_tiled,
 )
+from elementwise import parse_expression, evaluate
+from autotune import TuningDB, DEFAULT_DB_PATH, candidates_by_kernel
+from sweep import parse_sizes, latency_stats, bytes_moved, bandwidth_gbps, write_results, gemm_dims, gemm_flops, tflops, mfu
+from pipeline import make_compile_pool
 import subprocess
 import neuronxcc.nki as nki
+import neuronxcc.nki.language as nl
+
+name_to_kernel = {
+    "naive": vector_add_naive,
+    "tiled": vector_add_tiled,
+    "stream": vector_add_stream,
+    "transpose": matrix_transpose,
+    "elementwise": fused_elementwise_stream,
+    "gemm": matmul_tiled,
+}
+
+# kernels that split their tiles over an SPMD launch grid
+spmd_kernels = {"stream", "transpose", "elementwise"}
+
+# matmul_tiled options set from the command line: the operand layouts, and
+# the output block shape, which --autotune may choose instead
+gemm_layout_options = ("transpose_a", "transpose_b")
+gemm_options = gemm_layout_options + ("tiles_m", "tiles_n")
+
+# kernels with a multi-buffered pipeline mode (buffer_depth)
+buffered_kernels = {"tiled", "stream"}
+
+def spmd_launch(kernel, num_cores):
+    """Launch an nki wrapper over `num_cores` NeuronCores, one SPMD program each."""
+    if num_cores == 1:
+        return kernel
+    return kernel[nl.nc(num_cores)]
+
+def check_correctness(kernel, *args, num_cores=1, **kernel_kwargs):
+    """
+    Run a kernel once with nki.baremetal and compare its output with NumPy.
+    `kernel_kwargs` are compile-time kernel parameters such as `free_dim`.
+    `num_cores` > 1 launches the kernel over that many cores (SPMD).
+
+    Returns:
+    --------
+    bool
+        Whether the kernel output matches the expected NumPy result.
+    """
+    out = spmd_launch(nki.baremetal(kernel), num_cores)(*args, **kernel_kwargs)
+    # expected result by numpy
+    if kernel == matrix_transpose:
+        out_np = args[0].T
+    elif kernel == fused_elementwise_stream:
+        # exp, tanh, gelu, ... run on the activation engine's approximations
+        return bool(np.allclose(out, evaluate(kernel_kwargs["program"], args), rtol=1e-3, atol=1e-5))
+    elif kernel == matmul_tiled:
+        # fp32 products are accumulated in a different order than NumPy's
+        rtol = 1e-3 if args[0].dtype == np.float32 else 1e-2
+        return bool(np.allclose(out, gemm_reference(*args, **kernel_kwargs), rtol=rtol, atol=1e-3))
+    else:
+        out_np = args[0] + args[1]
+    return bool(np.allclose(out, out_np))
 
-def benchmark_kernel(kernel, *args, profile_name=None):
+def gemm_reference(a, b, bias=None, transpose_a=False, transpose_b=False, **tiling):
+    """NumPy reference for matmul_tiled, computed in fp32."""
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    if transpose_a:
+        a = a.swapaxes(-1, -2)
+    if transpose_b:
+        b = b.swapaxes(-1, -2)
+    out = a @ b
+    if bias is not None:
+        out = out + bias.astype(np.float32)
+    return out
+
+def check_correctness_by_name(kernel_name, args, kernel_kwargs, num_cores=1):
+    # pool entry point: kernels are looked up by name so only arrays are pickled
+    return check_correctness(name_to_kernel[kernel_name], *args, num_cores=num_cores, **kernel_kwargs)
+
+def measure_kernel(kernel, *args, profile_name=None, kernel_kwargs=None, num_cores=1):
+    """
+    Run a kernel under nki.benchmark and return its `nc_latency` result.
+    """
+    kernel_kwargs = kernel_kwargs or {}
+    if profile_name:
+        bench_func = spmd_launch(nki.benchmark(kernel, warmup=1, iters=10,
+                                               save_neff_name="file.neff",
+                                               save_trace_name=profile_name + ".ntff",
+                                               additional_compile_opt="--disable-dge"), num_cores)
+        bench_func(*args, **kernel_kwargs)
+        subprocess.run(["mv", "file.neff", profile_name + ".neff"], check=True)
+    else:
+        bench_func = spmd_launch(nki.benchmark(kernel, warmup=1, iters=10), num_cores)
+        bench_func(*args, **kernel_kwargs)
+
+    return bench_func.benchmark_result.nc_latency
+
+def benchmark_kernel(kernel, *args, profile_name=None, correct=None, kernel_kwargs=None, num_cores=1):
     """
     Benchmark a vector addition kernel function and verify its correctness.
 
@@ -36,11 +139,19 @@ def benchmark_kernel(kernel, *args, profile_name=None):
         The arguments to be passed to the kernel.
     profile_name : str
         Name used to save .NEFF and .NTFF files.
+    correct : bool
+        Result of a correctness check already run elsewhere (e.g. in a worker
+        process). If None, the check is run here first.
+    kernel_kwargs : dict
+        Compile-time kernel parameters, e.g. {"free_dim": 2000}.
+    num_cores : int
+        Number of NeuronCores to launch the kernel over (SPMD).
 
     Returns:
     --------
-    None
-        This function prints the benchmark results and correctness validation to stdout.
+    dict
+        p50/p90/p99, min and mean latency in μs. The p99 and correctness are
+        also printed to stdout.
 
     Raises:
     -------
@@ -48,59 +159,227 @@ def benchmark_kernel(kernel, *args, profile_name=None):
         If the kernel output does not match the expected NumPy result.
     """
     # run without benchmarking to verify correctness
-    out = nki.baremetal(kernel)(*args)
-    # expected result by numpy
-    if kernel == matrix_transpose:
-        out_np = args[0].T
-    else:
-        out_np = args[0] + args[1]
-    print(f"\nCorrectness passed? {np.allclose(out, out_np)}")
-    assert np.allclose(out, out_np)
+    kernel_kwargs = kernel_kwargs or {}
+    if correct is None:
+        correct = check_correctness(kernel, *args, num_cores=num_cores, **kernel_kwargs)
+    print(f"\nCorrectness passed? {correct}")
+    assert correct
 
     print("\nBenchmarking performance.........")
-    if profile_name:
-        bench_func = nki.benchmark(kernel, warmup=1, iters=10,
-                                   save_neff_name="file.neff",
-                                   save_trace_name=profile_name + ".ntff",
-                                   additional_compile_opt="--disable-dge")
-        bench_func(*args)
-        subprocess.run(["mv", "file.neff", profile_name + ".neff"], check=True)
-    else:
-        bench_func = nki.benchmark(kernel, warmup=1, iters=10)
-        bench_func(*args)
+    nc_latency = measure_kernel(kernel, *args, profile_name=profile_name, kernel_kwargs=kernel_kwargs,
+                                num_cores=num_cores)
+    stats = latency_stats(nc_latency)
+    print(f"\nExecution Time: {stats['p99_us']} μs")
+    return stats
+
+def tuning_point(name, args, kernel_kwargs=None):
+    """
+    (name, size) the tuning database keys a case by: the vector length, or for
+    the gemm its layout and M x N x K.
+    """
+    if name == "gemm":
+        _, M, N, K = gemm_dims(args, kernel_kwargs)
+        layout = "".join(f":{option}" for option in gemm_layout_options if (kernel_kwargs or {}).get(option))
+        return name + layout, f"{M}x{N}x{K}"
+    return name, args[0].shape[0]
+
+def autotune_kernel(name, *args, tuning_db, kernel_kwargs=None):
+    """
+    Sweep the legal tile parameters of a kernel for the size of `args`.
+    `kernel_kwargs` are fixed parameters passed with every candidate, such as
+    the gemm's transpose_a / transpose_b, which also constrain the candidates.
+
+    Candidates are pruned against SBUF and PSUM capacity and divisibility
+    before being compiled, each survivor's p99 latency is measured, and the
+    fastest one is checked for correctness and stored in `tuning_db`.
+
+    Returns:
+    --------
+    dict
+        The winning kernel parameters.
+    """
+    kernel = name_to_kernel[name]
+    kernel_kwargs = kernel_kwargs or {}
+    n, dtype = args[0].shape[0], args[0].dtype
+    candidates = candidates_by_kernel[name](n, dtype, **kernel_kwargs)
+    if not candidates:
+        raise ValueError(f"No legal tile parameters for {name} with n={n}")
+
+    print(f"\nAutotuning {kernel.__name__} over {len(candidates)} candidates.........")
+    results = []
+    for params in candidates:
+        p99_us = measure_kernel(kernel, *args, kernel_kwargs={**kernel_kwargs, **params}).get_latency_percentile(99)
+        print(f"  {params}: {p99_us} μs")
+        results.append({"params": params, "p99_us": p99_us})
 
-    p99_us = bench_func.benchmark_result.nc_latency.get_latency_percentile(99)
-    print(f"\nExecution Time: {p99_us} μs")
+    best = min(results, key=lambda result: result["p99_us"])
+    assert check_correctness(kernel, *args, **kernel_kwargs, **best["params"])
+    tuning_db.store(*tuning_point(name, args, kernel_kwargs), dtype, best["params"], best["p99_us"], results)
+    print(f"\nBest parameters: {best['params']} ({best['p99_us']} μs)")
+    return best["params"]
 
 def main():
-    name_to_kernel = {
-        "naive": vector_add_naive,
-        "tiled": vector_add_tiled,
-        "stream": vector_add_stream,
-        "transpose": matrix_transpose,
-    }
     parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
-    parser.add_argument("--kernel", type=str, choices=name_to_kernel.keys(), required=True)
-    parser.add_argument("-n", type=int, required=True, help="Width of vector/matrix.")
-    parser.add_argument("-m", type=int, help="Height of matrix. If not specified, defaults to n.")
+    parser.add_argument("--kernel", type=str, nargs="+", choices=name_to_kernel.keys(), required=True,
+                        help="One or more kernels to benchmark, in order.")
+    parser.add_argument("-n", type=parse_sizes, required=True,
+                        help="Width of vector/matrix. A list (a,b,c) or range\n"
+                             "(start:stop:step, start:stop:xfactor) sweeps every size.")
+    parser.add_argument("-m", type=parse_sizes,
+                        help="Height of matrix. If not specified, defaults to n. Accepts lists/ranges like -n.")
     parser.add_argument("--profile_name", type=str, help="Name used to save .NEFF and .NTFF files for profiling.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Compile and check the kernels ahead of time in this many worker processes.")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Sweep the tile parameters of the tiled/stream kernels (and the gemm's output\n"
+                             "block) and store the fastest.")
+    parser.add_argument("--tuning_db", type=str, default=DEFAULT_DB_PATH,
+                        help="JSON file holding tuned kernel parameters.")
+    parser.add_argument("--sweep_out", type=str,
+                        help="Write latency and bandwidth for every benchmarked point to this .csv or .json file.")
+    parser.add_argument("--expr", type=str, default="a * b + c",
+                        help="Elementwise expression for the elementwise kernel, e.g. 'relu(a + bias)'.")
+    parser.add_argument("--scalar", type=str, action="append", default=[], metavar="NAME=VALUE",
+                        help="Bind a name in --expr to a compile-time scalar. May be repeated.")
+    parser.add_argument("--per_partition", type=str, action="append", default=[], metavar="NAME",
+                        help="Pass this input of --expr as a (128, 1) per-partition vector. May be repeated.")
+    parser.add_argument("-k", type=parse_sizes,
+                        help="Inner dimension K of the gemm kernel. If not specified, defaults to n.\n"
+                             "Accepts lists/ranges like -n.")
+    parser.add_argument("--transpose_a", action="store_true", help="gemm: pass A as [K, M] (its native layout).")
+    parser.add_argument("--transpose_b", action="store_true", help="gemm: pass B as [N, K].")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="gemm: run a batched GEMM over this many (A, B) pairs; 0 for a single 2D GEMM.")
+    parser.add_argument("--bias", action="store_true", help="gemm: add a bias vector of length N.")
+    parser.add_argument("--tiles_m", type=int, help="gemm: 128-row PSUM tiles per output block. Defaults to the\n"
+                                                    "--autotune result for the shape, else 2.")
+    parser.add_argument("--tiles_n", type=int, help="gemm: 512-column PSUM tiles per output block. Defaults to the\n"
+                                                    "--autotune result for the shape, else 2.")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16"],
+                        help="gemm: dtype of the operands and the output.")
+    parser.add_argument("--buffer_depth", type=int, default=1,
+                        help=f"Also benchmark {', '.join(sorted(buffered_kernels))} with this many input buffers\n"
+                             "in flight, and report the bandwidth with and without them.")
+    parser.add_argument("--num-cores", "--num_cores", dest="num_cores", type=int, default=1,
+                        help=f"Launch the kernels over this many NeuronCores (SPMD; {', '.join(sorted(spmd_kernels))} only).")
     args = parser.parse_args()
+    if args.num_cores > 1 and not set(args.kernel) <= spmd_kernels:
+        parser.error(f"--num-cores > 1 is only supported for {', '.join(sorted(spmd_kernels))}")
+    tuning_db = TuningDB(args.tuning_db)
+
+    # The elementwise kernel's inputs and program come from --expr
+    if "elementwise" in args.kernel:
+        scalars = dict(binding.split("=", 1) for binding in args.scalar)
+        input_names, program = parse_expression(args.expr, {name: float(value) for name, value in scalars.items()})
+        if args.per_partition and any(n % 128 for n in args.n):
+            parser.error("--per_partition needs vector sizes that are multiples of 128")
+
+    # Generate random input arrays for every (kernel, size) point
+    cases = []
+    for name in args.kernel:
+        for n in args.n:
+            if name_to_kernel[name] == matrix_transpose:
+                for m in args.m or [n]:
+                    cases.append((name, [np.random.rand(m, n).astype(np.float32)]))
+            elif name_to_kernel[name] == matmul_tiled:
+                for m in args.m or [n]:
+                    for k in args.k or [n]:
+                        batch = (args.batch,) if args.batch else ()
+                        a_shape = batch + ((k, m) if args.transpose_a else (m, k))
+                        b_shape = batch + ((n, k) if args.transpose_b else (k, n))
+                        operands = [np.random.rand(*a_shape).astype(args.dtype), np.random.rand(*b_shape).astype(args.dtype)]
+                        if args.bias:
+                            operands.append(np.random.rand(n).astype(args.dtype))
+                        cases.append((name, operands))
+            elif name_to_kernel[name] == fused_elementwise_stream:
+                shapes = [(128, 1) if input_name in args.per_partition else (n,) for input_name in input_names]
+                cases.append((name, [np.random.rand(*shape).astype(np.float32) for shape in shapes]))
+            else:
+                a = np.random.rand(n).astype(np.float32)
+                b = np.random.rand(n).astype(np.float32)
+                cases.append((name, [a, b]))
+
+    # gemm options given on the command line; tiles_m / tiles_n left unset
+    # come from the tuning database, or the kernel's defaults
+    gemm_kwargs = {option: getattr(args, option) for option in gemm_options if getattr(args, option) is not None}
+    gemm_layout = {option: gemm_kwargs[option] for option in gemm_layout_options}
+
+    if args.autotune:
+        for name, kernel_args in cases:
+            if name in candidates_by_kernel:
+                autotune_kernel(name, *kernel_args, tuning_db=tuning_db,
+                                kernel_kwargs=gemm_layout if name == "gemm" else None)
+
+    # Pick up tuned parameters for each size, if any
+    kernel_kwargs = [tuning_db.lookup(*tuning_point(name, kernel_args, gemm_layout), kernel_args[0].dtype) or {}
+                     for name, kernel_args in cases]
+    kernel_kwargs = [{**params, "program": program} if name == "elementwise" else params
+                     for (name, _), params in zip(cases, kernel_kwargs)]
+    kernel_kwargs = [{**params, **gemm_kwargs} if name == "gemm" else params
+                     for (name, _), params in zip(cases, kernel_kwargs)]
+
+    # Compile and check every kernel up front, keeping the benchmarks serial
+    checks = [None] * len(cases)
+    if args.jobs > 1:
+        pool = make_compile_pool(args.jobs, first_core=args.num_cores, cores_per_job=args.num_cores)
+        checks = [pool.submit(check_correctness_by_name, name, kernel_args, params, args.num_cores)
+                  for (name, kernel_args), params in zip(cases, kernel_kwargs)]
+
+    # Run the specified kernels
+    rows = []
+    for (name, kernel_args), check, params in zip(cases, checks, kernel_kwargs):
+        kernel = name_to_kernel[name]
+        shape = kernel_args[0].shape
+        print(f"\nRunning {kernel.__name__} with shape {shape}")
+        tuned = {key: value for key, value in params.items() if key != "program"}
+        if tuned:
+            print(f"Using tuned parameters {tuned}")
+        profile_name = args.profile_name
+        if profile_name and len(cases) > 1:
+            profile_name = f"{profile_name}_{name}_{'x'.join(map(str, shape))}"
+        stats = benchmark_kernel(kernel, *kernel_args, profile_name=profile_name, kernel_kwargs=params,
+                                 correct=check.result() if check is not None else None, num_cores=args.num_cores)
+
+        num_bytes = bytes_moved(name, kernel_args, params)
+        row = {
+            "kernel": name,
+            "shape": "x".join(map(str, shape)),
+            "params": ",".join(f"{key}={value}" for key, value in tuned.items()),
+            "expr": args.expr if name == "elementwise" else "",
+            "num_cores": args.num_cores,
+            "buffer_depth": 1,
+            **stats,
+            "bytes": num_bytes,
+            "bandwidth_gbps": bandwidth_gbps(num_bytes, stats["p50_us"]),
+        }
+        if name == "gemm":
+            flops = gemm_flops(kernel_args, params)
+            row |= {
+                "flops": flops,
+                "tflops": tflops(flops, stats["p50_us"]),
+                "mfu": mfu(flops, stats["p50_us"], kernel_args[0].dtype),
+            }
+            print(f"\nThroughput: {row['tflops']:.2f} TFLOP/s, MFU {row['mfu']:.1%}")
+        rows.append(row)
+
+        if args.buffer_depth > 1 and name in buffered_kernels:
+            print(f"\nWith buffer_depth={args.buffer_depth}:")
+            buffered_stats = benchmark_kernel(kernel, *kernel_args, kernel_kwargs={**params, "buffer_depth": args.buffer_depth},
+                                              num_cores=args.num_cores)
+            buffered_row = row | {"buffer_depth": args.buffer_depth, **buffered_stats,
+                                  "bandwidth_gbps": bandwidth_gbps(num_bytes, buffered_stats["p50_us"])}
+            rows.append(buffered_row)
+            print(f"\nBandwidth: {row['bandwidth_gbps']:.1f} GB/s unbuffered, "
+                  f"{buffered_row['bandwidth_gbps']:.1f} GB/s with buffer_depth={args.buffer_depth} "
+                  f"({buffered_row['bandwidth_gbps'] / row['bandwidth_gbps'] - 1:+.1%})")
+
+    if args.jobs > 1:
+        pool.shutdown()
+
+    if args.sweep_out:
+        write_results(args.sweep_out, rows)
+        print(f"\nWrote {len(rows)} results to {args.sweep_out}")
 
-    # Generate random input arrays
-    kernel = name_to_kernel[args.kernel]
-    if kernel == matrix_transpose:
-        mat = np.random.rand(args.m or args.n, args.n).astype(np.float32)
-        kernel_args = [mat]
-        print(f"\nRunning {kernel.__name__} with shape {mat.shape}")
-    else:
-        a = np.random.rand(args.n).astype(np.float32)
-        b = np.random.rand(args.n).astype(np.float32)
-        kernel_args = [a, b]
-        print(f"\nRunning {kernel.__name__} with shape {a.shape}")
-    
-    # Run the specified kernel
-    benchmark_kernel(kernel, *kernel_args, profile_name=args.profile_name)
-    
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
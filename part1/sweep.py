@@ -0,0 +1,136 @@
+"""
+Helpers for run_benchmark.py sweeps: size ranges, latency statistics,
+effective bandwidth, GEMM throughput, and CSV/JSON output.
+"""
+
+import csv
+import json
+
+import ml_dtypes
+import numpy as np
+
+from latency import latency_samples
+
+# Dense tensor engine throughput of one NeuronCore, in FLOP/s; fp8 runs at
+# twice the 16-bit rate. The same table as PEAK_FLOPS_BY_DTYPE in
+# part2/cost_model.py, which the conv cost model uses: keep the two in step
+PEAK_FLOPS_BY_DTYPE = {
+    np.dtype(np.float32): 22.6e12,
+    np.dtype(np.float16): 83.4e12,
+    np.dtype(ml_dtypes.bfloat16): 83.4e12,
+    np.dtype(ml_dtypes.float8_e4m3fn): 166.8e12,
+    np.dtype(ml_dtypes.float8_e5m2): 166.8e12,
+}
+
+
+def parse_sizes(spec):
+    """
+    Parse a size specification into a list of ints.
+
+    Accepted forms:
+        "4096"                 a single size
+        "1024,2048,8192"       an explicit list
+        "1024:8192:1024"       an inclusive linear range (start:stop:step)
+        "1024:1048576:x2"      an inclusive geometric range (start:stop:xfactor)
+    """
+    if "," in spec:
+        return [int(size) for size in spec.split(",")]
+    if ":" not in spec:
+        return [int(spec)]
+
+    start, stop, step = (spec.split(":") + ["x2"])[:3]
+    start, stop = int(start), int(stop)
+    sizes = []
+    if step.startswith("x"):
+        factor = int(step[1:])
+        assert factor > 1, f"Geometric factor must be > 1 in {spec!r}"
+        while start <= stop:
+            sizes.append(start)
+            start *= factor
+    else:
+        sizes = list(range(start, stop + 1, int(step)))
+    return sizes
+
+
+def latency_stats(nc_latency):
+    """
+    Latency percentiles of an nki.benchmark run, plus the min, max and mean of
+    its raw samples; those three are None when the run has no raw samples.
+    """
+    samples = latency_samples(nc_latency)
+    return {
+        "p50_us": nc_latency.get_latency_percentile(50),
+        "p90_us": nc_latency.get_latency_percentile(90),
+        "p99_us": nc_latency.get_latency_percentile(99),
+        "min_us": float(samples.min()) if samples is not None else None,
+        "max_us": float(samples.max()) if samples is not None else None,
+        "mean_us": float(samples.mean()) if samples is not None else None,
+    }
+
+
+def bytes_moved(kernel_name, args, kernel_kwargs=None):
+    """HBM bytes read plus written by one kernel invocation."""
+    if kernel_name == "transpose":
+        # read the matrix once, write its transpose once
+        return 2 * args[0].nbytes
+    if kernel_name == "gemm":
+        # read every operand once, write C once
+        return sum(arg.nbytes for arg in args) + gemm_out_elements(args, kernel_kwargs) * args[0].itemsize
+    if kernel_name == "elementwise":
+        # read every input once, write one vector as long as the streams
+        return sum(arg.nbytes for arg in args) + next(arg for arg in args if arg.ndim == 1).nbytes
+    # read a and b, write a + b
+    return 3 * args[0].nbytes
+
+
+def bandwidth_gbps(num_bytes, latency_us):
+    return num_bytes / (latency_us * 1e-6) / 1e9
+
+
+def gemm_dims(args, kernel_kwargs=None):
+    """(batch, M, N, K) of a matmul_tiled call on `args` (a, b[, bias])."""
+    kernel_kwargs = kernel_kwargs or {}
+    a, b = args[0], args[1]
+    batch = a.shape[0] if a.ndim == 3 else 1
+    if kernel_kwargs.get("transpose_a"):
+        K, M = a.shape[-2:]
+    else:
+        M, K = a.shape[-2:]
+    N = b.shape[-2] if kernel_kwargs.get("transpose_b") else b.shape[-1]
+    return batch, M, N, K
+
+
+def gemm_out_elements(args, kernel_kwargs=None):
+    batch, M, N, _ = gemm_dims(args, kernel_kwargs)
+    return batch * M * N
+
+
+def gemm_flops(args, kernel_kwargs=None):
+    """Multiply-adds of a matmul_tiled call, counted as 2 FLOPs each."""
+    batch, M, N, K = gemm_dims(args, kernel_kwargs)
+    return 2 * batch * M * N * K
+
+
+def tflops(flops, latency_us):
+    return flops / (latency_us * 1e-6) / 1e12
+
+
+def mfu(flops, latency_us, dtype):
+    """Fraction of the tensor engine's peak for `dtype` achieved."""
+    return flops / (latency_us * 1e-6) / PEAK_FLOPS_BY_DTYPE[np.dtype(dtype)]
+
+
+def write_results(path, rows):
+    """Write sweep rows to `path`, as JSON if it ends in .json and as CSV otherwise."""
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -6,6 +6,10 @@ import neuronxcc.nki.language as nl
 import neuronxcc.nki.isa as nisa
 from neuronxcc.nki import baremetal
 
+from conv_shape import (
+    STATIONARY_PSUM_TILES, ConvShape, channel_tiles, grouped_weight_blocks, is_depthwise, stacks_taps,
+)
+
 
 """
 A fused convolution - maxpool kernel that you need to implement for Part 2.
@@ -14,94 +18,246 @@ Parameters:
     X: the input tensor
     W: the weights of the convolution filters.
     bias: the biases of the convolution filters.
-    pool_size: the size of the pool filter and pool stride.
+    pool_size: the size of the pool filter (and, by default, the pool stride).
 
 expect: X.shape == [batch_size, in_channels, input_height, input_width]
 expect: W.shape == [out_channels, in_channels, filter_height, filter_width]
 expect: bias.shape == [out_channels]
 expect: filter_height == filter_width
-expect: pool_size == 1 || pool_size == 2
-expect: input_channels % 128 == 0
-expect: output_channels % 128 == 0
+expect: pool_size >= 1 and pool_stride >= 1 (pool_stride defaults to pool_size)
+expect: pool_size <= out_height and pool_size <= out_width
+expect: pool_type == "max" || pool_type == "avg"
+
+Pool windows may overlap (pool_stride < pool_size) or leave gaps (pool_stride >
+pool_size); rows and columns past the last whole window are dropped.
+
+Channel counts need not be multiples of 128: the last channel tile is partial,
+zero-filled in SBUF and stored with a DMA of only its valid partitions.
+
+out_height = (input_height + 2 * pad_size - dilation * (filter_height - 1) - 1) // stride + 1
+out_width = (input_width + 2 * pad_size - dilation * (filter_width - 1) - 1) // stride + 1
 
-out_height = input_height - filter_height + 1
-out_width = input_width - filter_width + 1
+which is input_height - filter_height + 1 (and likewise for the width) for a
+valid, stride-1, undilated convolution, and
 
-out_pool_height = out_height // pool_size
-out_pool_width = out_width // pool_size
+out_pool_height = (out_height - pool_size) // pool_stride + 1
+out_pool_width = (out_width - pool_size) // pool_stride + 1
+
+which is out_height // pool_size, out_width // pool_size for the default stride.
 
 The shape of the output should be [batch_size, out_channels, out_pool_height, out_pool_width]
 
+Layout:
+    layout: "NCHW" (the default) or "NHWC". With "NHWC", X is
+        [batch_size, input_height, input_width, in_channels] and the output
+        [batch_size, out_pool_height, out_pool_width, out_channels]; W and
+        bias are unchanged. The layout change happens in SBUF on the way in
+        and out: each input band is DMAed with the pixels on the partitions,
+        up to 128 columns at a time, and every row is transposed to put the
+        channels on the partitions with nc_transpose. The pooled output tiles
+        are transposed back before their DMA. Runs the row-band schedule.
+
+Tuning options:
+    row_reuse: load each input row band once per image and c_in tile, and reuse
+        it for every output-channel tile and filter row, instead of DMAing
+        filter_height input rows per output row per c_out tile.
+    band_rows: conv output rows per band in row_reuse mode, rounded down to
+        whole pool windows. Chosen from the SBUF budget when None.
+    pack_rows: accumulate as many output rows as fit the matmul moving free
+        dimension into one PSUM tile, issuing each matmul over all of them at
+        once. Pays off on narrow images; implies row_reuse.
+    prepacked: W was produced by prepack_conv_weights, i.e. has shape
+        [in_channels, out_channels, filter_height, filter_width], and is loaded
+        with plain DMAs instead of being transposed on every call.
+    buffer_depth: in the per-row schedule (no row_reuse), cycle the temp_X
+        input rows through this many SBUF buffers, DMAing the rows of c_in
+        tile k + buffer_depth - 1 while tile k's matmuls run. 1 leaves the
+        overlap to the scheduler.
+    batch_stationary: keep the whole batch in SBUF and put the output-channel
+        tile loop outside the image loop, applying each weight tile to several
+        images' PSUM tiles in a row. None (the default) picks it when
+        batch_size > 1, an image's conv output rows per PSUM tile stream no
+        more than 128 columns, and the batch fits BATCH_STATIONARY_SBUF_BUDGET;
+        see choose_batch_stationary in conv_shape.py.
+
+SPMD launch:
+    Launched over a 1D grid (e.g. fused_conv2d_maxpool[nl.nc(2)]), each program
+    computes its share of the output, split by nl.program_id(0):
+    shard_by: "batch" (images; batch_size must divide evenly) or "c_out"
+        (output-channel tiles; out_channels must divide into whole tiles
+        evenly). The weight prologue is not split.
+
+Convolution options:
+    pad_size: zero padding on each side of both spatial axes. The border is
+        zero-filled in SBUF and only the real rows and columns are DMAed, so
+        the padded input never exists in HBM.
+    stride: convolution stride along both spatial axes.
+    dilation: spacing between filter taps along both spatial axes.
+    groups: split the channels into this many groups, each convolved with
+        its own in_channels // groups input channels, as torch's conv2d
+        groups. W then has shape [out_channels, in_channels // groups,
+        filter_height, filter_width]. Only the c_in tiles holding an output
+        tile's groups are multiplied, and only those weight blocks are
+        loaded. Depthwise convs (groups == in_channels == out_channels)
+        run on the vector engine: one multiply-accumulate per tap over a
+        whole band, with each channel's weights as per-partition scalars.
+        Not with prepacked weights or shard_by="c_out".
+
+Precision:
+    X and W share one dtype: float32, float16, bfloat16, float8_e4m3 or
+    float8_e5m2. Products are always accumulated in fp32 PSUM, and the bias is
+    applied in fp32.
+    out_dtype: dtype of the output, by name (one of OUTPUT_DTYPES); None keeps
+        X's dtype. The single rounding happens at PSUM eviction, so e.g. fp8
+        inputs with out_dtype="bfloat16" only lose precision on the inputs.
+
+Epilogue options (applied when PSUM is evicted, before pooling):
+    activation: None, "relu", "gelu" or "silu". Bias and activation are applied
+        by the single nisa.activation instruction that moves each result out
+        of PSUM.
+    pool_type: "max" or "avg".
+    pool_stride: stride of the pool window; defaults to pool_size. Anything
+        other than non-overlapping max pooling runs the row-band schedule.
+
+Schedules by filter size:
+    1x1 (stride 1, no padding): a GEMM over the flattened pixels. The rows of
+        a band are contiguous in SBUF, so each nc_matmul streams a full
+        gemm_moving_fmax pixels regardless of out_width.
+    5x5 and larger: always the row-band schedule with packed rows, so every
+        input row is DMAed once per band and each matmul covers a whole PSUM
+        tile of rows, however many taps the filter has.
+    in_channels * filter_width <= 128 (any filter wider than 1): the filter
+        columns are stacked on the partitions, both in the weights and in
+        each input band (one SBUF-to-SBUF DMA per column), so a filter row
+        is one matmul instead of filter_width.
+
 """
 @nki.compiler.skip_middle_end_transformations
 @nki.jit
-def fused_conv2d_maxpool(X, W, bias, pool_size=1):
-    batch_size, in_channels, input_height, input_width = X.shape
-    out_channels, in_channels_, filter_height, filter_width = W.shape
+def fused_conv2d_maxpool(
+    X, W, bias, pool_size=1, row_reuse=False, band_rows=None, pack_rows=False, prepacked=False,
+    activation=None, pool_type="max", pool_stride=None, pad_size=0, stride=1, dilation=1, batch_stationary=None,
+    shard_by="batch", out_dtype=None, buffer_depth=1, groups=1, layout="NCHW",
+):
+    assert layout in ("NCHW", "NHWC"), f"Unsupported layout {layout}"
+    if layout == "NHWC":
+        batch_size, input_height, input_width, in_channels = X.shape
+    else:
+        batch_size, in_channels, input_height, input_width = X.shape
+    if prepacked:
+        in_channels_, out_channels, filter_height, filter_width = W.shape
+    else:
+        out_channels, in_channels_, filter_height, filter_width = W.shape
     out_channels_ = bias.shape[0]
 
     assert (
-        in_channels_ == in_channels and out_channels_ == out_channels
+        in_channels_ * groups == in_channels and out_channels_ == out_channels
     ), f"Shape mismatch. {in_channels}, {in_channels_}, {out_channels}, {out_channels_}"
+    assert out_channels % groups == 0, f"{groups} groups do not split {out_channels} output channels"
+    assert groups == 1 or not prepacked, "Grouped convs take W in the original layout"
+    assert W.dtype == X.dtype, f"X and W must share a dtype, got {X.dtype} and {W.dtype}"
 
-    out_height = input_height - filter_height + 1
-    out_width = input_width - filter_width + 1
+    out_height = (input_height + 2 * pad_size - dilation * (filter_height - 1) - 1) // stride + 1
+    out_width = (input_width + 2 * pad_size - dilation * (filter_width - 1) - 1) // stride + 1
 
-    out_pool_height = out_height // pool_size
-    out_pool_width = out_width // pool_size
+    if pool_stride is None:
+        pool_stride = pool_size
+    out_pool_height = (out_height - pool_size) // pool_stride + 1
+    out_pool_width = (out_width - pool_size) // pool_stride + 1
+    assert pool_type in ("max", "avg"), f"Unsupported pool_type {pool_type}"
+    assert pool_size >= 1 and pool_stride >= 1, f"Unsupported {pool_size=}, {pool_stride=}"
+    assert pool_size <= min(out_height, out_width), f"pool_size={pool_size} exceeds the conv output"
+    act_fn = ACTIVATIONS[activation]
     
-    # Can assume multiple of 128 to avoid using mask
-    assert in_channels % 128 == out_channels % 128 == 0
-
     # Can assume one PSUM bank can at least fit one row of the pixels
     assert nl.tile_size.gemm_moving_fmax >= out_width
 
     # Initialize output array
+    out_shape = (batch_size, out_channels, out_pool_height, out_pool_width)
+    if layout == "NHWC":
+        out_shape = (batch_size, out_pool_height, out_pool_width, out_channels)
     X_out = nl.ndarray(
-        shape=(batch_size, out_channels, out_pool_height, out_pool_width),
-        dtype=X.dtype,
-        buffer=nl.hbm,
+        shape=out_shape,
+        dtype=X.dtype if out_dtype is None else OUTPUT_DTYPES[out_dtype],
+        buffer=nl.shared_hbm,
     )
 
     # initialize tiling dimensions
     c_out_par_dim = nl.tile_size.gemm_stationary_fmax       #128
-    num_c_out_tiles = out_channels // c_out_par_dim
+    num_c_out_tiles = -(-out_channels // c_out_par_dim)
 
     c_in_par_dim = nl.tile_size.pmax        # 128
-    num_c_in_tiles = in_channels // c_in_par_dim
+    num_c_in_tiles = -(-in_channels // c_in_par_dim)
+
+    # a partial last channel tile on either side
+    ragged = in_channels % c_in_par_dim != 0 or out_channels % c_out_par_dim != 0
+
+    # this program's share of the images and output-channel tiles
+    assert shard_by in ("batch", "c_out"), f"Unsupported shard_by {shard_by}"
+    batch_shard, c_out_shard = (0, batch_size), (0, num_c_out_tiles)
+    if shard_by == "batch":
+        batch_shard = spmd_shard(batch_size)
+    else:
+        assert out_channels % c_out_par_dim == 0, "shard_by='c_out' needs whole output-channel tiles"
+        assert groups == 1, "Grouped convs shard by batch"
+        c_out_shard = spmd_shard(num_c_out_tiles)
+    batch_start, local_batch = batch_shard
+    c_out_tile_start, local_c_out_tiles = c_out_shard
 
     rows_per_chunk = pool_size
     chunks_in_image = out_pool_height
 
-    # preprocess all the weights
-    W = W.reshape((num_c_out_tiles, c_out_par_dim, num_c_in_tiles, c_in_par_dim, filter_height, filter_width))
-    w_transpose = nl.ndarray(
-        shape=((c_in_par_dim, num_c_in_tiles, c_out_par_dim, num_c_out_tiles, filter_height, filter_width)),
-        dtype=X.dtype,
-        buffer=nl.sbuf,
-    )
-    w_sbuf = nl.ndarray(
-        shape=((c_out_par_dim, num_c_out_tiles, c_in_par_dim, num_c_in_tiles, filter_height, filter_width)),
-        dtype=X.dtype,
-        buffer=nl.sbuf,
+    w_transpose = load_conv_weights(W, prepacked, groups)
+
+    conv = ConvShape(
+        (batch_size, in_channels, input_height, input_width), (out_channels, in_channels, filter_height, filter_width),
+        pool_size, pool_stride=pool_stride, pack_rows=pack_rows, band_rows=band_rows, dtype=X.dtype,
+        pad_size=pad_size, stride=stride, dilation=dilation, batch_stationary=batch_stationary,
+        batch_shard=batch_shard, c_out_shard=c_out_shard, out_dtype=X_out.dtype, groups=groups, layout=layout,
     )
 
-    # pretranspose all the weights in our weight matrix
-    for out_tile in nl.affine_range(num_c_out_tiles):
-        for in_tile in nl.affine_range(num_c_in_tiles):
-            nisa.dma_copy(src=W[out_tile, :, in_tile, :, :], dst=w_sbuf[:, out_tile, :, in_tile, : ,:])
-            for i in nl.affine_range(filter_height):
-                for j in nl.affine_range(filter_width):
-                    w_psum = nisa.nc_transpose(w_sbuf[:, out_tile, :, in_tile, i, j])
-                    w_transpose[:, in_tile, :, out_tile, i, j] = nisa.tensor_copy(w_psum, engine=nisa.vector_engine)
+    # the per-row schedule below only knows valid, stride-1 convolutions
+    # followed by non-overlapping max pooling that tiles the output width,
+    # on whole NCHW channel tiles
+    if (
+        pool_type != "max" or pool_stride != pool_size or out_width % pool_size != 0
+        or pad_size > 0 or stride != 1 or dilation != 1 or ragged
+    ):
+        row_reuse = True
+    # and 1x1, large, tap-stacked and grouped convs have row-band schedules of their own
+    if conv.gemm or conv.pack_rows or conv.stack_taps or groups > 1:
+        row_reuse = True
+    if layout == "NHWC":
+        row_reuse = True
+
+    if conv.batch_stationary:
+        conv_batch_stationary(X, X_out, bias, w_transpose, conv, act_fn, pool_type)
+        return X_out
+
+    if row_reuse:
+        first_interior, num_interior, edge_bands = conv.band_schedule()
+
+        for b_local in nl.affine_range(conv.batch_size):
+            b = conv.batch_start + b_local
+            for band in nl.affine_range(num_interior):
+                conv_row_band(
+                    X, X_out, bias, w_transpose, conv, act_fn, pool_type,
+                    b, (first_interior + band) * conv.band_pool_rows, conv.band_pool_rows,
+                )
+            # bands that overlap the padding or are cut short, with static row ranges
+            for pool_row_start, band_pool_rows in edge_bands:
+                conv_row_band(
+                    X, X_out, bias, w_transpose, conv, act_fn, pool_type,
+                    b, pool_row_start, band_pool_rows, edge=True,
+                )
+        return X_out
 
     # process the images in batches
-    for b in nl.affine_range(batch_size):
-        for c_out_ind in nl.affine_range(num_c_out_tiles):
-            bias_temp = nl.load(
-                bias[c_out_ind * c_out_par_dim : (c_out_ind + 1) * c_out_par_dim], 
-                dtype=bias.dtype,
-            )
+    for b_local in nl.affine_range(local_batch):
+        b = batch_start + b_local
+        for c_out_local in nl.affine_range(local_c_out_tiles):
+            c_out_ind = c_out_tile_start + c_out_local
+            bias_temp = load_bias(bias, c_out_ind)
             for row_chunk in nl.affine_range(chunks_in_image):
                 pool_sbuf = nl.ndarray(
                     shape=(c_out_par_dim, out_width, rows_per_chunk),
@@ -109,20 +265,25 @@ def fused_conv2d_maxpool(X, W, bias, pool_size=1):
                     buffer=nl.sbuf,
                 )
                 for out_row in nl.affine_range(rows_per_chunk):
-                    res_psum = nl.zeros((c_out_par_dim, out_width * 1), nl.float32, buffer=nl.psum)
-                    for c_in_ind in nl.affine_range(num_c_in_tiles):
-                        temp_X = nl.ndarray(
-                            shape=(c_in_par_dim, filter_height, input_width),
-                            dtype=X.dtype,
-                            buffer=nl.sbuf,
+                    if buffer_depth > 1:
+                        res_psum = conv_row_buffered(
+                            X, w_transpose, b, row_chunk * rows_per_chunk + out_row, c_out_ind, out_width, buffer_depth
                         )
-                        nisa.dma_copy(dst=temp_X, src=X[b, c_in_ind * c_in_par_dim:(c_in_ind+1) * c_in_par_dim, row_chunk*rows_per_chunk+out_row : row_chunk*rows_per_chunk+out_row+filter_height, :])
-                        for i in nl.affine_range(filter_height):
-                            for j in nl.affine_range(filter_width):
-                                res_psum += nisa.nc_matmul(w_transpose[:, c_in_ind, :, c_out_ind, i, j], temp_X[:, i, j:j+out_width])
+                    else:
+                        res_psum = nl.zeros((c_out_par_dim, out_width * 1), nl.float32, buffer=nl.psum)
+                        for c_in_ind in nl.affine_range(num_c_in_tiles):
+                            temp_X = nl.ndarray(
+                                shape=(c_in_par_dim, filter_height, input_width),
+                                dtype=X.dtype,
+                                buffer=nl.sbuf,
+                            )
+                            nisa.dma_copy(dst=temp_X, src=X[b, c_in_ind * c_in_par_dim:(c_in_ind+1) * c_in_par_dim, row_chunk*rows_per_chunk+out_row : row_chunk*rows_per_chunk+out_row+filter_height, :])
+                            for i in nl.affine_range(filter_height):
+                                for j in nl.affine_range(filter_width):
+                                    res_psum += nisa.nc_matmul(w_transpose[:, c_in_ind, :, c_out_ind, i, j], temp_X[:, i, j:j+out_width])
     
-                    pool_sbuf[:, :, out_row] = nisa.tensor_copy(res_psum, engine=nisa.vector_engine)
-                    pool_sbuf[:, :, out_row] = nisa.tensor_tensor(pool_sbuf[:, :, out_row], bias_temp, op=nl.add)
+                    # evict PSUM with bias and activation applied on the way out
+                    pool_sbuf[:, :, out_row] = nisa.activation(op=act_fn, data=res_psum, bias=bias_temp, dtype=X_out.dtype)
 
                 # perform pooling if necessary:
                 
@@ -132,3 +293,768 @@ def fused_conv2d_maxpool(X, W, bias, pool_size=1):
                 pool_sbuf_copy = nisa.tensor_reduce(nl.max, pool_sbuf, axis=[2])
                 nisa.dma_copy(dst=X_out[b, c_out_ind * c_out_par_dim : (c_out_ind + 1) * c_out_par_dim, row_chunk, :], src=pool_sbuf_copy)
     return X_out
+
+
+
+"""
+Write the conv weights to HBM in the layout fused_conv2d_maxpool computes with,
+so repeated inference calls can skip the per-call transpose.
+
+expect: W.shape == [out_channels, in_channels, filter_height, filter_width]
+
+The output has shape [in_channels, out_channels, filter_height, filter_width];
+pass it to fused_conv2d_maxpool with prepacked=True.
+"""
+@nki.compiler.skip_middle_end_transformations
+@nki.jit
+def prepack_conv_weights(W):
+    out_channels, in_channels, filter_height, filter_width = W.shape
+
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    num_c_out_tiles = out_channels // c_out_par_dim
+    c_in_par_dim = nl.tile_size.pmax
+    num_c_in_tiles = in_channels // c_in_par_dim
+
+    W_packed = nl.ndarray(
+        shape=(in_channels, out_channels, filter_height, filter_width),
+        dtype=W.dtype,
+        buffer=nl.hbm,
+    )
+
+    if in_channels % c_in_par_dim != 0 or out_channels % c_out_par_dim != 0:
+        # partial tiles: one statically sized transpose per tile pair
+        for out_start, out_size in channel_tiles(out_channels, c_out_par_dim):
+            for in_start, in_size in channel_tiles(in_channels, c_in_par_dim):
+                w_packed_sbuf = nl.ndarray((in_size, out_size, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+                transpose_weight_tile(W, w_packed_sbuf, out_start, out_size, in_start, in_size)
+                nisa.dma_copy(
+                    src=w_packed_sbuf,
+                    dst=W_packed[in_start : in_start + in_size, out_start : out_start + out_size, :, :],
+                )
+        return W_packed
+
+    W = W.reshape((num_c_out_tiles, c_out_par_dim, num_c_in_tiles, c_in_par_dim, filter_height, filter_width))
+    for out_tile in nl.affine_range(num_c_out_tiles):
+        for in_tile in nl.affine_range(num_c_in_tiles):
+            w_sbuf = nl.ndarray((c_out_par_dim, c_in_par_dim, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+            w_packed_sbuf = nl.ndarray((c_in_par_dim, c_out_par_dim, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+            nisa.dma_copy(src=W[out_tile, :, in_tile, :, :, :], dst=w_sbuf)
+            for i in nl.affine_range(filter_height):
+                for j in nl.affine_range(filter_width):
+                    w_psum = nisa.nc_transpose(w_sbuf[:, :, i, j])
+                    w_packed_sbuf[:, :, i, j] = nisa.tensor_copy(w_psum, engine=nisa.vector_engine)
+            nisa.dma_copy(
+                src=w_packed_sbuf,
+                dst=W_packed[in_tile * c_in_par_dim:(in_tile+1) * c_in_par_dim, out_tile * c_out_par_dim:(out_tile+1) * c_out_par_dim, :, :],
+            )
+
+    return W_packed
+
+"""
+Load the conv weights into SBUF as the stationary matmul tiles, w_transpose
+of shape (128, num_c_in_tiles, 128, num_c_out_tiles, filter_height,
+filter_width) with the input channels on the partitions. W is either in the
+original [out, in, kh, kw] layout and transposed tap by tap on the tensor
+engine, or prepacked by prepack_conv_weights and DMAed as is. When the filter columns
+are stacked (stacks_taps), the weights come from load_stacked_weights.
+
+Grouped convs (W of shape [out, in // groups, kh, kw]) load only the diagonal
+blocks of w_transpose, from load_grouped_weights; depthwise ones instead get
+the per-channel scalars of load_depthwise_weights.
+"""
+def load_conv_weights(W, prepacked=False, groups=1):
+    c_in_par_dim = nl.tile_size.pmax
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    if groups > 1:
+        out_channels, group_in_channels, _, _ = W.shape
+        if is_depthwise(group_in_channels * groups, out_channels, groups):
+            return load_depthwise_weights(W)
+        return load_grouped_weights(W, groups)
+    if prepacked:
+        in_channels, out_channels, filter_height, filter_width = W.shape
+    else:
+        out_channels, in_channels, filter_height, filter_width = W.shape
+    if stacks_taps(in_channels, filter_width):
+        return load_stacked_weights(W, prepacked)
+    num_c_in_tiles = -(-in_channels // c_in_par_dim)
+    num_c_out_tiles = -(-out_channels // c_out_par_dim)
+    ragged = in_channels % c_in_par_dim != 0 or out_channels % c_out_par_dim != 0
+
+    w_transpose_shape = (c_in_par_dim, num_c_in_tiles, c_out_par_dim, num_c_out_tiles, filter_height, filter_width)
+    if ragged:
+        # the partial tiles' unused rows and columns must multiply as zeros
+        w_transpose = nl.zeros(w_transpose_shape, dtype=W.dtype, buffer=nl.sbuf)
+        load_ragged_weights(W, w_transpose, prepacked)
+    elif prepacked:
+        w_transpose = nl.ndarray(w_transpose_shape, dtype=W.dtype, buffer=nl.sbuf)
+        # the packed layout already matches w_transpose tile for tile
+        for in_tile in nl.affine_range(num_c_in_tiles):
+            for out_tile in nl.affine_range(num_c_out_tiles):
+                nisa.dma_copy(
+                    src=W[in_tile * c_in_par_dim:(in_tile+1) * c_in_par_dim, out_tile * c_out_par_dim:(out_tile+1) * c_out_par_dim, :, :],
+                    dst=w_transpose[:, in_tile, :, out_tile, :, :],
+                )
+    else:
+        w_transpose = nl.ndarray(w_transpose_shape, dtype=W.dtype, buffer=nl.sbuf)
+        # preprocess all the weights
+        W = W.reshape((num_c_out_tiles, c_out_par_dim, num_c_in_tiles, c_in_par_dim, filter_height, filter_width))
+        w_sbuf = nl.ndarray(
+            shape=((c_out_par_dim, num_c_out_tiles, c_in_par_dim, num_c_in_tiles, filter_height, filter_width)),
+            dtype=W.dtype,
+            buffer=nl.sbuf,
+        )
+
+        # pretranspose all the weights in our weight matrix
+        for out_tile in nl.affine_range(num_c_out_tiles):
+            for in_tile in nl.affine_range(num_c_in_tiles):
+                nisa.dma_copy(src=W[out_tile, :, in_tile, :, :], dst=w_sbuf[:, out_tile, :, in_tile, : ,:])
+                for i in nl.affine_range(filter_height):
+                    for j in nl.affine_range(filter_width):
+                        w_psum = nisa.nc_transpose(w_sbuf[:, out_tile, :, in_tile, i, j])
+                        w_transpose[:, in_tile, :, out_tile, i, j] = nisa.tensor_copy(w_psum, engine=nisa.vector_engine)
+
+    return w_transpose
+
+"""
+(start, count) of this SPMD program's share of `total` units of work, split
+evenly along axis 0 of the launch grid; (0, total) outside an SPMD launch.
+Same contract as part 1's kernels.spmd_shard, except that the conv kernel has
+no leftover handling, so `total` must divide evenly.
+"""
+def spmd_shard(total):
+    if nl.program_ndim() == 0:
+        return 0, total
+    num_shards = nl.num_programs(axes=0)
+    assert total % num_shards == 0, f"{total} units do not split evenly over {num_shards} programs"
+    count = total // num_shards
+    return nl.program_id(axis=0) * count, count
+
+
+"""
+Load W[out_start : out_start + out_size, in_start : in_start + in_size] and
+transpose every filter tap into `dst`, an (in_size, out_size, kh, kw) SBUF view.
+"""
+def transpose_weight_tile(W, dst, out_start, out_size, in_start, in_size):
+    _, _, filter_height, filter_width = W.shape
+    w_sbuf = nl.ndarray((out_size, in_size, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+    nisa.dma_copy(src=W[out_start : out_start + out_size, in_start : in_start + in_size, :, :], dst=w_sbuf)
+    for i in nl.affine_range(filter_height):
+        for j in nl.affine_range(filter_width):
+            w_psum = nisa.nc_transpose(w_sbuf[:, :, i, j])
+            dst[:, :, i, j] = nisa.tensor_copy(w_psum, engine=nisa.vector_engine)
+
+
+"""
+Fill a zeroed w_transpose from W when a channel count is not a multiple of
+128. Each tile pair is written into the top-left corner of its 128x128 slot,
+so the partial tiles' padding stays zero.
+"""
+def load_ragged_weights(W, w_transpose, prepacked):
+    c_in_par_dim = nl.tile_size.pmax
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    if prepacked:
+        in_channels, out_channels, _, _ = W.shape
+    else:
+        out_channels, in_channels, _, _ = W.shape
+
+    for out_tile, (out_start, out_size) in enumerate(channel_tiles(out_channels, c_out_par_dim)):
+        for in_tile, (in_start, in_size) in enumerate(channel_tiles(in_channels, c_in_par_dim)):
+            if prepacked:
+                nisa.dma_copy(
+                    src=W[in_start : in_start + in_size, out_start : out_start + out_size, :, :],
+                    dst=w_transpose[0:in_size, in_tile, 0:out_size, out_tile, :, :],
+                )
+            else:
+                transpose_weight_tile(
+                    W, w_transpose[0:in_size, in_tile, 0:out_size, out_tile, :, :], out_start, out_size, in_start, in_size
+                )
+
+
+"""
+Load the weights of a tap-stacked conv as a w_transpose of shape (128, 1,
+128, num_c_out_tiles, filter_height, 1): partition j * in_channels + c holds
+input channel c of filter column j, matching the bands stack_filter_columns
+builds. Each output-channel tile is transposed (or, prepacked, read) once,
+then every filter column is DMAed into its block of partitions. The unused
+partitions are zero.
+"""
+def load_stacked_weights(W, prepacked):
+    c_in_par_dim = nl.tile_size.pmax
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    if prepacked:
+        in_channels, out_channels, filter_height, filter_width = W.shape
+    else:
+        out_channels, in_channels, filter_height, filter_width = W.shape
+    num_c_out_tiles = -(-out_channels // c_out_par_dim)
+
+    w_stacked = nl.zeros(
+        (c_in_par_dim, 1, c_out_par_dim, num_c_out_tiles, filter_height, 1), dtype=W.dtype, buffer=nl.sbuf
+    )
+    for out_tile, (out_start, out_size) in enumerate(channel_tiles(out_channels, c_out_par_dim)):
+        if prepacked:
+            w_tile = W[:, out_start : out_start + out_size, :, :]
+        else:
+            w_tile = nl.ndarray((in_channels, out_size, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+            transpose_weight_tile(W, w_tile, out_start, out_size, 0, in_channels)
+        for j in range(filter_width):
+            nisa.dma_copy(
+                dst=w_stacked[j * in_channels : (j + 1) * in_channels, 0, 0:out_size, out_tile, :, 0],
+                src=w_tile[:, :, :, j],
+            )
+    return w_stacked
+
+
+"""
+Load a grouped conv's weights into a zeroed w_transpose of the dense layout,
+transposing only the blocks grouped_weight_blocks lists; everything across
+groups stays zero and is never multiplied (see ConvShape.c_in_tile_span).
+Each block is transposed at partition 0 and DMAed to its offset, like
+load_stacked_weights.
+"""
+def load_grouped_weights(W, groups):
+    c_in_par_dim = nl.tile_size.pmax
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    out_channels, group_in_channels, filter_height, filter_width = W.shape
+    in_channels = group_in_channels * groups
+    num_c_in_tiles = -(-in_channels // c_in_par_dim)
+    num_c_out_tiles = -(-out_channels // c_out_par_dim)
+
+    w_transpose = nl.zeros(
+        (c_in_par_dim, num_c_in_tiles, c_out_par_dim, num_c_out_tiles, filter_height, filter_width),
+        dtype=W.dtype,
+        buffer=nl.sbuf,
+    )
+    for block in grouped_weight_blocks(out_channels, in_channels, groups):
+        out_tile, out_offset, out_start, out_size, in_tile, in_offset, in_start, in_size = block
+        # engines only start at partitions 0/32/64/96, so transpose at
+        # partition 0 and let the DMA place the block at in_offset
+        w_block = nl.ndarray((in_size, out_size, filter_height, filter_width), dtype=W.dtype, buffer=nl.sbuf)
+        transpose_weight_tile(W, w_block, out_start, out_size, in_start, in_size)
+        nisa.dma_copy(
+            dst=w_transpose[in_offset : in_offset + in_size, in_tile, out_offset : out_offset + out_size, out_tile, :, :],
+            src=w_block,
+        )
+    return w_transpose
+
+
+"""
+Load a depthwise conv's weights, W of shape [channels, 1, kh, kw], as float32
+per-partition scalars of shape (128, num_channel_tiles, kh * kw): channel c's
+taps in row c % 128 of tile c // 128, zero past the last channel.
+"""
+def load_depthwise_weights(W):
+    c_par_dim = nl.tile_size.pmax
+    channels, _, filter_height, filter_width = W.shape
+    taps = filter_height * filter_width
+    w_sbuf = nl.zeros((c_par_dim, -(-channels // c_par_dim), taps), dtype=W.dtype, buffer=nl.sbuf)
+    for tile, (start, size) in enumerate(channel_tiles(channels, c_par_dim)):
+        nisa.dma_copy(src=W.reshape((channels, taps))[start : start + size, :], dst=w_sbuf[0:size, tile, :])
+    return nisa.tensor_copy(w_sbuf, dtype=nl.float32)
+
+
+# Activation applied while evicting PSUM; nl.copy is the identity
+ACTIVATIONS = {
+    None: nl.copy,
+    "relu": nl.relu,
+    "gelu": nl.gelu,
+    "silu": nl.silu,
+}
+
+# Output dtypes selectable with out_dtype
+OUTPUT_DTYPES = {
+    "float32": nl.float32,
+    "float16": nl.float16,
+    "bfloat16": nl.bfloat16,
+    "float8_e4m3": nl.float8_e4m3,
+    "float8_e5m2": nl.float8_e5m2,
+}
+
+"""
+Loop over `count` output-channel tiles: affine for dense convs, static for
+grouped ones, so conv.c_in_tile_span is evaluated at trace time.
+"""
+def c_out_tiles(conv, count):
+    return range(count) if conv.groups > 1 else nl.affine_range(count)
+
+
+"""
+Load one output-channel tile of the bias as a (128, 1) float32 column, the
+form nisa.activation takes its per-partition bias in. A partial tile of
+`size` channels is zero-padded.
+"""
+def load_bias(bias, c_out_ind, size=None):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    start = c_out_ind * c_out_par_dim
+    if size is None or size == c_out_par_dim:
+        bias_sbuf = nl.ndarray((c_out_par_dim, 1), dtype=bias.dtype, buffer=nl.sbuf)
+        size = c_out_par_dim
+    else:
+        bias_sbuf = nl.zeros((c_out_par_dim, 1), dtype=bias.dtype, buffer=nl.sbuf)
+    nisa.dma_copy(
+        src=bias.reshape((bias.shape[0], 1))[start : start + size, :],
+        dst=bias_sbuf[0:size, :],
+    )
+    return nisa.tensor_copy(bias_sbuf, dtype=nl.float32)
+
+
+"""
+Compute `band_pool_rows` pooled output rows of image `b`, starting at pooled
+row `pool_row_start`, for every output-channel tile.
+
+The input rows the band needs are loaded once per c_in tile, and every filter
+row and c_out tile reads them from SBUF. Conv rows are evicted into an SBUF
+band (with bias and activation applied), pooled as a whole, and stored with
+one DMA per c_out tile.
+
+Bands marked `edge` have a static pool_row_start, so the rows that fall in
+the top or bottom padding can be clipped at trace time.
+"""
+def conv_row_band(X, X_out, bias, w_transpose, conv, act_fn, pool_type, b, pool_row_start, band_pool_rows, edge=False):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    x_band = load_input_band(X, conv, b, pool_row_start, band_pool_rows, edge)
+
+    for c_out_local in c_out_tiles(conv, conv.num_full_c_out_tiles):
+        c_out_ind = conv.c_out_tile_start + c_out_local
+        conv_out_tile(
+            x_band, X_out, bias, w_transpose, conv, act_fn, pool_type,
+            b, pool_row_start, band_pool_rows, c_out_ind, c_out_par_dim,
+        )
+    if conv.c_out_tail > 0:
+        conv_out_tile(
+            x_band, X_out, bias, w_transpose, conv, act_fn, pool_type,
+            b, pool_row_start, band_pool_rows, conv.num_full_c_out_tiles, conv.c_out_tail,
+        )
+
+
+"""
+Batch-stationary schedule: every image of the batch is resident in SBUF, the
+output-channel tile loop is outermost, and each weight tile is applied to up
+to STATIONARY_PSUM_TILES PSUM tiles (spread over images and rows) back to back
+before the next tap. The bias is loaded once per c_out tile instead of once
+per image, and the stationary weights are reused across the batch.
+"""
+def conv_batch_stationary(X, X_out, bias, w_transpose, conv, act_fn, pool_type):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    x_bands = [
+        load_input_band(X, conv, conv.batch_start + b, 0, conv.out_pool_height, edge=True)
+        for b in range(conv.batch_size)
+    ]
+
+    for c_out_local in c_out_tiles(conv, conv.num_full_c_out_tiles):
+        c_out_ind = conv.c_out_tile_start + c_out_local
+        conv_batch_out_tile(x_bands, X_out, bias, w_transpose, conv, act_fn, pool_type, c_out_ind, c_out_par_dim)
+    if conv.c_out_tail > 0:
+        conv_batch_out_tile(
+            x_bands, X_out, bias, w_transpose, conv, act_fn, pool_type, conv.num_full_c_out_tiles, conv.c_out_tail
+        )
+
+
+"""
+One output-channel tile of the batch-stationary schedule, for all images.
+"""
+def conv_batch_out_tile(x_bands, X_out, bias, w_transpose, conv, act_fn, pool_type, c_out_ind, c_out_size):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    conv_rows = conv.conv_rows(conv.out_pool_height)
+    group_rows = conv.rows_per_psum
+
+    bias_temp = load_bias(bias, c_out_ind, c_out_size)
+    conv_bands = [
+        nl.ndarray((c_out_par_dim, conv_rows, conv.out_width), dtype=X_out.dtype, buffer=nl.sbuf)
+        for _ in range(conv.batch_size)
+    ]
+
+    # (image, first row, rows) of every PSUM tile, processed STATIONARY_PSUM_TILES at a time
+    tiles = [
+        (b, row, min(group_rows, conv_rows - row))
+        for b in range(conv.batch_size)
+        for row in range(0, conv_rows, group_rows)
+    ]
+    for chunk_start in range(0, len(tiles), STATIONARY_PSUM_TILES):
+        chunk = tiles[chunk_start : chunk_start + STATIONARY_PSUM_TILES]
+        psums = [
+            nl.zeros((c_out_par_dim, rows, conv.out_width), nl.float32, buffer=nl.psum) for (_, _, rows) in chunk
+        ]
+        c_in_first, c_in_count = conv.c_in_tile_span(c_out_ind)
+        for c_in_local in nl.affine_range(c_in_count):
+            c_in_ind = c_in_first + c_in_local
+            for i in nl.affine_range(conv.filter_height):
+                for j in nl.affine_range(conv.col_taps):
+                    # same stationary tile for every matmul of the chunk
+                    for t, (b, row, rows) in enumerate(chunk):
+                        psums[t] += nisa.nc_matmul(
+                            w_transpose[:, c_in_ind, :, c_out_ind, i, j],
+                            moving_tile(x_bands[b], conv, c_in_ind, row, rows, i, j),
+                        )
+        for t, (b, row, rows) in enumerate(chunk):
+            conv_bands[b][:, row : row + rows, :] = nisa.activation(
+                op=act_fn, data=psums[t], bias=bias_temp, dtype=X_out.dtype
+            )
+
+    for b in range(conv.batch_size):
+        pooled = pool_band(conv_bands[b], conv, pool_type, conv.out_pool_height)
+        store_out_tile(X_out, pooled, conv, conv.batch_start + b, c_out_ind, c_out_size, 0, conv.out_pool_height)
+
+
+"""
+Load the input rows a band of `band_pool_rows` pooled rows of image `b` reads,
+for every c_in tile, into one SBUF band of shape
+(128, num_c_in_tiles, in_rows, padded_width).
+
+With padding, the band is zero-filled and only the real input rows and
+columns are DMAed into it; so is a partial last c_in tile. For `edge` bands
+the row range is clipped statically to the rows that exist.
+"""
+def load_input_band(X, conv, b, pool_row_start, band_pool_rows, edge=False):
+    c_in_par_dim = nl.tile_size.pmax
+    conv_rows = conv.conv_rows(band_pool_rows)
+    in_rows = conv.in_rows(conv_rows)
+    in_start = conv.in_row_start(pool_row_start)
+
+    band_shape = (c_in_par_dim, conv.num_c_in_tiles, in_rows, conv.padded_width)
+    if conv.pad_size > 0 or conv.c_in_tail > 0:
+        x_band = nl.zeros(band_shape, dtype=X.dtype, buffer=nl.sbuf)
+    else:
+        x_band = nl.ndarray(band_shape, dtype=X.dtype, buffer=nl.sbuf)
+
+    # rows [dst_row, dst_row + num_rows) of the band come from the input
+    dst_row, num_rows = 0, in_rows
+    if edge:
+        dst_row = max(0, -in_start)
+        num_rows = min(in_rows, conv.input_height - in_start) - dst_row
+
+    if num_rows > 0 and conv.layout == "NHWC":
+        for c_in_ind, (c_in_start, c_in_size) in enumerate(channel_tiles(conv.in_channels, c_in_par_dim)):
+            load_nhwc_rows(X, x_band, conv, b, c_in_ind, c_in_start, c_in_size, in_start + dst_row, dst_row, num_rows)
+    elif num_rows > 0:
+        pad = conv.pad_size
+        src_rows = (in_start + dst_row, in_start + dst_row + num_rows)
+        for c_in_ind in nl.affine_range(conv.num_full_c_in_tiles):
+            nisa.dma_copy(
+                dst=x_band[:, c_in_ind, dst_row : dst_row + num_rows, pad : pad + conv.input_width],
+                src=X[b, c_in_ind * c_in_par_dim:(c_in_ind+1) * c_in_par_dim, src_rows[0] : src_rows[1], :],
+            )
+        if conv.c_in_tail > 0:
+            # only the valid partitions of the last tile; the rest stay zero
+            c_in_start = conv.num_full_c_in_tiles * c_in_par_dim
+            nisa.dma_copy(
+                dst=x_band[0:conv.c_in_tail, conv.num_full_c_in_tiles, dst_row : dst_row + num_rows, pad : pad + conv.input_width],
+                src=X[b, c_in_start : c_in_start + conv.c_in_tail, src_rows[0] : src_rows[1], :],
+            )
+
+    if conv.stack_taps:
+        return stack_filter_columns(x_band, conv, 0, in_rows)
+    return x_band
+
+
+"""
+Fill rows [dst_row, dst_row + num_rows) of c_in tile `c_in_ind` of x_band
+from input rows [src_row, src_row + num_rows) of a channels-last image, for
+channels [c_start, c_start + c_size). Like matrix_transpose, this goes
+through tiles of at most 128x128: each chunk of up to 128 columns is DMAed
+once for all rows with the pixels on the partitions, and every row of it is
+transposed with nc_transpose into the band's channels-on-partitions layout.
+"""
+def load_nhwc_rows(X, x_band, conv, b, c_in_ind, c_start, c_size, src_row, dst_row, num_rows):
+    pad = conv.pad_size
+    for col, cols in channel_tiles(conv.input_width, nl.tile_size.pmax):
+        x_nhwc = nl.ndarray((cols, num_rows, c_size), dtype=X.dtype, buffer=nl.sbuf)
+        i_w, i_r, i_c = nl.mgrid[0:cols, 0:num_rows, 0:c_size]
+        nisa.dma_copy(dst=x_nhwc, src=X[b, src_row + i_r, col + i_w, c_start + i_c])
+        for r in nl.affine_range(num_rows):
+            x_t = nisa.nc_transpose(x_nhwc[:, r, :])
+            x_band[0:c_size, c_in_ind, dst_row + r, pad + col : pad + col + cols] = nisa.tensor_copy(
+                x_t, dtype=x_band.dtype, engine=nisa.vector_engine
+            )
+
+
+"""
+Store pooled rows [pool_row_start, pool_row_start + pool_rows) of one
+output-channel tile of image `b`, the first `c_out_size` partitions of
+`pooled`, in X_out's layout. NHWC tiles are transposed back to pixels on the
+partitions first, up to 128 columns at a time, with one DMA per chunk.
+"""
+def store_out_tile(X_out, pooled, conv, b, c_out_ind, c_out_size, pool_row_start, pool_rows):
+    c_out_start = c_out_ind * nl.tile_size.gemm_stationary_fmax
+    if conv.layout == "NCHW":
+        nisa.dma_copy(
+            dst=X_out[b, c_out_start : c_out_start + c_out_size, pool_row_start : pool_row_start + pool_rows, :],
+            src=pooled[0:c_out_size],
+        )
+        return
+
+    for col, cols in channel_tiles(conv.out_pool_width, nl.tile_size.pmax):
+        out_nhwc = nl.ndarray((cols, pool_rows, c_out_size), dtype=X_out.dtype, buffer=nl.sbuf)
+        for r in nl.affine_range(pool_rows):
+            out_t = nisa.nc_transpose(pooled[0:c_out_size, r, col : col + cols])
+            out_nhwc[:, r, :] = nisa.tensor_copy(out_t, dtype=X_out.dtype, engine=nisa.vector_engine)
+        i_w, i_r, i_c = nl.mgrid[0:cols, 0:pool_rows, 0:c_out_size]
+        nisa.dma_copy(dst=X_out[b, pool_row_start + i_r, col + i_w, c_out_start + i_c], src=out_nhwc)
+
+
+"""
+Tap-stacked copy of `in_rows` rows of an input band, starting at row
+`x_row_start` of `x_band`: partitions [j * in_channels, (j + 1) * in_channels)
+hold the band shifted left by filter column j's offset, so the moving tile of
+column 0 covers the whole filter row. One SBUF-to-SBUF DMA per filter column.
+The columns a shifted block lacks are never read, but the unused partitions
+are zeroed, since they multiply the zero weights.
+"""
+def stack_filter_columns(x_band, conv, x_row_start, in_rows):
+    in_channels = conv.c_in_tail
+    width = conv.padded_width
+    x_stacked = nl.zeros((nl.tile_size.pmax, 1, in_rows, width), dtype=x_band.dtype, buffer=nl.sbuf)
+    for j in range(conv.filter_width):
+        shift = j * conv.dilation
+        nisa.dma_copy(
+            dst=x_stacked[j * in_channels : (j + 1) * in_channels, 0, :, 0 : width - shift],
+            src=x_band[0:in_channels, 0, x_row_start : x_row_start + in_rows, shift:width],
+        )
+    return x_stacked
+
+"""
+Compute, pool and store one output-channel tile of a band. Only the first
+`c_out_size` partitions are stored, so the last tile may be partial.
+"""
+def conv_out_tile(
+    x_band, X_out, bias, w_transpose, conv, act_fn, pool_type, b, pool_row_start, band_pool_rows, c_out_ind, c_out_size
+):
+    pooled = conv_pooled_tile(
+        x_band, X_out.dtype, bias, w_transpose, conv, act_fn, pool_type, band_pool_rows, c_out_ind, c_out_size
+    )
+    store_out_tile(X_out, pooled, conv, b, c_out_ind, c_out_size, pool_row_start, band_pool_rows)
+
+
+"""
+Compute and pool one output-channel tile of a band into SBUF, as `dtype`.
+The band's first input row is row `x_row_start` of `x_band`, which lets the
+band read straight out of a larger SBUF tensor. The partitions past
+`c_out_size` of a partial tile hold act(0) = 0: their weights and bias are zero.
+"""
+def conv_pooled_tile(
+    x_band, dtype, bias, w_transpose, conv, act_fn, pool_type, band_pool_rows, c_out_ind, c_out_size, x_row_start=0
+):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    conv_rows = conv.conv_rows(band_pool_rows)
+    group_rows = conv.rows_per_psum
+    num_groups = conv_rows // group_rows
+    tail_rows = conv_rows % group_rows
+
+    bias_temp = load_bias(bias, c_out_ind, c_out_size)
+    if conv.depthwise:
+        conv_band = depthwise_band(x_band, dtype, bias_temp, w_transpose, conv, act_fn, c_out_ind, conv_rows, x_row_start)
+        return pool_band(conv_band, conv, pool_type, band_pool_rows)
+    if conv.gemm:
+        conv_band = conv_gemm_band(x_band, dtype, bias_temp, w_transpose, conv, act_fn, c_out_ind, conv_rows, x_row_start)
+        return pool_band(conv_band, conv, pool_type, band_pool_rows)
+
+    conv_band = nl.ndarray(
+        shape=(c_out_par_dim, conv_rows, conv.out_width),
+        dtype=dtype,
+        buffer=nl.sbuf,
+    )
+
+    for group in nl.affine_range(num_groups):
+        conv_row_group(
+            x_band, conv_band, bias_temp, w_transpose, conv, act_fn, c_out_ind, group * group_rows, group_rows, x_row_start
+        )
+    if tail_rows > 0:
+        conv_row_group(
+            x_band, conv_band, bias_temp, w_transpose, conv, act_fn, c_out_ind, num_groups * group_rows, tail_rows,
+            x_row_start,
+        )
+
+    return pool_band(conv_band, conv, pool_type, band_pool_rows)
+
+
+"""
+The conv rows of a band for a 1x1 conv, as the GEMM it is: the band's rows are
+contiguous in `x_band` (no padding, stride 1), so its pixels are read as one
+flat row per c_in tile and each nc_matmul streams gemm_moving_fmax of them, cut
+without regard to row boundaries. Returns the rows as (128, conv_rows,
+out_width), the shape pool_band takes.
+"""
+def conv_gemm_band(x_band, dtype, bias_temp, w_transpose, conv, act_fn, c_out_ind, conv_rows, x_row_start=0):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    chunk = nl.tile_size.gemm_moving_fmax
+    pixels = conv_rows * conv.out_width
+    num_chunks, tail = divmod(pixels, chunk)
+
+    x_flat = x_band.reshape((x_band.shape[0], x_band.shape[1], x_band.shape[2] * x_band.shape[3]))
+    conv_flat = nl.ndarray((c_out_par_dim, pixels), dtype=dtype, buffer=nl.sbuf)
+    x_start = x_row_start * conv.out_width
+    for k in nl.affine_range(num_chunks):
+        conv_gemm_chunk(x_flat, conv_flat, bias_temp, w_transpose, conv, act_fn, c_out_ind, x_start, k * chunk, chunk)
+    if tail > 0:
+        conv_gemm_chunk(x_flat, conv_flat, bias_temp, w_transpose, conv, act_fn, c_out_ind, x_start, num_chunks * chunk, tail)
+
+    return conv_flat.reshape((c_out_par_dim, conv_rows, conv.out_width))
+
+
+"""
+The conv rows of a band for a depthwise conv, on the vector engine: each
+channel sits on its own partition, so every filter tap is one
+multiply-accumulate over the whole band, the tap's moving tile scaled by the
+per-partition weights in `w_depthwise` (from load_depthwise_weights) and added
+to a float32 accumulator. Bias and activation are applied by the final
+nisa.activation, as on PSUM eviction.
+"""
+def depthwise_band(x_band, dtype, bias_temp, w_depthwise, conv, act_fn, c_ind, conv_rows, x_row_start=0):
+    acc = None
+    for i in range(conv.filter_height):
+        for j in range(conv.filter_width):
+            window = moving_tile(x_band, conv, c_ind, 0, conv_rows, i, j, x_row_start)
+            tap = i * conv.filter_width + j
+            weight = w_depthwise[:, c_ind, tap : tap + 1]
+            if acc is None:
+                acc = nisa.tensor_scalar(window, nl.multiply, weight, dtype=nl.float32)
+            else:
+                acc = nisa.scalar_tensor_tensor(
+                    data=window, op0=nl.multiply, operand0=weight, op1=nl.add, operand1=acc, dtype=nl.float32
+                )
+    return nisa.activation(op=act_fn, data=acc, bias=bias_temp, dtype=dtype)
+
+
+"""
+Pixels [start, start + size) of a 1x1 conv band: one nc_matmul per c_in tile
+(of the output tile's groups) into a flat PSUM tile, evicted with bias and activation applied.
+"""
+def conv_gemm_chunk(x_flat, conv_flat, bias_temp, w_transpose, conv, act_fn, c_out_ind, x_start, start, size):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    res_psum = nl.zeros((c_out_par_dim, size), nl.float32, buffer=nl.psum)
+    c_in_first, c_in_count = conv.c_in_tile_span(c_out_ind)
+    for c_in_local in nl.affine_range(c_in_count):
+        c_in_ind = c_in_first + c_in_local
+        res_psum += nisa.nc_matmul(
+            w_transpose[:, c_in_ind, :, c_out_ind, 0, 0], x_flat[:, c_in_ind, x_start + start : x_start + start + size]
+        )
+    conv_flat[:, start : start + size] = nisa.activation(op=act_fn, data=res_psum, bias=bias_temp, dtype=conv_flat.dtype)
+
+
+"""
+Accumulate output row `row` of image `b` for one c_out tile in PSUM, the
+per-row schedule's c_in loop with `depth` temp_X buffers: the filter_height
+input rows of c_in tile k + depth - 1 are DMAed while tile k's matmuls run.
+The buffers are a Python list, indexed statically by unrolling `depth` c_in
+tiles per iteration of a sequential loop, like the vector kernels'
+add_tiles_buffered.
+"""
+def conv_row_buffered(X, w_transpose, b, row, c_out_ind, out_width, depth):
+    c_in_par_dim = nl.tile_size.pmax
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    num_c_in_tiles = w_transpose.shape[1]
+    filter_height, filter_width = w_transpose.shape[4], w_transpose.shape[5]
+    input_width = X.shape[3]
+
+    x_bufs = [
+        nl.ndarray((c_in_par_dim, filter_height, input_width), dtype=X.dtype, buffer=nl.sbuf) for _ in range(depth)
+    ]
+    res_psum = nl.zeros((c_out_par_dim, out_width), nl.float32, buffer=nl.psum)
+
+    # prologue: fill all but one buffer
+    ahead = min(depth - 1, num_c_in_tiles)
+    for k in range(ahead):
+        load_input_rows(X, x_bufs[k], b, k, row)
+
+    # steady state: every prefetch is in range for these groups
+    num_groups = (num_c_in_tiles - ahead) // depth
+    for g in nl.sequential_range(num_groups):
+        for slot in range(depth):
+            c_in_ind = g * depth + slot
+            load_input_rows(X, x_bufs[(slot - 1) % depth], b, c_in_ind + depth - 1, row)
+            for i in nl.affine_range(filter_height):
+                for j in nl.affine_range(filter_width):
+                    res_psum += nisa.nc_matmul(w_transpose[:, c_in_ind, :, c_out_ind, i, j], x_bufs[slot][:, i, j:j+out_width])
+
+    # epilogue: the last tiles, prefetching only those that exist
+    for c_in_ind in range(num_groups * depth, num_c_in_tiles):
+        if c_in_ind + depth - 1 < num_c_in_tiles:
+            load_input_rows(X, x_bufs[(c_in_ind - 1) % depth], b, c_in_ind + depth - 1, row)
+        for i in nl.affine_range(filter_height):
+            for j in nl.affine_range(filter_width):
+                res_psum += nisa.nc_matmul(
+                    w_transpose[:, c_in_ind, :, c_out_ind, i, j], x_bufs[c_in_ind % depth][:, i, j:j+out_width]
+                )
+    return res_psum
+
+
+"""
+DMA the filter_height input rows starting at `row` of image `b`, c_in tile
+`c_in_ind`, into `x_buf`.
+"""
+def load_input_rows(X, x_buf, b, c_in_ind, row):
+    c_in_par_dim = nl.tile_size.pmax
+    nisa.dma_copy(
+        dst=x_buf, src=X[b, c_in_ind * c_in_par_dim:(c_in_ind+1) * c_in_par_dim, row : row + x_buf.shape[1], :]
+    )
+
+
+"""
+Compute `group_rows` consecutive conv rows, starting at row `band_row` of the
+band, in a single PSUM tile: each nc_matmul streams a (group_rows, out_width)
+moving tile, so the per-matmul overhead is paid once for all of them. The
+tile is evicted into `conv_band` by one nisa.activation that also adds the bias.
+"""
+def conv_row_group(
+    x_band, conv_band, bias_temp, w_transpose, conv, act_fn, c_out_ind, band_row, group_rows, x_row_start=0
+):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    out_width = conv.out_width
+
+    res_psum = nl.zeros((c_out_par_dim, group_rows, out_width), nl.float32, buffer=nl.psum)
+    c_in_first, c_in_count = conv.c_in_tile_span(c_out_ind)
+    for c_in_local in nl.affine_range(c_in_count):
+        c_in_ind = c_in_first + c_in_local
+        for i in nl.affine_range(conv.filter_height):
+            for j in nl.affine_range(conv.col_taps):
+                res_psum += nisa.nc_matmul(
+                    w_transpose[:, c_in_ind, :, c_out_ind, i, j],
+                    moving_tile(x_band, conv, c_in_ind, band_row, group_rows, i, j, x_row_start),
+                )
+
+    conv_band[:, band_row : band_row + group_rows, :] = nisa.activation(
+        op=act_fn, data=res_psum, bias=bias_temp, dtype=conv_band.dtype
+    )
+
+
+"""
+The (128, group_rows, out_width) slice of the input band that filter tap (i, j)
+multiplies for conv rows [band_row, band_row + group_rows), the band
+starting at row `x_row_start` of `x_band`. Strided convolutions read it
+through nl.mgrid; dilation only shifts the tap offsets.
+"""
+def moving_tile(x_band, conv, c_in_ind, band_row, group_rows, i, j, x_row_start=0):
+    row = x_row_start + band_row * conv.stride + i * conv.dilation
+    col = j * conv.dilation
+    if conv.stride == 1:
+        return x_band[:, c_in_ind, row : row + group_rows, col : col + conv.out_width]
+
+    i_p, i_r, i_w = nl.mgrid[0:nl.tile_size.pmax, 0:group_rows, 0:conv.out_width]
+    return x_band[i_p, c_in_ind, row + conv.stride * i_r, col + conv.stride * i_w]
+
+
+"""
+Max or average pool a band of conv rows: one vector instruction per offset in
+the pool window, each reading the strided window elements through nl.mgrid.
+Average pooling sums in fp32 and rounds once, so low-precision outputs do not
+lose bits on every add.
+"""
+def pool_band(conv_band, conv, pool_type, band_pool_rows):
+    pool_size = conv.pool_size
+    stride = conv.pool_stride
+    if pool_size == 1 and stride == 1:
+        return conv_band
+
+    i_p, i_r, i_w = nl.mgrid[0:nl.tile_size.gemm_stationary_fmax, 0:band_pool_rows, 0:conv.out_pool_width]
+    reduce_op = nl.maximum if pool_type == "max" else nl.add
+    pooled = None
+    for di in range(pool_size):
+        for dj in range(pool_size):
+            window = conv_band[i_p, di + stride * i_r, dj + stride * i_w]
+            if pooled is None:
+                pooled = nisa.tensor_copy(window, dtype=conv_band.dtype if pool_type == "max" else nl.float32)
+            else:
+                pooled = nisa.tensor_tensor(pooled, window, op=reduce_op, dtype=pooled.dtype)
+
+    if pool_type == "avg":
+        pooled = nisa.tensor_scalar(pooled, nl.multiply, 1.0 / (pool_size * pool_size), dtype=conv_band.dtype)
+    return pooled
@@ -0,0 +1,223 @@
+import numpy as np
+
+import neuronxcc.nki as nki
+import neuronxcc.nki.language as nl
+import neuronxcc.nki.isa as nisa
+
+from conv2d import ACTIVATIONS, conv_pooled_tile, load_conv_weights, load_input_band, stack_filter_columns
+from conv_shape import ConvShape
+
+
+"""
+A stack of conv + bias + activation + pool layers in one kernel.
+
+Chaining fused_conv2d_maxpool calls writes every intermediate activation to
+HBM and reads it back in the next call. Here each layer runs over row bands
+like fused_conv2d_maxpool's row_reuse mode, but its output goes straight into
+an SBUF buffer when it fits NETWORK_SBUF_BUDGET. That buffer is zero-padded
+for the next layer, whose bands read their inputs out of it with no DMA at
+all. Only activations too large for SBUF are spilled to HBM scratch.
+
+Parameters:
+    X: the input tensor, [batch_size, in_channels, input_height, input_width]
+    W0, bias0, ..., W3, bias3: the weights and biases of up to four layers,
+        laid out as for fused_conv2d_maxpool. Layer k + 1's in_channels must
+        be layer k's out_channels.
+    layers: one spec per layer, built by network_layers from dicts of
+        LAYER_OPTS (pad_size, stride, dilation, activation, pool_size,
+        pool_type, pool_stride). These have the same meaning as the
+        fused_conv2d_maxpool arguments of the same name. Empty means
+        pool_size=1 with no padding or activation for every layer.
+
+The images are processed one at a time, each through the whole stack, on a
+single NeuronCore.
+"""
+@nki.compiler.skip_middle_end_transformations
+@nki.jit
+def fused_conv_network(X, W0, bias0, W1=None, bias1=None, W2=None, bias2=None, W3=None, bias3=None, layers=()):
+    weights = [W for W in (W0, W1, W2, W3) if W is not None]
+    biases = [bias for bias in (bias0, bias1, bias2, bias3) if bias is not None]
+    assert len(biases) == len(weights), "Every layer needs a weight and a bias"
+    layers = layers or ((),) * len(weights)
+    assert len(layers) == len(weights), f"{len(layers)} layer specs for {len(weights)} layers"
+    for W in weights:
+        assert W.dtype == X.dtype, f"X and W must share a dtype, got {X.dtype} and {W.dtype}"
+
+    batch_size = X.shape[0]
+    convs = network_shapes(X.shape, [W.shape for W in weights], layers, X.dtype)
+    resident = choose_resident(convs, X.dtype)
+    opts = [dict(layer) for layer in layers]
+
+    w_transposes = [load_conv_weights(W) for W in weights]
+
+    last = convs[-1]
+    X_out = nl.ndarray(
+        shape=(batch_size, weights[-1].shape[0], last.out_pool_height, last.out_pool_width),
+        dtype=X.dtype,
+        buffer=nl.shared_hbm,
+    )
+    # intermediate activations that do not fit SBUF go through HBM scratch
+    spills = [
+        None if keep else nl.ndarray(
+            (batch_size, W.shape[0], conv.out_pool_height, conv.out_pool_width), dtype=X.dtype, buffer=nl.hbm
+        )
+        for keep, W, conv in zip(resident, weights, convs)
+    ]
+
+    for b in nl.affine_range(batch_size):
+        # each layer reads either x_hbm through DMAed bands, or x_act in SBUF
+        x_hbm, x_act = X, None
+        for layer, conv in enumerate(convs):
+            dst_hbm, dst_act, dst_pad = X_out, None, 0
+            if layer < len(convs) - 1 and resident[layer]:
+                consumer = convs[layer + 1]
+                dst_hbm, dst_pad = None, consumer.pad_size
+                act_shape = (
+                    nl.tile_size.pmax, consumer.num_c_in_tiles,
+                    consumer.input_height + 2 * dst_pad, consumer.padded_width,
+                )
+                # the border is the next layer's zero padding
+                if dst_pad > 0:
+                    dst_act = nl.zeros(act_shape, dtype=X.dtype, buffer=nl.sbuf)
+                else:
+                    dst_act = nl.ndarray(act_shape, dtype=X.dtype, buffer=nl.sbuf)
+            elif layer < len(convs) - 1:
+                dst_hbm = spills[layer]
+
+            network_layer(
+                x_hbm, x_act, dst_hbm, dst_act, dst_pad, biases[layer], w_transposes[layer], conv,
+                ACTIVATIONS[opts[layer].get("activation")], opts[layer].get("pool_type", "max"), b,
+            )
+            x_hbm, x_act = dst_hbm, dst_act
+
+    return X_out
+
+
+# Per-layer options of fused_conv_network
+LAYER_OPTS = ("pad_size", "stride", "dilation", "activation", "pool_size", "pool_type", "pool_stride")
+
+# Bytes of each SBUF partition the resident activations of one image may use
+NETWORK_SBUF_BUDGET = 96 * 1024
+
+
+"""
+Layer specs (dicts of LAYER_OPTS) in the hashable form fused_conv_network's
+`layers` argument takes.
+"""
+def network_layers(*layers):
+    for layer in layers:
+        unknown = set(layer) - set(LAYER_OPTS)
+        assert not unknown, f"Unknown layer options {sorted(unknown)}"
+    return tuple(tuple(sorted(layer.items())) for layer in layers)
+
+
+"""
+ConvShape of every layer, each fed the previous layer's pooled output. Rows
+are always packed into PSUM tiles, since the later layers' images are narrow.
+Pure Python, so the harness can use it on the host too.
+"""
+def network_shapes(X_shape, W_shapes, layers, dtype):
+    convs = []
+    shape = X_shape
+    for W_shape, layer in zip(W_shapes, layers):
+        opts = dict(layer)
+        assert W_shape[1] == shape[1], f"Layer expects {W_shape[1]} input channels, got {shape[1]}"
+        conv = ConvShape(
+            shape, W_shape, opts.get("pool_size", 1), pool_stride=opts.get("pool_stride"), pack_rows=True,
+            dtype=dtype, pad_size=opts.get("pad_size", 0), stride=opts.get("stride", 1),
+            dilation=opts.get("dilation", 1), batch_stationary=False,
+        )
+        convs.append(conv)
+        shape = (shape[0], W_shape[0], conv.out_pool_height, conv.out_pool_width)
+    return convs
+
+
+"""
+For each layer but the last, whether its output stays in SBUF as the next
+layer's padded input. Decided greedily from the first layer: an activation
+is kept if it fits NETWORK_SBUF_BUDGET together with the resident input of
+the layer producing it, since both are live while that layer runs.
+"""
+def choose_resident(convs, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    resident = []
+    input_bytes = 0
+    for consumer in convs[1:]:
+        padded_height = consumer.input_height + 2 * consumer.pad_size
+        out_bytes = consumer.num_c_in_tiles * padded_height * consumer.padded_width * itemsize
+        keep = input_bytes + out_bytes <= NETWORK_SBUF_BUDGET
+        resident.append(keep)
+        input_bytes = out_bytes if keep else 0
+    return resident
+
+
+"""
+One layer of one image, over the bands of conv.band_schedule(): from x_act
+(SBUF, already padded) if the previous layer kept its output resident, and
+from x_hbm otherwise. The pooled output goes to dst_act at offset dst_pad
+when this layer's output is resident, and to dst_hbm otherwise.
+"""
+def network_layer(x_hbm, x_act, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type, b):
+    first_interior, num_interior, edge_bands = conv.band_schedule()
+    for band in nl.affine_range(num_interior):
+        network_band(
+            x_hbm, x_act, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+            b, (first_interior + band) * conv.band_pool_rows, conv.band_pool_rows,
+        )
+    for pool_row_start, band_pool_rows in edge_bands:
+        network_band(
+            x_hbm, x_act, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+            b, pool_row_start, band_pool_rows, edge=True,
+        )
+
+
+def network_band(
+    x_hbm, x_act, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+    b, pool_row_start, band_pool_rows, edge=False,
+):
+    c_out_par_dim = nl.tile_size.gemm_stationary_fmax
+    if x_act is None:
+        x_band, x_row_start = load_input_band(x_hbm, conv, b, pool_row_start, band_pool_rows, edge), 0
+    else:
+        # in padded coordinates the band starts at in_row_start + pad_size
+        x_band, x_row_start = x_act, pool_row_start * conv.pool_stride * conv.stride
+        if conv.stack_taps:
+            in_rows = conv.in_rows(conv.conv_rows(band_pool_rows))
+            x_band, x_row_start = stack_filter_columns(x_act, conv, x_row_start, in_rows), 0
+
+    for c_out_ind in nl.affine_range(conv.num_full_c_out_tiles):
+        network_out_tile(
+            x_band, x_row_start, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+            b, pool_row_start, band_pool_rows, c_out_ind, c_out_par_dim,
+        )
+    if conv.c_out_tail > 0:
+        network_out_tile(
+            x_band, x_row_start, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+            b, pool_row_start, band_pool_rows, conv.num_full_c_out_tiles, conv.c_out_tail,
+        )
+
+
+"""
+Compute one output-channel tile of a band and store it. A resident output
+copies all 128 partitions, so a partial tile's unused partitions become the
+zeros the next layer's partial c_in tile needs.
+"""
+def network_out_tile(
+    x_band, x_row_start, dst_hbm, dst_act, dst_pad, bias, w_transpose, conv, act_fn, pool_type,
+    b, pool_row_start, band_pool_rows, c_out_ind, c_out_size,
+):
+    pooled = conv_pooled_tile(
+        x_band, x_band.dtype, bias, w_transpose, conv, act_fn, pool_type, band_pool_rows, c_out_ind, c_out_size,
+        x_row_start,
+    )
+    row = dst_pad + pool_row_start
+    if dst_act is not None:
+        dst_act[:, c_out_ind, row : row + band_pool_rows, dst_pad : dst_pad + conv.out_pool_width] = nisa.tensor_copy(
+            pooled
+        )
+    else:
+        c_out_start = c_out_ind * nl.tile_size.gemm_stationary_fmax
+        nisa.dma_copy(
+            dst=dst_hbm[b, c_out_start : c_out_start + c_out_size, row : row + band_pool_rows, :],
+            src=pooled[0:c_out_size],
+        )
@@ -0,0 +1,251 @@
+"""
+Static shapes and schedule choices of fused_conv2d_maxpool.
+
+Everything here is pure Python (no neuronxcc), so the cost model and other
+host-side tools can build a ConvShape and count tiles without the NKI
+toolchain installed. conv2d.py and conv_network.py build their kernels on top
+of it.
+"""
+
+import numpy as np
+
+# Partition dimension of SBUF and PSUM tiles (nl.tile_size.pmax)
+PMAX = 128
+
+# Free dimension of a matmul's stationary tile (nl.tile_size.gemm_stationary_fmax)
+STATIONARY_FMAX = 128
+
+# Free dimension of a matmul's moving tile (nl.tile_size.gemm_moving_fmax)
+MOVING_FMAX = 512
+
+# Bytes of each SBUF partition that row_reuse mode may spend on its input band
+ROW_BAND_SBUF_BUDGET = 64 * 1024
+
+# Bytes of each SBUF partition the batch-stationary schedule may spend on the
+# resident inputs and conv outputs of the whole batch
+BATCH_STATIONARY_SBUF_BUDGET = 96 * 1024
+
+# Filters with at least this many taps (5x5 and up) always run the row-band
+# schedule with packed rows
+LARGE_FILTER_TAPS = 25
+
+# PSUM tiles the batch-stationary schedule accumulates at once, each weight
+# tile being applied to all of them back to back (PSUM has 8 banks)
+STATIONARY_PSUM_TILES = 4
+
+
+"""
+(start, size) of each channel tile, the last one partial when `channels` is
+not a multiple of `tile`. Sizes are static, so ragged tile loops unroll.
+"""
+def channel_tiles(channels, tile):
+    return [(start, min(tile, channels - start)) for start in range(0, channels, tile)]
+
+
+"""
+Whether the filter columns of a conv are stacked on the partitions: filters
+wider than 1 whose in_channels * filter_width input rows fit one c_in tile.
+"""
+def stacks_taps(in_channels, filter_width):
+    return filter_width > 1 and in_channels * filter_width <= PMAX
+
+
+"""
+Whether a grouped conv is depthwise: one input and one output channel per group.
+"""
+def is_depthwise(in_channels, out_channels, groups):
+    return groups > 1 and groups == in_channels == out_channels
+
+
+"""
+(tile, offset in tile, start, size) of each piece of channels [start, stop)
+that falls in one `tile`-channel tile.
+"""
+def tile_pieces(start, stop, tile):
+    pieces = []
+    while start < stop:
+        size = min(stop, (start // tile + 1) * tile) - start
+        pieces.append((start // tile, start % tile, start, size))
+        start += size
+    return pieces
+
+
+"""
+The nonzero blocks of a grouped conv's w_transpose: for every group, each
+(output tile, input tile) piece of its weights, as (out_tile, out_offset,
+out_start, out_size, in_tile, in_offset, in_start, in_size). in_start is in
+W's own [0, in_channels // groups) coordinates. Pure Python, so the cost
+model can count them.
+"""
+def grouped_weight_blocks(out_channels, in_channels, groups):
+    c_par_dim = PMAX
+    group_out, group_in = out_channels // groups, in_channels // groups
+    blocks = []
+    for g in range(groups):
+        for out_tile, out_offset, out_start, out_size in tile_pieces(g * group_out, (g + 1) * group_out, c_par_dim):
+            for in_tile, in_offset, in_start, in_size in tile_pieces(g * group_in, (g + 1) * group_in, c_par_dim):
+                blocks.append(
+                    (out_tile, out_offset, out_start, out_size, in_tile, in_offset, in_start - g * group_in, in_size)
+                )
+    return blocks
+
+
+"""
+Static sizes of one fused_conv2d_maxpool call in row_reuse mode, shared by the
+kernel's helpers in conv2d.py and by the cost model.
+
+Bands are counted in pooled output rows: a band of P pooled rows needs
+conv_rows(P) conv rows and in_rows(conv_rows(P)) (padded) input rows.
+"""
+class ConvShape:
+    def __init__(
+        self, X_shape, W_shape, pool_size, pool_stride=None, pack_rows=False, band_rows=None, dtype=np.float32,
+        pad_size=0, stride=1, dilation=1, batch_stationary=None, batch_shard=None, c_out_shard=None, out_dtype=None,
+        groups=1, layout="NCHW",
+    ):
+        # always NCHW order; `layout` is that of the kernel's X and X_out
+        batch_size, in_channels, input_height, input_width = X_shape
+        out_channels, _, filter_height, filter_width = W_shape
+
+        # this SPMD program's images: batch_start may be symbolic
+        self.batch_start, self.batch_size = batch_shard or (0, batch_size)
+        self.pool_size = pool_size
+        self.pool_stride = pool_stride or pool_size
+        self.pad_size = pad_size
+        self.stride = stride
+        self.dilation = dilation
+        self.filter_height = filter_height
+        self.filter_width = filter_width
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.groups = groups
+        self.layout = layout
+        # depthwise convs run on the vector engine, without matmuls
+        self.depthwise = is_depthwise(in_channels, out_channels, groups)
+        # 1x1 convs run as a GEMM over the band's flattened pixels
+        self.gemm = filter_height == filter_width == 1 and stride == 1 and pad_size == 0 and not self.depthwise
+        # stacked filter columns: each filter row is a single matmul
+        self.stack_taps = groups == 1 and stacks_taps(in_channels, filter_width)
+        self.col_taps = 1 if self.stack_taps else filter_width
+        self.pack_rows = pack_rows or filter_height * filter_width >= LARGE_FILTER_TAPS
+        self.input_height = input_height
+        self.input_width = input_width
+        self.padded_width = input_width + 2 * pad_size
+        self.out_height = (input_height + 2 * pad_size - dilation * (filter_height - 1) - 1) // stride + 1
+        self.out_width = (self.padded_width - dilation * (filter_width - 1) - 1) // stride + 1
+        self.out_pool_height = (self.out_height - pool_size) // self.pool_stride + 1
+        self.out_pool_width = (self.out_width - pool_size) // self.pool_stride + 1
+        # full channel tiles, plus the size of a partial last tile (0 if none)
+        self.num_full_c_in_tiles, self.c_in_tail = divmod(in_channels, PMAX)
+        self.num_full_c_out_tiles, self.c_out_tail = divmod(out_channels, STATIONARY_FMAX)
+        self.num_c_in_tiles = self.num_full_c_in_tiles + (self.c_in_tail > 0)
+        self.num_c_out_tiles = self.num_full_c_out_tiles + (self.c_out_tail > 0)
+        # this SPMD program's output-channel tiles, only split when there is no tail
+        self.c_out_tile_start = 0
+        if c_out_shard is not None:
+            self.c_out_tile_start, local_tiles = c_out_shard
+            if self.c_out_tail == 0:
+                self.num_full_c_out_tiles = local_tiles
+
+        if batch_stationary is None:
+            batch_stationary = choose_batch_stationary(self, dtype, out_dtype or dtype)
+        # the depthwise schedule has no stationary weights to share
+        self.batch_stationary = batch_stationary and not self.depthwise
+
+        # the batch-stationary schedule always packs rows, to fill its PSUM tiles
+        self.rows_per_psum = choose_rows_per_psum(self.out_width) if self.pack_rows or self.batch_stationary else 1
+        if band_rows is None:
+            band_rows = choose_band_rows(
+                self.num_c_in_tiles, self.filter_span(filter_height), stride, self.padded_width, dtype
+            )
+        band_pool_rows = max(1, (band_rows - pool_size) // self.pool_stride + 1)
+        self.band_pool_rows = min(band_pool_rows, self.out_pool_height)
+
+    def c_in_tile_span(self, c_out_ind):
+        """
+        (first, count) of the c_in tiles output-channel tile `c_out_ind` reads:
+        all of them for a dense conv, and only those holding its groups' input
+        channels for a grouped one, which needs a static c_out_ind.
+        """
+        if self.groups == 1:
+            return 0, self.num_c_in_tiles
+        c_par_dim = PMAX
+        group_out, group_in = self.out_channels // self.groups, self.in_channels // self.groups
+        out_start = c_out_ind * STATIONARY_FMAX
+        out_stop = min(out_start + STATIONARY_FMAX, self.out_channels)
+        in_start = out_start // group_out * group_in
+        in_stop = ((out_stop - 1) // group_out + 1) * group_in
+        first = in_start // c_par_dim
+        return first, (in_stop - 1) // c_par_dim - first + 1
+
+    def filter_span(self, taps):
+        return self.dilation * (taps - 1) + 1
+
+    def conv_rows(self, pool_rows):
+        return (pool_rows - 1) * self.pool_stride + self.pool_size
+
+    def in_rows(self, conv_rows):
+        return (conv_rows - 1) * self.stride + self.filter_span(self.filter_height)
+
+    def in_row_start(self, pool_row_start):
+        """First input row (unpadded coordinates, may be negative) a band reads."""
+        return pool_row_start * self.pool_stride * self.stride - self.pad_size
+
+    def band_in_bounds(self, pool_row_start, pool_rows):
+        in_start = self.in_row_start(pool_row_start)
+        return in_start >= 0 and in_start + self.in_rows(self.conv_rows(pool_rows)) <= self.input_height
+
+    def band_schedule(self):
+        """
+        Split the output into bands: (first, count) of the contiguous run of
+        full bands that read no padding rows, and a list of (pool_row_start,
+        pool_rows) for the rest, which need their row range clipped statically.
+        """
+        rows = self.band_pool_rows
+        bands = [(start, min(rows, self.out_pool_height - start)) for start in range(0, self.out_pool_height, rows)]
+        interior = [k for k, (start, size) in enumerate(bands) if size == rows and self.band_in_bounds(start, size)]
+        if not interior:
+            return 0, 0, bands
+        first, count = interior[0], len(interior)
+        assert interior == list(range(first, first + count))
+        return first, count, bands[:first] + bands[first + count:]
+
+
+"""
+Pick the number of conv output rows per band for row_reuse mode: as many as
+fit the SBUF budget together with the input rows their filter span covers.
+"""
+def choose_band_rows(num_c_in_tiles, filter_span, stride, input_width, dtype):
+    row_bytes = num_c_in_tiles * input_width * np.dtype(dtype).itemsize
+    in_rows = ROW_BAND_SBUF_BUDGET // row_bytes
+    return max(1, (in_rows - filter_span) // stride + 1)
+
+
+"""
+Whether the batch-stationary schedule pays off: more than one image, not a
+1x1 conv (which runs as a GEMM instead) or a depthwise one (no matmuls), an
+image small enough that its matmuls stream no more columns than the weight
+tile has rows, so reloading the stationary tile per image would cost as much
+as the matmul itself, and every image's input and conv output fit in SBUF at
+the same time. Wider images keep the per-image schedules, whose matmuls
+already amortize the weight load.
+"""
+def choose_batch_stationary(conv, dtype, out_dtype):
+    if conv.batch_size == 1 or conv.gemm or conv.depthwise:
+        return False
+    moving_columns = min(conv.out_height, choose_rows_per_psum(conv.out_width)) * conv.out_width
+    if moving_columns > STATIONARY_FMAX:
+        return False
+    conv_rows = conv.conv_rows(conv.out_pool_height)
+    in_bytes = conv.num_c_in_tiles * conv.in_rows(conv_rows) * conv.padded_width * np.dtype(dtype).itemsize
+    out_bytes = conv_rows * conv.out_width * np.dtype(out_dtype).itemsize
+    image_bytes = in_bytes + out_bytes
+    return conv.batch_size * image_bytes <= BATCH_STATIONARY_SBUF_BUDGET
+
+
+"""
+Number of out_width-wide output rows packed into one PSUM tile: as many as fit
+the matmul moving free dimension.
+"""
+def choose_rows_per_psum(out_width):
+    return max(1, MOVING_FMAX // out_width)
@@ -0,0 +1,211 @@
+"""
+Analytic cost model for fused_conv2d_maxpool.
+
+Given the conv shapes, dtype and the kernel's tiling, this counts what the
+kernel issues (FLOPs, HBM bytes, DMAs, nc_matmul instructions) by walking the
+same loop structure as conv2d.py, and predicts a roofline-bound latency. Next
+to a measured latency it reports the achieved MFU and HBM bandwidth
+utilization, which tells whether a configuration is compute- or DMA-bound
+without opening the profiler.
+
+The hardware figures are one NeuronCore's share of the trn2 device.
+"""
+
+import numpy as np
+
+from conv_shape import MOVING_FMAX, PMAX, ConvShape, grouped_weight_blocks
+from precision import DTYPES
+
+# Dense tensor engine throughput per NeuronCore, in FLOP/s; fp8 runs at twice
+# the 16-bit rate. part1/sweep.py keeps the same table for the GEMM MFU
+PEAK_FLOPS_BY_DTYPE = {
+    DTYPES["float32"]: 22.6e12,
+    DTYPES["float16"]: 83.4e12,
+    DTYPES["bfloat16"]: 83.4e12,
+    DTYPES["float8_e4m3"]: 166.8e12,
+    DTYPES["float8_e5m2"]: 166.8e12,
+}
+
+# Vector engine throughput per NeuronCore, in FLOP/s: one multiply-add per
+# partition per cycle at 1.4 GHz. Depthwise convs run here instead of on the
+# tensor engine
+PEAK_VECTOR_FLOPS = 2 * 128 * 1.4e9
+
+# HBM bandwidth per NeuronCore (2.9 TB/s per device, 8 cores), in bytes/s
+PEAK_HBM_BYTES_PER_S = 2.9e12 / 8
+
+
+def analyze_conv(
+    X_shape, W_shape, dtype, pool_size=1, row_reuse=False, band_rows=None, pack_rows=False, prepacked=False,
+    activation=None, pool_type="max", pool_stride=None, pad_size=0, stride=1, dilation=1, batch_stationary=None,
+    shard_by="batch", out_dtype=None, buffer_depth=1, groups=1, layout="NCHW",
+):
+    """
+    Count the work fused_conv2d_maxpool issues for one call with the given
+    tuning options. An SPMD launch is counted as a whole, over all programs.
+    buffer_depth only reorders the input DMAs, so it does not change the counts.
+    X_shape is always given in NCHW order, whatever the layout.
+
+    Returns a dict with flops, hbm_read_bytes, hbm_write_bytes, dma_count,
+    matmul_count, transpose_count, vector_count (the depthwise schedule's
+    multiply-accumulates) and the predicted roofline latency in μs.
+    """
+    batch_size, in_channels, input_height, input_width = X_shape
+    out_channels, _, filter_height, filter_width = W_shape
+    itemsize = np.dtype(dtype).itemsize
+    out_dtype = np.dtype(dtype) if out_dtype is None else DTYPES[out_dtype]
+
+    out_height = (input_height + 2 * pad_size - dilation * (filter_height - 1) - 1) // stride + 1
+    out_width = (input_width + 2 * pad_size - dilation * (filter_width - 1) - 1) // stride + 1
+    pool_stride = pool_stride or pool_size
+    out_pool_height = (out_height - pool_size) // pool_stride + 1
+    out_pool_width = (out_width - pool_size) // pool_stride + 1
+
+    num_c_in_tiles = -(-in_channels // PMAX)
+    num_c_out_tiles = -(-out_channels // PMAX)
+    taps = filter_height * filter_width
+    # rows the kernel computes: whole pool windows only
+    rows = out_pool_height * pool_size
+
+    # useful work, independent of tiling
+    flops = 2 * batch_size * out_channels * (in_channels // groups) * taps * out_height * out_width
+
+    conv = ConvShape(
+        X_shape, W_shape, pool_size, pool_stride=pool_stride, pack_rows=pack_rows, band_rows=band_rows, dtype=dtype,
+        pad_size=pad_size, stride=stride, dilation=dilation, batch_stationary=batch_stationary, out_dtype=out_dtype,
+        groups=groups, layout=layout,
+    )
+    ragged = in_channels % PMAX != 0 or out_channels % PMAX != 0
+    if pool_type != "max" or pool_stride != pool_size or pad_size > 0 or stride != 1 or dilation != 1 or ragged:
+        # only the row-band schedule implements these
+        row_reuse = True
+    # nor 1x1, large, tap-stacked or grouped convs
+    if conv.gemm or conv.pack_rows or conv.stack_taps or groups > 1 or layout == "NHWC":
+        row_reuse = True
+    banded = conv.batch_stationary or row_reuse
+
+    # (out_tile, in_tile) pairs multiplied: only those within a group
+    tile_pairs = sum(conv.c_in_tile_span(out_tile)[1] for out_tile in range(num_c_out_tiles))
+
+    # weight prologue: one DMA per (out_tile, in_tile), plus one transpose per
+    # tap unless the weights were prepacked; stacked weights are then moved
+    # into place with one DMA per (out_tile, filter column). Grouped weights
+    # take a load, transposes and a placing DMA per diagonal block, depthwise
+    # ones a DMA per tile
+    dma_count = num_c_out_tiles * num_c_in_tiles
+    transpose_count = 0 if prepacked else num_c_out_tiles * num_c_in_tiles * taps
+    if conv.depthwise:
+        dma_count, transpose_count = num_c_out_tiles, 0
+    elif groups > 1:
+        num_blocks = len(grouped_weight_blocks(out_channels, in_channels, groups))
+        dma_count, transpose_count = 2 * num_blocks, num_blocks * taps
+    if conv.stack_taps:
+        dma_count += num_c_out_tiles * filter_width
+    read_bytes = out_channels * (in_channels // groups) * taps * itemsize
+
+    # PSUM tiles (matmul groups) per image and output-channel tile
+    row_groups = rows
+    if banded:
+        # the batch-stationary schedule treats each whole image as one band
+        band_pool_rows = out_pool_height if conv.batch_stationary else conv.band_pool_rows
+        num_bands = -(-out_pool_height // band_pool_rows)
+        band_sizes = [band_pool_rows] * (out_pool_height // band_pool_rows)
+        if out_pool_height % band_pool_rows:
+            band_sizes.append(out_pool_height % band_pool_rows)
+        conv_rows = [conv.conv_rows(size) for size in band_sizes]
+        if conv.gemm and not conv.batch_stationary:
+            # flat moving tiles that cross row boundaries
+            row_groups = sum(-(-(size * conv.out_width) // MOVING_FMAX) for size in conv_rows)
+        else:
+            row_groups = sum(-(-size // conv.rows_per_psum) for size in conv_rows)
+        # input: the rows each band's filter span covers (padding is not read),
+        # once per (image, band, in_tile)
+        input_loads = batch_size * num_bands * num_c_in_tiles
+        band_in_rows = []
+        for start, band_conv_rows in zip(range(0, out_pool_height, band_pool_rows), conv_rows):
+            in_start = conv.in_row_start(start)
+            band_in_rows.append(min(in_start + conv.in_rows(band_conv_rows), input_height) - max(in_start, 0))
+        input_rows = batch_size * num_c_in_tiles * sum(band_in_rows)
+        if conv.stack_taps:
+            # SBUF-to-SBUF copies of each band, one per filter column
+            dma_count += batch_size * num_bands * filter_width
+        if layout == "NHWC":
+            # one DMA per chunk of 128 columns, and a transpose per row of it
+            in_col_chunks = -(-input_width // PMAX)
+            input_loads *= in_col_chunks
+            transpose_count += input_rows * in_col_chunks
+        # bias: one load per (image, band, out_tile), or per out_tile when batch-stationary
+        bias_loads = num_c_out_tiles if conv.batch_stationary else batch_size * num_bands * num_c_out_tiles
+    else:
+        # input: filter_height rows per (image, out_tile, row, in_tile)
+        input_loads = batch_size * num_c_out_tiles * rows * num_c_in_tiles
+        input_rows = input_loads * filter_height
+        # bias: one load per (image, out_tile)
+        bias_loads = batch_size * num_c_out_tiles
+
+    dma_count += bias_loads
+    read_bytes += bias_loads * PMAX * itemsize
+    dma_count += input_loads
+    read_bytes += input_rows * PMAX * input_width * itemsize
+
+    # stacked filter columns share one matmul per filter row
+    matmul_count = batch_size * tile_pairs * row_groups * filter_height * conv.col_taps
+    vector_count = 0
+    if conv.depthwise:
+        # one multiply-accumulate per tap over each band, instead of matmuls
+        matmul_count = 0
+        vector_count = batch_size * num_c_out_tiles * num_bands * taps
+
+    # output: one DMA per (image, out_tile, band) in the row-band schedule,
+    # one per (image, out_tile, pooled row) otherwise
+    if banded:
+        out_col_chunks = 1
+        if layout == "NHWC":
+            # transposed back a row and 128 columns at a time
+            out_col_chunks = -(-out_pool_width // PMAX)
+            transpose_count += batch_size * num_c_out_tiles * out_pool_height * out_col_chunks
+        dma_count += batch_size * num_c_out_tiles * num_bands * out_col_chunks
+    else:
+        dma_count += batch_size * num_c_out_tiles * out_pool_height
+    write_bytes = batch_size * out_channels * out_pool_height * out_pool_width * out_dtype.itemsize
+
+    peak_flops = PEAK_VECTOR_FLOPS if conv.depthwise else PEAK_FLOPS_BY_DTYPE[np.dtype(dtype)]
+    compute_us = flops / peak_flops * 1e6
+    memory_us = (read_bytes + write_bytes) / PEAK_HBM_BYTES_PER_S * 1e6
+
+    return {
+        "flops": flops,
+        "hbm_read_bytes": read_bytes,
+        "hbm_write_bytes": write_bytes,
+        "dma_count": dma_count,
+        "matmul_count": matmul_count,
+        "transpose_count": transpose_count,
+        "vector_count": vector_count,
+        "compute_us": compute_us,
+        "memory_us": memory_us,
+        "roofline_us": max(compute_us, memory_us),
+        "bound": "compute" if compute_us >= memory_us else "DMA",
+        "peak_flops": peak_flops,
+    }
+
+
+def format_report(cost, measured_us=None):
+    lines = [
+        f"  FLOPs: {cost['flops'] / 1e9:.2f} GFLOP",
+        f"  HBM traffic: {cost['hbm_read_bytes'] / 2**20:.1f} MiB read, "
+        f"{cost['hbm_write_bytes'] / 2**20:.1f} MiB written",
+        f"  Instructions: {cost['dma_count']} DMAs, {cost['matmul_count']} nc_matmul, "
+        f"{cost['transpose_count']} nc_transpose"
+        + (f", {cost['vector_count']} depthwise multiply-accumulates" if cost["vector_count"] else ""),
+        f"  Roofline: {cost['roofline_us']:.1f} μs ({cost['bound']}-bound; "
+        f"compute {cost['compute_us']:.1f} μs, memory {cost['memory_us']:.1f} μs)",
+    ]
+    if measured_us is not None:
+        seconds = measured_us * 1e-6
+        mfu = cost["flops"] / seconds / cost["peak_flops"]
+        bandwidth = (cost["hbm_read_bytes"] + cost["hbm_write_bytes"]) / seconds
+        lines.append(
+            f"  Measured: {measured_us:.1f} μs, MFU {mfu:.1%}, "
+            f"HBM bandwidth {bandwidth / 1e9:.1f} GB/s ({bandwidth / PEAK_HBM_BYTES_PER_S:.1%} of peak)"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,185 @@
+"""
+On-disk cache of test harness inputs and reference outputs.
+
+Every fixture lives in its own directory under the store root, named after a
+hash of (seed, shapes, dtype, use_bias, centered). It holds X.npy, W.npy, bias.npy, and one
+golden output per pool_size and epilogue options. Arrays are reopened memory-mapped, so repeat runs
+skip both the random data generation and the reference convolution.
+
+The store is capped by total size on disk. Using a fixture touches its
+directory's mtime, and the least recently used fixtures are evicted first
+once the cap is exceeded. Several harness processes (--jobs) may share one
+store: touching and eviction are serialized by a flock on the store root, and
+fixtures used within the last EVICT_GRACE_S seconds are never evicted, since
+another process may still have them open.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+EVICT_GRACE_S = 600
+
+
+def allclose_blockwise(actual, expected, **kwargs):
+    """np.allclose over the leading axis, one slice at a time.
+
+    Comparing block by block keeps memory-mapped references paged in a slice
+    at a time, instead of materializing a second full copy of the output.
+    """
+    actual = np.asarray(actual)
+    if actual.shape != expected.shape:
+        return False
+    if actual.ndim == 0:
+        return np.allclose(actual, expected, **kwargs)
+    for i in range(actual.shape[0]):
+        if not np.allclose(actual[i], expected[i], **kwargs):
+            return False
+    return True
+
+
+def random_inputs(rng, X_shape, W_shape, dtype, use_bias, centered=False):
+    """
+    Draw (X, W, bias) from `rng` (a np.random.Generator or np.random itself).
+
+    By default every array is uniform in [0, 1), so every pre-activation is
+    large and positive. centered=True draws W and bias around zero instead,
+    with W scaled by its fan-in, so pre-activations take both signs and
+    activation epilogues see their nonlinear range.
+    """
+    X = rng.random(X_shape).astype(dtype)
+    out_channels = W_shape[0]
+    if centered:
+        fan_in = int(np.prod(W_shape[1:]))
+        W = ((rng.random(W_shape) - 0.5) / np.sqrt(fan_in)).astype(dtype)
+        bias = rng.random(out_channels) - 0.5
+    else:
+        W = rng.random(W_shape).astype(dtype)
+        bias = rng.random(out_channels)
+    bias = bias.astype(dtype) if use_bias else np.zeros(out_channels).astype(dtype)
+    return X, W, bias
+
+
+class FixtureStore:
+    def __init__(self, root, max_bytes=16 * 2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _entry_dir(self, seed, X_shape, W_shape, dtype, use_bias, centered=False):
+        key = f"{seed}-{'x'.join(map(str, X_shape))}-{'x'.join(map(str, W_shape))}-{np.dtype(dtype).name}-{int(use_bias)}"
+        if centered:
+            key += "-centered"
+        return os.path.join(self.root, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    def _load(self, path):
+        return np.load(path, mmap_mode="r")
+
+    def _save(self, path, array):
+        # write under a unique temporary name in the same directory, so an
+        # interrupted run never leaves a truncated fixture behind and two
+        # processes filling the same entry never share a scratch file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp.npy")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _touch(self, entry):
+        now = time.time()
+        os.utime(entry, (now, now))
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive=False):
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _claim(self, entry, paths):
+        """
+        Mark `entry` as in use and return whether all of `paths` exist.
+
+        Done under the shared lock, so an evictor either sees the fresh mtime
+        and skips the entry, or removes it before we check and we regenerate.
+        """
+        with self._locked():
+            os.makedirs(entry, exist_ok=True)
+            self._touch(entry)
+            return all(os.path.exists(path) for path in paths)
+
+    def inputs(self, seed, X_shape, W_shape, dtype, use_bias, centered=False):
+        """Return memory-mapped (X, W, bias), generating them on first use."""
+        entry = self._entry_dir(seed, X_shape, W_shape, dtype, use_bias, centered)
+        names = ("X.npy", "W.npy", "bias.npy")
+        paths = [os.path.join(entry, name) for name in names]
+
+        if not self._claim(entry, paths):
+            rng = np.random.default_rng([seed, *X_shape, *W_shape])
+            X, W, bias = random_inputs(rng, X_shape, W_shape, dtype, use_bias, centered)
+            for path, array in zip(paths, (X, W, bias)):
+                self._save(path, array)
+            self._evict(keep=entry)
+
+        # .npy files store ml_dtypes arrays (bfloat16, fp8) as raw bytes; view them back
+        return tuple(self._load(path).view(dtype) for path in paths)
+
+    def reference(self, seed, X_shape, W_shape, dtype, use_bias, pool_size, compute, ref_opts=None, centered=False):
+        """
+        Return the memory-mapped golden output, calling `compute()` on a miss.
+
+        ref_opts: any further reference keyword arguments (activation, pool
+        stride, ...) the output depends on; they become part of its file name.
+        """
+        entry = self._entry_dir(seed, X_shape, W_shape, dtype, use_bias, centered)
+        name = f"ref_pool{pool_size}"
+        for opt, value in sorted((ref_opts or {}).items()):
+            if value is not None:
+                name += f"_{opt}-{value}"
+        path = os.path.join(entry, name + ".npy")
+
+        if not self._claim(entry, [path]):
+            self._save(path, np.asarray(compute()))
+            self._evict(keep=entry)
+
+        return self._load(path)
+
+    def _entry_bytes(self, entry):
+        total = 0
+        for name in os.listdir(entry):
+            # other processes' scratch files may vanish while we look
+            with contextlib.suppress(FileNotFoundError):
+                total += os.path.getsize(os.path.join(entry, name))
+        return total
+
+    def _evict(self, keep=None):
+        with self._locked(exclusive=True):
+            entries = [
+                os.path.join(self.root, name)
+                for name in os.listdir(self.root)
+                if os.path.isdir(os.path.join(self.root, name))
+            ]
+            mtimes = {entry: os.path.getmtime(entry) for entry in entries}
+            sizes = {entry: self._entry_bytes(entry) for entry in entries}
+            total = sum(sizes.values())
+            in_use_since = time.time() - EVICT_GRACE_S
+
+            # oldest mtime first
+            for entry in sorted(entries, key=mtimes.get):
+                if total <= self.max_bytes:
+                    break
+                if entry == keep or mtimes[entry] >= in_use_since:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= sizes[entry]
@@ -0,0 +1,178 @@
+"""
+Store of the NEFFs the test harness compiles, indexed by kernel signature.
+
+Kernels are keyed by their signature: a hash of the kernel's sources (its own
+file and the local modules it imports), the input shapes and dtypes, the
+keyword arguments (pool_size, ...) and the compile options. Within a process,
+one nki.baremetal / nki.benchmark wrapper is kept per signature and reused
+across calls, instead of a fresh wrapper per test case. The NEFF produced for
+each signature is kept in the store directory and listed in an index.json, so
+an unchanged kernel's artifact (e.g. for `--profile` or neuron-profile) can be
+found by signature across runs.
+
+This is not a compilation cache: NKI has no entry point that runs a
+previously built NEFF, so every call still compiles. Several harness
+processes (--jobs) may record into the same directory: index updates are
+merged under a flock on index.json.lock.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import neuronxcc.nki as nki
+
+
+def local_source_files(module):
+    """
+    Source files of `module` and of every module in its directory it imports,
+    directly or through another such module, e.g. conv2d.py and conv_shape.py.
+    """
+    root = os.path.dirname(os.path.abspath(module.__file__))
+    seen = {module.__name__: module}
+    pending = [module]
+    while pending:
+        for value in vars(pending.pop()).values():
+            imported = value if inspect.ismodule(value) else inspect.getmodule(value)
+            path = getattr(imported, "__file__", None)
+            if path is None or imported.__name__ in seen:
+                continue
+            if os.path.dirname(os.path.abspath(path)) == root:
+                seen[imported.__name__] = imported
+                pending.append(imported)
+    return sorted(os.path.abspath(imported.__file__) for imported in seen.values())
+
+
+def kernel_source_hash(kernel):
+    """Hash of the sources `kernel` is built from, so helper edits count too."""
+    func = getattr(kernel, "func", kernel)
+    module = inspect.getmodule(func)
+    if module is None or getattr(module, "__file__", None) is None:
+        return hashlib.sha1(func.__name__.encode()).hexdigest()
+    digest = hashlib.sha1()
+    for path in local_source_files(module):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def kernel_signature(kernel, args, kwargs, compile_opt=None, grid=None):
+    func = getattr(kernel, "func", kernel)
+    parts = [func.__name__, kernel_source_hash(kernel), compile_opt or "", repr(grid)]
+    for arg in args:
+        arg = np.asarray(arg)
+        parts.append(f"{arg.shape}:{arg.dtype.name}")
+    for name in sorted(kwargs):
+        parts.append(f"{name}={kwargs[name]!r}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:24]
+
+
+class StoredKernel:
+    """Callable standing in for nki.baremetal(kernel) / nki.benchmark(...)(kernel)."""
+
+    def __init__(self, store, kernel, mode, save_neff_name=None, **nki_kwargs):
+        self.store = store
+        self.kernel = kernel
+        self.mode = mode
+        self.save_neff_name = save_neff_name
+        self.nki_kwargs = nki_kwargs
+        self.grid = None
+        self.benchmark_result = None
+
+    def __getitem__(self, grid):
+        """
+        SPMD launch grid, as for the nki wrappers: stored_kernel[grid](*args).
+        Returns a new StoredKernel bound to the grid; this one is unchanged.
+        """
+        launch = StoredKernel(self.store, self.kernel, self.mode, self.save_neff_name, **self.nki_kwargs)
+        launch.grid = grid
+        return launch
+
+    def __call__(self, *args, **kwargs):
+        compile_opt = self.nki_kwargs.get("additional_compile_opt")
+        key = kernel_signature(self.kernel, args, kwargs, compile_opt, self.grid)
+        wrapper, neff_path = self.store.lookup(key, self)
+
+        launch = wrapper[self.grid] if self.grid is not None else wrapper
+        out = launch(*args, **kwargs)
+        self.store.record(key, self.kernel, neff_path)
+
+        if self.mode == "benchmark":
+            self.benchmark_result = launch.benchmark_result
+        if self.save_neff_name and os.path.exists(neff_path):
+            shutil.copyfile(neff_path, self.save_neff_name)
+        return out
+
+    def build(self, neff_path):
+        if self.mode == "baremetal":
+            return nki.baremetal(self.kernel, save_neff_name=neff_path, **self.nki_kwargs)
+        return nki.benchmark(save_neff_name=neff_path, **self.nki_kwargs)(self.kernel)
+
+
+class NeffStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, "index.json")
+        self._wrappers = {}
+
+        os.makedirs(store_dir, exist_ok=True)
+        with self._locked():
+            self.index = self._read_index()
+        self.initial_entries = len(self.index)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.index_path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def baremetal(self, kernel, **nki_kwargs):
+        return StoredKernel(self, kernel, "baremetal", **nki_kwargs)
+
+    def benchmark(self, kernel, save_neff_name=None, **nki_kwargs):
+        return StoredKernel(self, kernel, "benchmark", save_neff_name=save_neff_name, **nki_kwargs)
+
+    def lookup(self, key, stored_kernel):
+        """Return (nki wrapper, NEFF path) for a signature."""
+        wrapper_key = (key, stored_kernel.mode, tuple(sorted(stored_kernel.nki_kwargs.items())))
+        neff_path = os.path.join(self.store_dir, key + ".neff")
+
+        if wrapper_key not in self._wrappers:
+            self._wrappers[wrapper_key] = stored_kernel.build(neff_path)
+        return self._wrappers[wrapper_key], neff_path
+
+    def record(self, key, kernel, neff_path):
+        if key in self.index or not os.path.exists(neff_path):
+            return
+        func = getattr(kernel, "func", kernel)
+        with self._locked():
+            # merge into the index on disk, which other processes may have
+            # extended since we last read it
+            self.index = self._read_index()
+            self.index[key] = {"kernel": func.__name__, "neff": os.path.basename(neff_path)}
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".json.tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.index, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+
+    def stats(self):
+        with self._locked():
+            self.index = self._read_index()
+        new_entries = len(self.index) - self.initial_entries
+        return f"NEFF store: {len(self.index)} NEFFs indexed, {new_entries} new this run"
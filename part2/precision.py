@@ -0,0 +1,46 @@
+"""
+Host-side dtypes for the conv kernel's precisions, and the tolerances the
+harness checks each output dtype against.
+
+NumPy has no bfloat16 or fp8 types; ml_dtypes (installed with neuronx-cc)
+provides them, and arrays of these types are passed to the kernel as
+nl.bfloat16, nl.float8_e4m3 and nl.float8_e5m2. The names below are the ones
+the kernel's out_dtype option takes.
+"""
+
+import ml_dtypes
+import numpy as np
+
+DTYPES = {
+    "float32": np.dtype(np.float32),
+    "float16": np.dtype(np.float16),
+    "bfloat16": np.dtype(ml_dtypes.bfloat16),
+    "float8_e4m3": np.dtype(ml_dtypes.float8_e4m3fn),
+    "float8_e5m2": np.dtype(ml_dtypes.float8_e5m2),
+}
+
+# (rtol, atol) per output dtype. The reference is computed in fp32 from the
+# same (already rounded) inputs, so the kernel's error is dominated by the one
+# rounding of the output: about one ulp of the output's mantissa. float32 keeps
+# np.allclose's defaults.
+TOLERANCES = {
+    "float32": (1e-5, 1e-8),
+    "float16": (1e-3, 1e-3),
+    "bfloat16": (1e-2, 1e-2),
+    "float8_e4m3": (1.25e-1, 1.25e-1),
+    "float8_e5m2": (2.5e-1, 2.5e-1),
+}
+
+
+def dtype_name(dtype):
+    """The kernel's name for a NumPy dtype (or scalar type), e.g. "bfloat16"."""
+    dtype = np.dtype(dtype)
+    for name, known in DTYPES.items():
+        if known == dtype:
+            return name
+    raise ValueError(f"Unsupported dtype {dtype}")
+
+
+def tolerance(dtype):
+    """(rtol, atol) for comparing an output of this dtype against the fp32 reference."""
+    return TOLERANCES[dtype_name(dtype)]
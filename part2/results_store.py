@@ -0,0 +1,151 @@
+"""
+SQLite store of benchmark runs, with regression detection against a baseline.
+
+Every performance run is recorded with its kernel hash, input shape, dtype,
+pool_size and launch configuration (the kernel options it ran with, e.g.
+row_reuse, layout or shard_by, and the number of NeuronCores), together with
+the raw per-iteration latencies from nki.benchmark. A run can be marked as the
+baseline; later runs of the same (shape, dtype, pool_size, configuration) are
+compared against the latest baseline with a Mann-Whitney U test on the full
+sample sets, rather than by a single percentile.
+"""
+
+import json
+import math
+import sqlite3
+import time
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kernel_hash TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    dtype TEXT NOT NULL,
+    pool_size INTEGER NOT NULL,
+    config TEXT NOT NULL DEFAULT '{}',
+    is_baseline INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    latency_us REAL NOT NULL
+);
+"""
+
+# runs recorded before the configuration was part of the key keep config '{}',
+# which no new run matches
+MIGRATIONS = """
+DROP INDEX IF EXISTS runs_key;
+CREATE INDEX IF NOT EXISTS runs_config_key ON runs (shape, dtype, pool_size, config, is_baseline);
+"""
+
+
+def mann_whitney_u(a, b):
+    """
+    Two-sided Mann-Whitney U test, normal approximation with tie correction.
+
+    Returns the p-value for the hypothesis that `a` and `b` come from the same
+    distribution.
+    """
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    n_a, n_b = len(a), len(b)
+    combined = np.concatenate([a, b])
+
+    # average ranks for ties
+    order = np.argsort(combined, kind="mergesort")
+    ranks = np.empty(len(combined))
+    ranks[order] = np.arange(1, len(combined) + 1)
+    _, inverse, counts = np.unique(combined, return_inverse=True, return_counts=True)
+    rank_sums = np.bincount(inverse, weights=ranks)
+    ranks = (rank_sums / counts)[inverse]
+
+    u_a = ranks[:n_a].sum() - n_a * (n_a + 1) / 2
+    mean_u = n_a * n_b / 2
+    n = n_a + n_b
+    tie_term = ((counts**3 - counts).sum()) / (n * (n - 1))
+    var_u = n_a * n_b / 12 * ((n + 1) - tie_term)
+    if var_u <= 0:
+        return 1.0
+
+    # continuity correction
+    z = (abs(u_a - mean_u) - 0.5) / math.sqrt(var_u)
+    return math.erfc(max(z, 0.0) / math.sqrt(2))
+
+
+class ResultStore:
+    def __init__(self, path, alpha=0.01, min_effect=0.02):
+        """
+        alpha: significance level of the Mann-Whitney test.
+        min_effect: smallest relative change in median latency that is reported,
+            so statistically significant but negligible shifts are ignored.
+        """
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(runs)")]
+        if "config" not in columns:
+            self.conn.execute("ALTER TABLE runs ADD COLUMN config TEXT NOT NULL DEFAULT '{}'")
+        self.conn.executescript(MIGRATIONS)
+        self.alpha = alpha
+        self.min_effect = min_effect
+
+    @staticmethod
+    def _key(shape, dtype, pool_size, config=None):
+        """
+        config: the launch configuration, e.g. {"row_reuse": True,
+            "shard_by": "batch", "num_cores": 2}; stored as sorted JSON.
+        """
+        config = json.dumps(config or {}, sort_keys=True, default=str)
+        return "x".join(map(str, shape)), np.dtype(dtype).name, int(pool_size), config
+
+    def record(self, kernel_hash, shape, dtype, pool_size, samples, config=None, is_baseline=False):
+        shape, dtype, pool_size, config = self._key(shape, dtype, pool_size, config)
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (kernel_hash, shape, dtype, pool_size, config, is_baseline, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kernel_hash, shape, dtype, pool_size, config, int(is_baseline), time.time()),
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO samples (run_id, latency_us) VALUES (?, ?)",
+                [(run_id, float(sample)) for sample in samples],
+            )
+        return run_id
+
+    def baseline_samples(self, shape, dtype, pool_size, config=None):
+        """Samples of the latest baseline run for this key, or None if there is none."""
+        row = self.conn.execute(
+            "SELECT id FROM runs WHERE shape = ? AND dtype = ? AND pool_size = ? AND config = ? "
+            "AND is_baseline = 1 ORDER BY created DESC LIMIT 1",
+            self._key(shape, dtype, pool_size, config),
+        ).fetchone()
+        if row is None:
+            return None
+        samples = self.conn.execute(
+            "SELECT latency_us FROM samples WHERE run_id = ?", (row[0],)
+        ).fetchall()
+        return np.array([sample for (sample,) in samples])
+
+    def compare(self, shape, dtype, pool_size, samples, config=None):
+        """
+        Compare `samples` against the latest baseline.
+
+        Returns a dict with the verdict ("regression", "improvement",
+        "unchanged", "no baseline", or "inconclusive" when `samples` is None
+        because the benchmark returned no raw latencies), the relative change
+        in median latency and the test's p-value.
+        """
+        baseline = self.baseline_samples(shape, dtype, pool_size, config)
+        if baseline is None or len(baseline) == 0:
+            return {"verdict": "no baseline", "change": None, "p_value": None}
+        if samples is None:
+            return {"verdict": "inconclusive", "change": None, "p_value": None}
+
+        change = float(np.median(samples) / np.median(baseline) - 1)
+        p_value = mann_whitney_u(samples, baseline)
+        verdict = "unchanged"
+        if p_value < self.alpha and abs(change) >= self.min_effect:
+            verdict = "regression" if change > 0 else "improvement"
+        return {"verdict": verdict, "change": change, "p_value": p_value}
@@ -6,17 +6,44 @@ import neuronxcc.nki.language as nl
 import neuronxcc.nki.isa as nisa
 from neuronxcc.nki import baremetal
 from neuronxcc.nki import benchmark
+import os
+import sys
 
-from conv2d import fused_conv2d_maxpool as conv2d
+# modules shared with part1 (pipeline, latency) live in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
 
-from conv2d_numpy import conv2d_cpu_torch
+from conv2d import fused_conv2d_maxpool as conv2d
+from conv2d import prepack_conv_weights
+from conv_network import fused_conv_network, network_layers
+
+from conv2d_numpy import conv2d_cpu_torch, conv2d_cpu_numpy, torch
+from fixtures import FixtureStore, allclose_blockwise, random_inputs
+from neff_store import NeffStore, kernel_source_hash
+from results_store import ResultStore
+from latency import latency_samples
+from cost_model import analyze_conv, format_report
+from pipeline import make_compile_pool, run_ordered
+from throughput import throughput_point, find_saturation, format_throughput_table
+from precision import DTYPES, dtype_name, tolerance
 import logging
 import argparse
+import ast
 
 import subprocess
 
 logging.disable(logging.OFF)
 
+# Kernel options that change the result, and so are passed to the reference too
+REFERENCE_OPTS = ("activation", "pool_type", "pool_stride", "pad_size", "stride", "dilation", "groups")
+
+# (out_channels, filter_size, layer options) of the stack --test_network runs;
+# the last layer has a partial channel tile
+NETWORK_TEST_LAYERS = [
+    (128, 3, {"pad_size": 1, "activation": "relu"}),
+    (256, 3, {"pad_size": 1, "activation": "relu", "pool_size": 2}),
+    (200, 3, {"pad_size": 1, "pool_size": 2, "pool_type": "avg"}),
+]
+
 
 def save_trace(profile_name):
     """Run the profiler and save the NEFF and NTFF files with the specified name."""
@@ -43,10 +70,30 @@ def test_correctness_conv2d_kernel(
     use_larger_images=False,
     use_bias=False,
     use_maxpool=False,
+    fixtures=None,
+    seed=0,
+    neff_store=None,
+    kernel_opts=None,
+    conv_opts=None,
+    channels=None,
+    num_cores=1,
+    dtype=np.float32,
+    out_dtype=None,
+    kernel_sizes=None,
+    centered=False,
 ):
     if not simulate:
-        kernel = baremetal(kernel)
-    ref_impl = conv2d_cpu_torch
+        kernel = neff_store.baremetal(kernel) if neff_store is not None else baremetal(kernel)
+        kernel = spmd_launch(kernel, num_cores)
+    # conv_opts (padding, stride, dilation) are part of the test case itself
+    kernel_opts = {**(kernel_opts or {}), **(conv_opts or {})}
+    if out_dtype is not None:
+        kernel_opts["out_dtype"] = out_dtype
+    rtol, atol = tolerance(DTYPES[out_dtype] if out_dtype is not None else dtype)
+    # prepacked kernels take weights from prepack_conv_weights, run the same way as the kernel
+    pack_weights = simulate_kernel_wrapper(prepack_conv_weights) if simulate else baremetal(prepack_conv_weights)
+    # fall back to the vectorized NumPy reference on machines without torch
+    ref_impl = conv2d_cpu_torch if torch is not None else conv2d_cpu_numpy
 
     input_channels_list = [128, 256]
     output_channels_list = [128, 256]
@@ -60,39 +107,104 @@ def test_correctness_conv2d_kernel(
         output_channels_list = [256]
         image_dims_list = [(224, 224)]
 
+    if channels is not None:
+        # (in_channels, out_channels) overrides, e.g. counts that are not multiples of 128
+        input_channels_list = [channels[0]]
+        output_channels_list = [channels[1]]
+
+    # grouped convs take [out, in // groups, kh, kw] weights, as in torch
+    groups = kernel_opts.get("groups", 1)
+    # NHWC kernels get channels-last inputs; the reference stays NCHW
+    channels_last = kernel_opts.get("layout") == "NHWC"
+
+    if kernel_sizes is not None:
+        # other filter sizes dispatch to the 1x1 and large-filter schedules
+        kernel_size_list = list(kernel_sizes)
+
     for input_channels in input_channels_list:
         for output_channels in output_channels_list:
             for kernel_size in kernel_size_list:
                 for batch_size in batch_size_list:
                     for image_dims in image_dims_list:
-                        X = np.random.rand(
-                            batch_size, input_channels, image_dims[0], image_dims[1]
-                        ).astype(np.float32)
-                        W = np.random.rand(
-                            output_channels, input_channels, kernel_size, kernel_size
-                        ).astype(np.float32)
-                        bias = (
-                            np.zeros(output_channels).astype(np.float32)
-                            if not use_bias
-                            else np.random.rand(output_channels).astype(np.float32)
-                        )
+                        X_shape = (batch_size, input_channels, image_dims[0], image_dims[1])
+                        W_shape = (output_channels, input_channels // groups, kernel_size, kernel_size)
+                        if fixtures is not None:
+                            X, W, bias = fixtures.inputs(seed, X_shape, W_shape, dtype, use_bias, centered)
+                        else:
+                            X, W, bias = random_inputs(np.random, X_shape, W_shape, dtype, use_bias, centered)
 
                         args = [X, W, bias]
                         kwargs = {"pool_size": pool_size}
+                        ref_opts = {opt: kernel_opts[opt] for opt in REFERENCE_OPTS if opt in kernel_opts}
+                        # the reference runs in fp32 on the same rounded inputs
+                        ref_args = args if np.dtype(dtype) == np.float32 else [arg.astype(np.float32) for arg in args]
+
+                        kernel_args = [X, pack_weights(W), bias] if kernel_opts.get("prepacked") else args
+                        if channels_last:
+                            kernel_args = [to_nhwc(X)] + kernel_args[1:]
+                        launch_opts = spmd_kernel_opts(kernel_opts, num_cores, batch_size, output_channels)
+                        out = np.asarray(kernel(*kernel_args, **kwargs, **launch_opts)).astype(np.float32, copy=False)
+                        if channels_last:
+                            out = out.transpose(0, 3, 1, 2)
+                        if fixtures is not None:
+                            out_ref = fixtures.reference(
+                                seed, X_shape, W_shape, dtype, use_bias, pool_size,
+                                lambda: ref_impl(*ref_args, **kwargs, **ref_opts),
+                                ref_opts=ref_opts, centered=centered,
+                            )
+                            passed = allclose_blockwise(out, out_ref, rtol=rtol, atol=atol)
+                        else:
+                            out_ref = ref_impl(*ref_args, **kwargs, **ref_opts)
+                            passed = np.allclose(out, out_ref, rtol=rtol, atol=atol)
 
-                        out = kernel(*args, **kwargs)
-                        out_ref = ref_impl(*args, **kwargs)
-
-                        if not np.allclose(out, out_ref):
+                        if not passed:
                             print(
                                 f"Output mismatch for {input_channels=}, {output_channels=}, {kernel_size=}, "
-                                f"{batch_size=}, {image_dims=}, {use_bias=}, {use_maxpool=}"
+                                f"{batch_size=}, {image_dims=}, {use_bias=}, {use_maxpool=}, {conv_opts=}, "
+                                f"dtype={dtype_name(dtype)}, {out_dtype=}"
                             )
                             return False
 
     return True
 
 
+def test_correctness_conv_network(kernel, simulate=False, seed=0, neff_store=None, layer_specs=NETWORK_TEST_LAYERS):
+    """
+    Run a conv stack through fused_conv_network and compare it with the
+    reference applied layer by layer. The small image keeps every
+    intermediate in SBUF; the larger one spills the first to HBM.
+    """
+    if not simulate:
+        kernel = neff_store.baremetal(kernel) if neff_store is not None else baremetal(kernel)
+    ref_impl = conv2d_cpu_torch if torch is not None else conv2d_cpu_numpy
+    layers = network_layers(*[opts for (_, _, opts) in layer_specs])
+
+    for X_shape in [(2, 128, 32, 16), (1, 128, 160, 160)]:
+        rng = np.random.default_rng([seed, *X_shape])
+        X = rng.random(X_shape).astype(np.float32)
+        params = []
+        in_channels = X_shape[1]
+        for out_channels, filter_size, _ in layer_specs:
+            # centered and scaled by fan-in, so activations stay O(1) through the stack
+            fan_in = in_channels * filter_size * filter_size
+            W = ((rng.random((out_channels, in_channels, filter_size, filter_size)) - 0.5) / np.sqrt(fan_in))
+            params += [W.astype(np.float32), rng.random(out_channels).astype(np.float32)]
+            in_channels = out_channels
+
+        out = kernel(X, *params, layers=layers)
+
+        out_ref = X
+        for (W, bias), (_, _, opts) in zip(zip(params[0::2], params[1::2]), layer_specs):
+            out_ref = np.asarray(ref_impl(out_ref, W, bias, **{"pool_size": 1, **opts}))
+
+        # rounding differences compound over the layers
+        if not np.allclose(out, out_ref, rtol=1e-4, atol=1e-5):
+            print(f"Output mismatch for {X_shape=}, layers={[opts for (_, _, opts) in layer_specs]}")
+            return False
+
+    return True
+
+
 def test_performance_conv2d_kernel(
     kernel,
     dtype=np.float32,
@@ -104,47 +216,205 @@ def test_performance_conv2d_kernel(
     kernel_height=3,
     kernel_width=3,
     pool_size=1,
-    profile=None
+    profile=None,
+    fixtures=None,
+    seed=0,
+    neff_store=None,
+    kernel_opts=None,
+    num_cores=1,
+    results_store=None,
+    save_baseline=False,
+    compare_baseline=False,
+    report=False,
+    out_dtype=None,
 ):
     # a performance requirement map (dtype, image_height) ->
     # [relaxed performance threshold, optimized performance threshold]
     performance_requirements_by_dtype_size = {
-        (np.float32, 224): [4964, 4596],
-        (np.float16, 224): [1365, 1002],
-        (np.float32, 32): [110, 110],
-        (np.float16, 32): [84, 84],
+        ("float32", 224): [4964, 4596],
+        ("float16", 224): [1365, 1002],
+        ("float32", 32): [110, 110],
+        ("float16", 32): [84, 84],
+        # bfloat16 moves the same bytes at the same matmul rate as float16
+        ("bfloat16", 224): [1365, 1002],
+        ("bfloat16", 32): [84, 84],
+        # fp8 halves the input DMA bytes and doubles the matmul rate again (the
+        # output is widened to bfloat16); the small image is bound by fixed
+        # overheads, not by either
+        ("float8_e4m3", 224): [683, 501],
+        ("float8_e4m3", 32): [84, 84],
+        ("float8_e5m2", 224): [683, 501],
+        ("float8_e5m2", 32): [84, 84],
     }
+    # the thresholds are for 3x3 filters; other sizes are only timed
+    requirements = None
+    if (kernel_height, kernel_width) == (3, 3):
+        requirements = performance_requirements_by_dtype_size[(dtype_name(dtype), image_height)]
+
+    X_shape = (batch_size, in_channels, image_height, image_width)
+    W_shape = (out_channels, in_channels, kernel_height, kernel_width)
+    kernel_opts = kernel_opts or {}
+    if out_dtype is not None:
+        kernel_opts = {**kernel_opts, "out_dtype": out_dtype}
+    kwargs = {"pool_size": pool_size}
 
-    X = np.random.rand(batch_size, in_channels, image_height, image_width).astype(dtype)
-    W = np.random.rand(out_channels, in_channels, kernel_height, kernel_width).astype(
-        dtype
+    nc_latency = benchmark_conv2d_kernel(
+        kernel, X_shape, W_shape, dtype, pool_size, profile=profile, fixtures=fixtures, seed=seed,
+        neff_store=neff_store, kernel_opts=kernel_opts, num_cores=num_cores,
     )
-    bias = np.random.rand(out_channels).astype(dtype)
+    p99_us = nc_latency.get_latency_percentile(99)
+    print(f"\n\nExecution Time for student implementation: {p99_us} μs")
 
-    args = [X, W, bias]
-    kwargs = {"pool_size": pool_size}
+    if report:
+        print("Cost model:")
+        print(format_report(analyze_conv(X_shape, W_shape, dtype, **kwargs, **kernel_opts), p99_us))
 
-    bench_kwargs = {}
-    if profile:
-        bench_kwargs = {
-            "save_neff_name": profile,
-            "additional_compile_opt": "--disable-dge",
-        }
-    bench_func = nki.benchmark(warmup=5, iters=20, **bench_kwargs)(kernel)
-    bench_func(*args, **kwargs)
-    p99_us = bench_func.benchmark_result.nc_latency.get_latency_percentile(99)
-    print(f"\n\nExecution Time for student implementation: {p99_us} μs")
+    if results_store is not None:
+        record_latency(
+            results_store, kernel, X_shape, W_shape, dtype, pool_size, nc_latency, kernel_opts=kernel_opts,
+            num_cores=num_cores, save_baseline=save_baseline, compare_baseline=compare_baseline,
+        )
 
-    if p99_us > (thresh := performance_requirements_by_dtype_size[(dtype, image_height)][0]):
+    if requirements is None:
+        print(f"No performance requirement for {kernel_height}x{kernel_width} filters")
+        return True, True
+    if p99_us > (thresh := requirements[0]):
         print(f"Performance requirement not met: must be under {thresh} μs")
         return False, False
-    elif p99_us > (thresh := performance_requirements_by_dtype_size[(dtype, image_height)][1]):
+    elif p99_us > (thresh := requirements[1]):
         print(f"Performance requirement partially met (90% credit): for full credit, must be under {thresh} μs")
         return True, False
     else:
         return True, True
 
 
+def benchmark_conv2d_kernel(
+    kernel, X_shape, W_shape, dtype, pool_size, profile=None, fixtures=None, seed=0, neff_store=None,
+    kernel_opts=None, num_cores=1,
+):
+    """Run the kernel under nki.benchmark on fresh (or cached) inputs and return its nc_latency."""
+    out_channels = W_shape[0]
+    if fixtures is not None:
+        X, W, bias = fixtures.inputs(seed, X_shape, W_shape, dtype, use_bias=True)
+    else:
+        X = np.random.rand(*X_shape).astype(dtype)
+        W = np.random.rand(*W_shape).astype(dtype)
+        bias = np.random.rand(out_channels).astype(dtype)
+
+    kernel_opts = kernel_opts or {}
+    if kernel_opts.get("prepacked"):
+        # packing is a one-off per set of weights, so it stays outside the timed call
+        W = baremetal(prepack_conv_weights)(W)
+    if kernel_opts.get("layout") == "NHWC":
+        X = to_nhwc(X)
+
+    bench_kwargs = {}
+    if profile:
+        bench_kwargs = {
+            "save_neff_name": profile,
+            "additional_compile_opt": "--disable-dge",
+        }
+    if neff_store is not None:
+        bench_func = neff_store.benchmark(kernel, warmup=5, iters=20, **bench_kwargs)
+    else:
+        bench_func = nki.benchmark(warmup=5, iters=20, **bench_kwargs)(kernel)
+    bench_func = spmd_launch(bench_func, num_cores)
+    bench_func(X, W, bias, pool_size=pool_size, **spmd_kernel_opts(kernel_opts, num_cores, X_shape[0], out_channels))
+    return bench_func.benchmark_result.nc_latency
+
+
+def to_nhwc(X):
+    """Channels-last copy of an NCHW array, as the kernel's layout="NHWC" takes it."""
+    return np.ascontiguousarray(X.transpose(0, 2, 3, 1))
+
+
+def record_latency(
+    results_store, kernel, X_shape, W_shape, dtype, pool_size, nc_latency, kernel_opts=None, num_cores=1,
+    save_baseline=False, compare_baseline=False,
+):
+    samples = latency_samples(nc_latency)
+    shape = X_shape + W_shape
+    # the options the kernel actually ran with, so e.g. the resolved shard_by is part of the key
+    config = {**spmd_kernel_opts(kernel_opts or {}, num_cores, X_shape[0], W_shape[0]), "num_cores": num_cores}
+    if compare_baseline:
+        print_baseline_comparison(results_store.compare(shape, dtype, pool_size, samples, config))
+    if samples is None:
+        print("No raw latency samples in this benchmark result; run not recorded")
+        return
+    results_store.record(
+        kernel_source_hash(kernel), shape, dtype, pool_size, samples, config=config, is_baseline=save_baseline
+    )
+
+
+def test_throughput_conv2d_kernel(
+    kernel,
+    batch_sizes=(1, 2, 4, 8, 16),
+    dtypes=(np.float32, np.float16),
+    in_channels=256,
+    out_channels=256,
+    image_height=224,
+    image_width=224,
+    kernel_height=3,
+    kernel_width=3,
+    pool_size=1,
+    fixtures=None,
+    seed=0,
+    neff_store=None,
+    kernel_opts=None,
+    num_cores=1,
+    results_store=None,
+):
+    """
+    Benchmark the kernel at every batch size and dtype, print latency, images/s
+    and TFLOP/s for each, and the batch size at which images/s saturates.
+
+    Returns the sweep rows and {dtype name: saturation batch size}.
+    """
+    kernel_opts = kernel_opts or {}
+    W_shape = (out_channels, in_channels, kernel_height, kernel_width)
+    points = []
+    saturation = {}
+    for dtype in dtypes:
+        dtype_points = []
+        for batch_size in batch_sizes:
+            X_shape = (batch_size, in_channels, image_height, image_width)
+            nc_latency = benchmark_conv2d_kernel(
+                kernel, X_shape, W_shape, dtype, pool_size, fixtures=fixtures, seed=seed,
+                neff_store=neff_store, kernel_opts=kernel_opts, num_cores=num_cores,
+            )
+            if results_store is not None:
+                record_latency(
+                    results_store, kernel, X_shape, W_shape, dtype, pool_size, nc_latency,
+                    kernel_opts=kernel_opts, num_cores=num_cores,
+                )
+            flops = analyze_conv(X_shape, W_shape, dtype, pool_size=pool_size, **kernel_opts)["flops"]
+            dtype_points.append(throughput_point(
+                batch_size, dtype_name(dtype), flops,
+                nc_latency.get_latency_percentile(50), nc_latency.get_latency_percentile(99),
+            ))
+        points.extend(dtype_points)
+        saturation[dtype_name(dtype)] = find_saturation(dtype_points)
+
+    print(format_throughput_table(points))
+    for name, saturated_at in saturation.items():
+        print(f"{name}: throughput saturates at batch size {saturated_at}")
+    return points, saturation
+
+
+def print_baseline_comparison(comparison):
+    verdict = comparison["verdict"]
+    if verdict == "no baseline":
+        print("No baseline recorded for this configuration")
+        return
+    if verdict == "inconclusive":
+        print("Baseline comparison: inconclusive (no raw latency samples to test)")
+        return
+    print(
+        f"Baseline comparison: {verdict} "
+        f"({comparison['change']:+.1%} median latency, p={comparison['p_value']:.2g})"
+    )
+
+
 def get_performance_score(test_result, total_score):
     relaxed_result, optimized_result = test_result
     if optimized_result:
@@ -159,21 +429,93 @@ def get_performance_score(test_result, total_score):
         return 0
 
 
+def parse_kernel_opts(opts):
+    """Turn ["row_reuse=True", "band_rows=8"] into keyword arguments for the kernel."""
+    kernel_opts = {}
+    for opt in opts:
+        name, _, value = opt.partition("=")
+        try:
+            kernel_opts[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            kernel_opts[name] = value
+    return kernel_opts
+
+
+def spmd_launch(kernel, num_cores):
+    """Launch an nki wrapper over `num_cores` NeuronCores, one SPMD program each."""
+    if num_cores == 1:
+        return kernel
+    return kernel[nl.nc(num_cores)]
+
+
+def spmd_kernel_opts(kernel_opts, num_cores, batch_size, out_channels):
+    """
+    kernel_opts for a launch over `num_cores` programs. Unless shard_by is set,
+    the kernel shards by batch when the images split evenly over the programs
+    and otherwise by output-channel tiles, e.g. for the batch_size=1 cases.
+    """
+    if num_cores == 1 or "shard_by" in kernel_opts:
+        return kernel_opts
+    if batch_size % num_cores == 0:
+        return {**kernel_opts, "shard_by": "batch"}
+    c_out_tiles, c_out_tail = divmod(out_channels, 128)
+    if c_out_tail == 0 and c_out_tiles % num_cores == 0 and kernel_opts.get("groups", 1) == 1:
+        return {**kernel_opts, "shard_by": "c_out"}
+    raise ValueError(
+        f"Neither batch_size={batch_size} nor out_channels={out_channels} split evenly over {num_cores} cores"
+    )
+
+
 # write a function g which when passed a function f, returns a new function that when called with some *args
 # and **kwargs, calls nki.simulate_kernel(f, *args, **kwargs) and returns the result
-def simulate_kernel_wrapper(kernel):
+def simulate_kernel_wrapper(kernel, num_cores=1):
     def temp_func(*args, **kwargs):
-        return nki.simulate_kernel(kernel, *args, **kwargs)
+        return nki.simulate_kernel(spmd_launch(kernel, num_cores), *args, **kwargs)
 
     return temp_func
 
 
+def run_correctness_case(simulate, harness_kwargs, test_case):
+    """Pool entry point: run one correctness case against this module's conv2d."""
+    return test_correctness_conv2d_kernel(conv2d, simulate=simulate, **harness_kwargs, **test_case)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
         "--test_maxpool", action="store_true", help="Run the kernel with pool_size=2"
     )
+    parser.add_argument(
+        "--test_conv_options",
+        action="store_true",
+        help="Also check padding, stride, dilation and the batch-stationary schedule against the reference",
+    )
+    parser.add_argument(
+        "--test_ragged_channels",
+        action="store_true",
+        help="Also check channel counts that are not multiples of 128",
+    )
+    parser.add_argument(
+        "--test_groups",
+        action="store_true",
+        help="Also check grouped and depthwise convolutions against torch's groups=",
+    )
+    parser.add_argument(
+        "--test_nhwc",
+        action="store_true",
+        help="Also check channels-last (layout=NHWC) inputs and outputs",
+    )
+    parser.add_argument(
+        "--test_filter_sizes",
+        action="store_true",
+        help="Also check 1x1, 5x5 and 7x7 filters, and benchmark them (unscored)",
+    )
+    parser.add_argument(
+        "--test_epilogue",
+        action="store_true",
+        help="Also check the fused activations and average pooling",
+    )
     parser.add_argument(
         "--profile", type=str, default=None, help="File to save the .neff file"
     )
@@ -186,12 +528,125 @@ if __name__ == "__main__":
         "--seed", type=int, default=42, help="Seed for random number generation"
     )
 
+    parser.add_argument(
+        "--kernel_opt",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Extra keyword argument for the kernel (e.g. row_reuse=True); may be repeated",
+    )
+
+    parser.add_argument(
+        "--fixture_dir",
+        type=str,
+        default=None,
+        help="Cache inputs and reference outputs as .npy files in this directory",
+    )
+    parser.add_argument(
+        "--fixture_cap_gb",
+        type=float,
+        default=16.0,
+        help="Evict least recently used fixtures beyond this many GiB",
+    )
+    parser.add_argument(
+        "--neff_store",
+        type=str,
+        default=None,
+        help="Keep compiled NEFFs, indexed by kernel source, shapes and dtypes, in this directory",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Run correctness cases ahead of time in this many worker processes, one NeuronCore each",
+    )
+    parser.add_argument(
+        "--num-cores",
+        "--num_cores",
+        dest="num_cores",
+        type=int,
+        default=1,
+        help="Launch the kernel over this many NeuronCores (SPMD). Shards by batch when the images split evenly, "
+        "else by output-channel tiles; --kernel_opt shard_by=... overrides",
+    )
+    parser.add_argument(
+        "--test_network",
+        action="store_true",
+        help="Also test fused_conv_network on a 3-layer stack against chained reference calls",
+    )
+    parser.add_argument(
+        "--test_low_precision",
+        action="store_true",
+        help="Also test bfloat16 and fp8 inputs for correctness, and benchmark them (unscored)",
+    )
+    parser.add_argument(
+        "--throughput",
+        action="store_true",
+        help="After the correctness tests, sweep batch sizes and dtypes and report images/s and TFLOP/s "
+             "instead of running the graded performance tests",
+    )
+    parser.add_argument(
+        "--throughput_batches",
+        type=str,
+        default="1,2,4,8,16",
+        help="Comma-separated batch sizes for --throughput",
+    )
+    parser.add_argument(
+        "--throughput_dtypes",
+        type=str,
+        default="float32,float16",
+        help=f"Comma-separated dtypes for --throughput, from {', '.join(DTYPES)}",
+    )
+    parser.add_argument(
+        "--results_db",
+        type=str,
+        default=None,
+        help="Record every performance run (raw latency samples) in this SQLite file",
+    )
+    parser.add_argument(
+        "--save_baseline",
+        action="store_true",
+        help="Mark this run's performance results as the baseline (requires --results_db)",
+    )
+    parser.add_argument(
+        "--compare_baseline",
+        "--compare-baseline",
+        action="store_true",
+        help="Flag significant latency changes against the latest baseline (requires --results_db)",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Print the analytic cost model (FLOPs, HBM bytes, roofline, MFU) for each performance test",
+    )
+
     args = parser.parse_args()
 
     np.random.seed(args.seed)
 
+    fixtures = None
+    if args.fixture_dir is not None:
+        fixtures = FixtureStore(args.fixture_dir, max_bytes=int(args.fixture_cap_gb * 2**30))
+    neff_store = NeffStore(args.neff_store) if args.neff_store is not None else None
+    harness_kwargs = {
+        "fixtures": fixtures,
+        "seed": args.seed,
+        "neff_store": neff_store,
+        "kernel_opts": parse_kernel_opts(args.kernel_opt),
+        "num_cores": args.num_cores,
+    }
+
+    if (args.save_baseline or args.compare_baseline) and args.results_db is None:
+        parser.error("--save_baseline and --compare_baseline require --results_db")
+    perf_kwargs = {
+        "results_store": ResultStore(args.results_db) if args.results_db is not None else None,
+        "save_baseline": args.save_baseline,
+        "compare_baseline": args.compare_baseline,
+        "report": args.report,
+    }
+
     if args.simulate:
-        conv2d = simulate_kernel_wrapper(conv2d)
+        conv2d = simulate_kernel_wrapper(conv2d, num_cores=args.num_cores)
 
     correctness_score = 0.0
     performance_score = 0.0
@@ -221,25 +676,209 @@ if __name__ == "__main__":
             "use_bias": True,
             "use_maxpool": True,
         })
-    
-    for test_case in correctness_tests:
+    # the cases above are graded; the opt-in ones below only report pass/fail
+    num_scored_tests = len(correctness_tests)
+
+    if args.test_conv_options:
+        for conv_opts in [
+            {"pad_size": 1},
+            {"stride": 2},
+            {"dilation": 2},
+            {"pad_size": 2, "stride": 2, "dilation": 2},
+            # the 32x16 images are too wide for batch_stationary=None to pick it
+            {"batch_stationary": True},
+            {"batch_stationary": True, "pad_size": 1},
+        ]:
+            correctness_tests.append({
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "conv_opts": conv_opts,
+            })
+
+    if args.test_ragged_channels:
+        for channels in [(3, 128), (128, 64), (200, 136)]:
+            correctness_tests.append({
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "channels": channels,
+            })
+
+    # (groups, channels): groups of whole tiles, several groups per tile, and
+    # depthwise (one channel per group), also with a partial tile and padding
+    group_cases = [
+        (2, None, {}),
+        (32, None, {}),
+        (128, (128, 128), {}),
+        (200, (200, 200), {"pad_size": 1}),
+    ]
+    if args.test_groups:
+        for groups, channels, conv_opts in group_cases:
+            test_case = {
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "conv_opts": {"groups": groups, **conv_opts},
+            }
+            if channels is not None:
+                test_case["channels"] = channels
+            correctness_tests.append(test_case)
+
+    # channels-last, including a partial channel tile and the 224-wide image,
+    # which the layout change splits into 128-column tiles
+    if args.test_nhwc:
+        for use_larger_images, channels, conv_opts in [
+            (False, None, {}),
+            (False, (200, 136), {"pad_size": 1}),
+            (True, None, {}),
+        ]:
+            test_case = {
+                "use_larger_images": use_larger_images,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "conv_opts": {"layout": "NHWC", **conv_opts},
+            }
+            if channels is not None:
+                test_case["channels"] = channels
+            correctness_tests.append(test_case)
+
+    # 1x1 runs as a GEMM; 5x5 and 7x7 stack their filter columns on the
+    # partitions when the input channels are few enough, as in a stem layer
+    filter_size_cases = [
+        ((1,), None),
+        ((5, 7), None),
+        ((5, 7), (16, 128)),
+        ((7,), (3, 64)),
+    ]
+    if args.test_filter_sizes:
+        for kernel_sizes, channels in filter_size_cases:
+            test_case = {
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "kernel_sizes": kernel_sizes,
+            }
+            if channels is not None:
+                test_case["channels"] = channels
+            correctness_tests.append(test_case)
+        correctness_tests.append({
+            "use_larger_images": True,
+            "use_bias": True,
+            "use_maxpool": args.test_maxpool,
+            "kernel_sizes": (1,),
+        })
+
+    # (pool the output, epilogue options): every activation, and average
+    # pooling with disjoint and overlapping windows. The weights and bias are
+    # drawn around zero, so the pre-activations take both signs
+    epilogue_cases = [
+        (args.test_maxpool, {"activation": "relu"}),
+        (args.test_maxpool, {"activation": "gelu"}),
+        (args.test_maxpool, {"activation": "silu"}),
+        (True, {"pool_type": "avg"}),
+        (True, {"pool_type": "avg", "pool_stride": 1}),
+        (True, {"activation": "relu", "pool_type": "avg"}),
+    ]
+    if args.test_epilogue:
+        for use_pool, conv_opts in epilogue_cases:
+            correctness_tests.append({
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": use_pool,
+                "conv_opts": conv_opts,
+                "centered": True,
+            })
+
+    # (input dtype, out_dtype); fp8 results are widened to bfloat16 on eviction
+    low_precision_cases = [
+        (DTYPES["bfloat16"], None),
+        (DTYPES["float8_e4m3"], "bfloat16"),
+        (DTYPES["float8_e5m2"], "bfloat16"),
+    ]
+    if args.test_low_precision:
+        for dtype, out_dtype in low_precision_cases:
+            correctness_tests.append({
+                "use_larger_images": False,
+                "use_bias": True,
+                "use_maxpool": args.test_maxpool,
+                "dtype": dtype,
+                "out_dtype": out_dtype,
+            })
+
+    correctness_results = None
+    if args.jobs > 1:
+        # core 0 (cores 0..num_cores-1 for SPMD launches) stays with the timed benchmarks
+        pool = make_compile_pool(args.jobs, first_core=args.num_cores, cores_per_job=args.num_cores)
+        correctness_results = run_ordered(
+            pool, run_correctness_case,
+            [(args.simulate, harness_kwargs, test_case) for test_case in correctness_tests],
+        )
+
+    unscored_passed = 0
+    for index, test_case in enumerate(correctness_tests):
+        scored = index < num_scored_tests
         print("\nRunning correctness test for conv2d kernel with "
               f"{'larger' if test_case['use_larger_images'] else 'smaller'} image"
               f"{' + bias' if test_case['use_bias'] else ''}"
               f"{' + maxpool' if test_case['use_maxpool'] else ''}"
-              f"{' [simulated]' if args.simulate else ''}...", end=" ", flush=True)
-            
-        test_result = test_correctness_conv2d_kernel(conv2d, simulate=args.simulate, **test_case)
+              f"{''.join(f' + {opt}={value}' for opt, value in test_case.get('conv_opts', {}).items())}"
+              f"{' + channels=%s->%s' % test_case['channels'] if 'channels' in test_case else ''}"
+              f"{''.join(f' + {size}x{size}' for size in test_case.get('kernel_sizes', ()))}"
+              f"{' + ' + dtype_name(test_case['dtype']) if 'dtype' in test_case else ''}"
+              f"{' -> ' + test_case['out_dtype'] if test_case.get('out_dtype') else ''}"
+              f"{' + centered weights' if test_case.get('centered') else ''}"
+              f"{' [simulated]' if args.simulate else ''}"
+              f"{'' if scored else ' [unscored]'}...", end=" ", flush=True)
+
+        if correctness_results is not None:
+            test_result = next(correctness_results)
+        else:
+            test_result = test_correctness_conv2d_kernel(conv2d, simulate=args.simulate, **harness_kwargs, **test_case)
         if test_result:
-            correctness_score += 2.5
+            if scored:
+                correctness_score += 2.5
+            else:
+                unscored_passed += 1
             print("Passed 😎")
         else:
             print("Failed 😢")
-    
-    if correctness_score < 2.5 * len(correctness_tests):
+
+    if correctness_results is not None:
+        pool.shutdown()
+
+    num_unscored_tests = len(correctness_tests) - num_scored_tests
+    if args.test_network:
+        num_unscored_tests += 1
+        print(f"\nRunning correctness test for a {len(NETWORK_TEST_LAYERS)}-layer conv network"
+              f"{' [simulated]' if args.simulate else ''} [unscored]...", end=" ", flush=True)
+        network = simulate_kernel_wrapper(fused_conv_network) if args.simulate else fused_conv_network
+        if test_correctness_conv_network(network, simulate=args.simulate, seed=args.seed, neff_store=neff_store):
+            unscored_passed += 1
+            print("Passed 😎")
+        else:
+            print("Failed 😢")
+
+    if num_unscored_tests:
+        print(f"\nUnscored correctness tests: {unscored_passed} / {num_unscored_tests} passed")
+
+    if correctness_score < 2.5 * num_scored_tests:
         print("Correctness failed, skipping performance tests.")
         exit()
     
+    # --------- THROUGHPUT SWEEP ---------
+    if args.throughput:
+        print("\nSweeping throughput...")
+        test_throughput_conv2d_kernel(
+            conv2d,
+            batch_sizes=[int(size) for size in args.throughput_batches.split(",")],
+            dtypes=[DTYPES[name] for name in args.throughput_dtypes.split(",")],
+            pool_size=2 if args.test_maxpool else 1,
+            results_store=perf_kwargs["results_store"],
+            **harness_kwargs,
+        )
+        exit()
+
     # --------- PERFORMANCE TESTS ---------
     performance_tests = [
         {
@@ -262,14 +901,14 @@ if __name__ == "__main__":
     
     for test_case in performance_tests:
         pool_str = "with maxpool" if test_case['pool_size'] == 2 else "no maxpool"
-        dtype_str = "float16" if test_case['dtype'] == np.float16 else "float32"
+        dtype_str = dtype_name(test_case['dtype'])
         print(f"\nComparing performance with reference kernel ({pool_str}, {dtype_str})...", end=" ", flush=True)
 
         profile = None
         if args.profile is not None:
             profile = f"{args.profile}{'_pool' if test_case['pool_size'] == 2 else ''}_{dtype_str}.neff"
         
-        test_result = test_performance_conv2d_kernel(conv2d, profile=profile, **test_case)
+        test_result = test_performance_conv2d_kernel(conv2d, profile=profile, **harness_kwargs, **perf_kwargs, **test_case)
         performance_score += get_performance_score(test_result, 17.5 if test_case['pool_size'] == 1 else 7.5)
 
         if profile:
@@ -279,7 +918,7 @@ if __name__ == "__main__":
     ec_tests = [test | {"image_height": 32, "image_width": 16} for test in performance_tests]
     for test_case in ec_tests:
         pool_str = "with maxpool" if test_case['pool_size'] == 2 else "no maxpool"
-        dtype_str = "float16" if test_case['dtype'] == np.float16 else "float32"
+        dtype_str = dtype_name(test_case['dtype'])
         print(f"\nComparing performance with reference kernel ({pool_str},"
               f" {dtype_str}, smaller image)... [EC] ", end=" ", flush=True)
 
@@ -287,12 +926,40 @@ if __name__ == "__main__":
         if args.profile is not None:
             profile = f"{args.profile}{'_pool' if test_case['pool_size'] == 2 else ''}_{dtype_str}_smaller.neff"
         
-        test_result = test_performance_conv2d_kernel(conv2d, profile=profile, **test_case)
+        test_result = test_performance_conv2d_kernel(conv2d, profile=profile, **harness_kwargs, **perf_kwargs, **test_case)
         ec += get_performance_score(test_result, 1.25)
 
         if profile:
             save_trace(profile.replace(".neff", ""))
     
+    # --------- LOW PRECISION (UNSCORED) ---------
+    if args.test_low_precision:
+        # with the same out_dtype as the correctness cases: fp8 outputs of
+        # these all-positive inputs would saturate past the e4m3 maximum
+        for dtype, out_dtype in low_precision_cases:
+            for test_case in performance_tests:
+                if test_case["dtype"] != np.float16:
+                    continue
+                test_case = test_case | {"dtype": dtype, "out_dtype": out_dtype}
+                pool_str = "with maxpool" if test_case['pool_size'] == 2 else "no maxpool"
+                precision_str = dtype_name(dtype) + (f" -> {out_dtype}" if out_dtype else "")
+                print(f"\nComparing performance with reference kernel ({pool_str}, {precision_str})... [unscored] ",
+                      end=" ", flush=True)
+                test_result = test_performance_conv2d_kernel(conv2d, **harness_kwargs, **perf_kwargs, **test_case)
+                get_performance_score(test_result, 0)
+
+    # --------- FILTER SIZES (UNSCORED) ---------
+    if args.test_filter_sizes:
+        # (in_channels, out_channels, filter size) on the larger image
+        for in_channels, out_channels, size in [(256, 256, 1), (256, 256, 5), (3, 64, 7)]:
+            print(f"\nTiming {size}x{size} filters, channels={in_channels}->{out_channels} (float16)... [unscored] ",
+                  end=" ", flush=True)
+            test_result = test_performance_conv2d_kernel(
+                conv2d, dtype=np.float16, in_channels=in_channels, out_channels=out_channels,
+                kernel_height=size, kernel_width=size, **harness_kwargs, **perf_kwargs,
+            )
+            get_performance_score(test_result, 0)
+
     print(
         f"Your final score is {'' if args.test_maxpool else '(without maxpool)'}: ",
         f"{correctness_score + performance_score + ec} / {60.0 if args.test_maxpool else 42.5}"
@@ -303,4 +970,6 @@ if __name__ == "__main__":
     print(
         f"Performance: {performance_score}\tTotal obtainable: {50.0 if args.test_maxpool else 35}"
     )
-    print(f"Extra Credit: {ec}\tTotal obtainable: {5.0 if args.test_maxpool else 2.5}")
\ No newline at end of file
+    print(f"Extra Credit: {ec}\tTotal obtainable: {5.0 if args.test_maxpool else 2.5}")
+    if neff_store is not None:
+        print(neff_store.stats())
\ No newline at end of file
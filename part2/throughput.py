@@ -0,0 +1,45 @@
+"""
+Throughput sweep for the conv kernel.
+
+The harness benchmarks the kernel at a range of batch sizes (and dtypes);
+this module turns the measured latencies into images/s and TFLOP/s and finds
+the batch size where throughput saturates, i.e. where larger batches only add
+latency.
+"""
+
+
+def throughput_point(batch_size, dtype, flops, p50_us, p99_us):
+    """One row of the sweep. Throughput uses the median latency, as sustained serving would see."""
+    seconds = p50_us * 1e-6
+    return {
+        "batch_size": batch_size,
+        "dtype": dtype,
+        "p50_us": p50_us,
+        "p99_us": p99_us,
+        "images_per_s": batch_size / seconds,
+        "tflops": flops / seconds / 1e12,
+    }
+
+
+def find_saturation(points, tolerance=0.05):
+    """
+    Smallest batch size whose images/s is within `tolerance` of the best seen.
+
+    `points` are the sweep rows of one dtype. Returns None for an empty sweep.
+    """
+    if not points:
+        return None
+    best = max(point["images_per_s"] for point in points)
+    for point in sorted(points, key=lambda point: point["batch_size"]):
+        if point["images_per_s"] >= (1 - tolerance) * best:
+            return point["batch_size"]
+
+
+def format_throughput_table(points):
+    lines = [f"{'dtype':>8} {'batch':>6} {'p50 μs':>10} {'p99 μs':>10} {'images/s':>10} {'TFLOP/s':>8}"]
+    for point in points:
+        lines.append(
+            f"{point['dtype']:>8} {point['batch_size']:>6} {point['p50_us']:>10.1f} {point['p99_us']:>10.1f} "
+            f"{point['images_per_s']:>10.1f} {point['tflops']:>8.2f}"
+        )
+    return "\n".join(lines)